@@ -0,0 +1,183 @@
+"""
+Times each stage of an export of the busiest chat of a synthetic chat.db, from opening the database to copying the
+attachments, and writes the times to a JSON report. Given the report of an earlier run, it shows how much faster or
+slower each stage is.
+
+    python benchmarks/end_to_end_benchmark.py --messages 200000 --report after.json --compare before.json
+
+The database is made by tests/synthetic_chat_db.py, or one that already exists can be given with --database.
+"""
+
+import argparse
+import configparser
+import json
+import os
+import platform
+import resource
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import imessagedb
+from imessagedb.attachments import Attachments
+from imessagedb.conversion_pool import ConversionPool
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'tests'))
+from synthetic_chat_db import create_chat_db
+
+REPORT_VERSION = 1
+
+
+class Stages:
+    """ Times the stages, in wall clock and CPU seconds """
+
+    def __init__(self) -> None:
+        self._stages = {}
+
+    def run(self, name: str, function, rows=None):
+        """ Run a stage, returning what the function returns. The rows are the number of things the stage
+        handled, or a function that counts them from the result. """
+        start = time.perf_counter()
+        cpu_start = time.process_time()
+        result = function()
+        seconds = time.perf_counter() - start
+        cpu = time.process_time() - cpu_start
+        if callable(rows):
+            rows = rows(result)
+        self._stages[name] = {'seconds': seconds, 'cpu_seconds': cpu, 'rows': rows,
+                              'rows_per_second': rows / seconds if rows and seconds else None}
+        return result
+
+    @property
+    def stages(self) -> dict:
+        return self._stages
+
+
+def busiest_chat(filename: str) -> int:
+    connection = sqlite3.connect(filename)
+    (chat_id,) = connection.execute("select chat_id from chat_message_join "
+                                    "group by chat_id order by count(*) desc limit 1").fetchone()
+    connection.close()
+    return chat_id
+
+
+def run(filename: str, directory: str, chat_id: int, jobs: int) -> dict:
+    config = configparser.ConfigParser()
+    config.read_string(imessagedb.DEFAULT_CONFIGURATION)
+    # The attachments are copied in a stage of their own, so the html stage only lays them out
+    config.set('CONTROL', 'copy', 'False')
+    config.set('CONTROL', 'conversion cache', 'False')
+    config.set('CONTROL', 'jobs', str(jobs))
+    stages = Stages()
+
+    database = stages.run('open', lambda: imessagedb.DB(filename, config=config))
+    stages.run('preload', lambda: len(database.handles) + len(database.chats), lambda i: i)
+    messages = stages.run('fetch', lambda: database.Messages('chat', 'Benchmark', chat_id=chat_id), len)
+
+    def decode() -> int:
+        for message in messages:
+            message.text
+            message.edits
+        return len(messages)
+    stages.run('decode', decode, lambda i: i)
+    stages.run('html', lambda: database.HTMLOutput('Me', messages, output_file=os.path.join(directory, 'chat')),
+               len(messages))
+    def text() -> None:
+        with open(os.path.join(directory, 'chat.txt'), 'w') as file:
+            database.TextOutput('Me', messages, output_file=file).save()
+    stages.run('text', text, len(messages))
+
+    def copy_attachments() -> int:
+        copy_directory = os.path.join(directory, 'attachments')
+        os.makedirs(copy_directory, exist_ok=True)
+        attachments = Attachments(database, copy=True, copy_directory=copy_directory,
+                                  message_ids=[i.rowid for i in messages if i.attachments])
+        pool = ConversionPool(jobs=jobs)
+        for attachment in attachments.attachment_list.values():
+            if not attachment.skip and not attachment.missing:
+                pool.submit(attachment)
+        pool.wait()
+        return pool.processed
+    stages.run('attachments', copy_attachments, lambda i: i)
+
+    database.disconnect()
+    return stages.stages
+
+
+def compare(report: dict, previous: dict) -> None:
+    print(f"\n{'Stage':<12s} {'Before':>10s} {'After':>10s} {'Speedup':>8s}")
+    for (name, stage) in report['stages'].items():
+        before = previous['stages'].get(name)
+        if before is None:
+            continue
+        speedup = before['seconds'] / stage['seconds'] if stage['seconds'] else float('inf')
+        print(f"{name:<12s} {before['seconds']:>10.3f} {stage['seconds']:>10.3f} {speedup:>7.2f}x")
+
+
+def main() -> None:
+    argument_parser = argparse.ArgumentParser()
+    argument_parser.add_argument('--messages', type=int, default=100000, help="The number of messages to generate")
+    argument_parser.add_argument('--handles', type=int, default=50, help="The number of handles to generate")
+    argument_parser.add_argument('--attachment-rate', type=float, default=0.02,
+                                 help="The share of the messages with an attachment")
+    argument_parser.add_argument('--database', help="A database to use instead of generating one")
+    argument_parser.add_argument('--chat', type=int, help="The chat to export, default is the busiest one")
+    argument_parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1,
+                                 help="The number of attachments to copy at the same time")
+    argument_parser.add_argument('--report', default='benchmark_report.json', help="Where to write the report")
+    argument_parser.add_argument('--compare', help="The report of an earlier run to compare with")
+    args = argument_parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        generated = None
+        filename = args.database
+        if filename is None:
+            filename = os.path.join(directory, 'chat.db')
+            start = time.perf_counter()
+            counts = create_chat_db(filename, messages=args.messages, handles=args.handles,
+                                    attachment_directory=os.path.join(directory, 'source'),
+                                    attachment_rate=args.attachment_rate)
+            generated = {'seconds': time.perf_counter() - start, 'rows': counts}
+        chat_id = args.chat if args.chat is not None else busiest_chat(filename)
+
+        output_directory = os.path.join(directory, 'output')
+        os.makedirs(output_directory)
+        stages = run(filename, output_directory, chat_id, args.jobs)
+
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    report = {
+        'version': REPORT_VERSION,
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'imessagedb': imessagedb.__version__,
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'database': args.database,
+        'generated': generated,
+        'chat': chat_id,
+        'stages': stages,
+        'total_seconds': sum(i['seconds'] for i in stages.values()),
+        'peak_rss': rss if sys.platform == 'darwin' else rss * 1024,
+    }
+    with open(args.report, 'w') as file:
+        json.dump(report, file, indent=2)
+
+    print(f"\n{'Stage':<12s} {'Seconds':>10s} {'CPU':>10s} {'Rows':>10s} {'Rows/sec':>12s}")
+    for (name, stage) in stages.items():
+        rate = f"{stage['rows_per_second']:>12,.0f}" if stage['rows_per_second'] else f"{'':>12s}"
+        rows = f"{stage['rows']:>10,}" if stage['rows'] is not None else f"{'':>10s}"
+        print(f"{name:<12s} {stage['seconds']:>10.3f} {stage['cpu_seconds']:>10.3f} {rows} {rate}")
+    print(f"{'total':<12s} {report['total_seconds']:>10.3f}, peak RSS {report['peak_rss'] / 2 ** 20:,.1f} MiB, "
+          f"report in {args.report}")
+
+    if args.compare:
+        with open(args.compare) as file:
+            compare(report, json.load(file))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Compares reading the messages of a conversation one row at a time, with a separate count query
+(the way Messages used to do it), against batched fetchmany with the count from the chat_message_join index.
+
+    python benchmarks/fetch_benchmark.py --rows 2000000 --fetch-size 1000
+"""
+
+import argparse
+import configparser
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+import imessagedb
+from imessagedb.messages import _build_message_query
+from imessagedb.utils import fetch_rows
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'tests'))
+from synthetic_chat_db import create_schema
+
+
+def create_database(filename: str, rows: int) -> None:
+    """ Create a chat.db with the real schema and one chat with the given number of messages """
+    connection = sqlite3.connect(filename)
+    create_schema(connection)
+    connection.execute("insert into handle (ROWID, id, service) values (1, 'bench@example.com', 'iMessage')")
+    connection.execute("insert into chat (ROWID, guid, chat_identifier) values (1, 'bench', 'bench@example.com')")
+    connection.execute("insert into chat_handle_join (chat_id, handle_id) values (1, 1)")
+    connection.executemany("insert into message (ROWID, guid, text, handle_id, date, is_from_me) "
+                           "values (?, ?, ?, 1, ?, ?)",
+                           ((i, f'guid-{i}', f'Message number {i}', i * 1000000000, i % 2)
+                            for i in range(1, rows + 1)))
+    connection.executemany("insert into chat_message_join (chat_id, message_id, message_date) values (1, ?, ?)",
+                           ((i, i * 1000000000) for i in range(1, rows + 1)))
+    connection.commit()
+    connection.close()
+
+
+def fetch_one_at_a_time(database: imessagedb.DB, select_string: str, where_clause: str, parameters: dict) -> int:
+    cursor = database.connection
+    cursor.execute(f"select count (*) from message where {where_clause}")
+    cursor.fetchone()
+    cursor.execute(select_string, parameters)
+    count = 0
+    row = cursor.fetchone()
+    while row:
+        count += 1
+        row = cursor.fetchone()
+    return count
+
+
+def fetch_in_batches(database: imessagedb.DB, select_string: str, count_string: str, parameters: dict,
+                     fetch_size: int) -> int:
+    cursor = database.connection
+    cursor.execute(count_string, parameters)
+    cursor.fetchone()
+    cursor.execute(select_string, parameters)
+    count = 0
+    for _ in fetch_rows(cursor, fetch_size):
+        count += 1
+    return count
+
+
+def main() -> None:
+    argument_parser = argparse.ArgumentParser()
+    argument_parser.add_argument('--rows', type=int, default=2000000, help="The number of messages to create")
+    argument_parser.add_argument('--fetch-size', type=int, default=1000, help="The number of rows per fetch")
+    args = argument_parser.parse_args()
+
+    config = configparser.ConfigParser()
+    config.read_string(imessagedb.DEFAULT_CONFIGURATION)
+    config.set('CONTROL', 'skip attachments', 'True')
+
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, 'chat.db')
+        print(f"Creating a database with {args.rows:,} messages")
+        create_database(filename, args.rows)
+
+        database = imessagedb.DB(filename, config=config)
+        (select_string, count_string, _, parameters) = _build_message_query(database, 'chat', chat_id=1)
+        where_clause = "rowid in (select message_id from chat_message_join where chat_id = 1)"
+
+        start = time.perf_counter()
+        count = fetch_one_at_a_time(database, select_string, where_clause, parameters)
+        before = time.perf_counter() - start
+        print(f"fetchone + count query: {count:,} rows in {before:.2f}s ({count / before:,.0f} rows/sec)")
+
+        start = time.perf_counter()
+        count = fetch_in_batches(database, select_string, count_string, parameters, args.fetch_size)
+        after = time.perf_counter() - start
+        print(f"fetchmany({args.fetch_size}) + index count: {count:,} rows in {after:.2f}s "
+              f"({count / after:,.0f} rows/sec)")
+        database.disconnect()
+
+
+if __name__ == '__main__':
+    main()
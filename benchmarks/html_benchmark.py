@@ -0,0 +1,110 @@
+"""
+Measures how fast the html is written, in rows per second, and how much memory it takes, for conversations of
+different lengths, and how much faster split output is when its pages are rendered in more than one process.
+Each run is in its own process, so the peak RSS is for that run alone.
+
+    python benchmarks/html_benchmark.py --messages 20000 100000 --page-processes 4
+"""
+
+import argparse
+import configparser
+import os
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import imessagedb
+
+from fetch_benchmark import create_database
+from message_benchmark import create_rows
+
+
+def create_threads(filename: str, count: int) -> None:
+    """ Put the text in attributedBody with an edit in one message in 20, the way Messages does, make one message
+    in ten a reply to the message five before it, and spread them out to 144 a day """
+    connection = sqlite3.connect(filename)
+    connection.executemany("update message set text = null, attributedBody = ?, message_summary_info = ? "
+                           "where ROWID = ?", ((row[5], row[6], row[0] + 1) for row in create_rows(count)))
+    connection.execute("update message set thread_originator_guid = 'guid-' || (ROWID - 5) "
+                       "where ROWID % 10 = 0")
+    connection.execute("update message set date = ROWID * 600000000000")
+    connection.execute("update chat_message_join set message_date = message_id * 600000000000")
+    connection.commit()
+    connection.close()
+
+
+def run(filename: str, directory: str, retain: bool, trace: bool, page_processes: int) -> None:
+    """ Write the html for the conversation, and print the rows/sec, the peak traced while it is written (which
+    includes the text that is decoded for it) and the peak RSS """
+    config = configparser.ConfigParser()
+    config.read_string(imessagedb.DEFAULT_CONFIGURATION)
+    config.set('CONTROL', 'skip attachments', 'True')
+    config.set('CONTROL', 'retain html', str(retain))
+    config.set('CONTROL', 'page processes', str(page_processes))
+    config.set('DISPLAY', 'split output', '1000')
+
+    database = imessagedb.DB(filename, config=config)
+    messages = database.Messages('chat', 'Benchmark', chat_id=1)
+
+    if trace:
+        tracemalloc.start()
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    database.HTMLOutput('Me', messages, output_file=os.path.join(directory, 'benchmark'))
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu_start
+    peak = 0
+    if trace:
+        (_, peak) = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    database.disconnect()
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    rss = rss if sys.platform == 'darwin' else rss * 1024
+    print(f"{len(messages) / elapsed} {len(messages) / cpu} {peak} {rss}")
+
+
+def measure(filename: str, directory: str, retain: bool, trace: bool, page_processes: int = 0) -> list:
+    output = subprocess.run([sys.executable, __file__, '--run', filename, directory, str(retain), str(trace),
+                             str(page_processes)], check=True, capture_output=True, text=True).stdout
+    return [float(i) for i in output.split()[-4:]]
+
+
+def main() -> None:
+    argument_parser = argparse.ArgumentParser()
+    argument_parser.add_argument('--messages', type=int, nargs='+', default=[20000, 100000],
+                                 help="The number of messages in each conversation")
+    argument_parser.add_argument('--page-processes', type=int, default=4,
+                                 help="The number of processes to render the pages in")
+    argument_parser.add_argument('--run', nargs=5, help=argparse.SUPPRESS)
+    args = argument_parser.parse_args()
+
+    if args.run:
+        (filename, directory, retain, trace, page_processes) = args.run
+        run(filename, directory, retain == 'True', trace == 'True', int(page_processes))
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        for count in args.messages:
+            filename = os.path.join(directory, f'chat_{count}.db')
+            create_database(filename, count)
+            create_threads(filename, count)
+            for retain in (True, False):
+                (rate, _, _, rss) = measure(filename, directory, retain, False)
+                (_, _, peak, _) = measure(filename, directory, retain, True)
+                name = "retained copy" if retain else "streamed"
+                print(f"{count:>9,} messages, {name:<14s} {rate:>10,.0f} rows/sec, "
+                      f"traced peak {peak / 2 ** 20:>7,.1f} MiB, process peak RSS {rss / 2 ** 20:>7,.1f} MiB")
+            # With enough cores, the rate is limited by how fast this process can lay out the pages
+            (rate, cpu_rate, _, rss) = measure(filename, directory, False, False, args.page_processes)
+            print(f"{count:>9,} messages, {args.page_processes} processes {rate:>10,.0f} rows/sec, "
+                  f"{cpu_rate:>10,.0f} rows/sec of this process's CPU time, "
+                  f"process peak RSS {rss / 2 ** 20:>7,.1f} MiB (not counting the page processes)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Compares the memory used to hold a conversation as Message objects (the way Messages does) and in a MessageStore.
+
+    python benchmarks/memory_benchmark.py --messages 200000
+"""
+
+import argparse
+import os
+import sqlite3
+import tempfile
+import tracemalloc
+
+from imessagedb.message import Message
+from imessagedb.message_store import MessageStore
+
+from message_benchmark import create_rows
+
+
+def read_rows(filename: str):
+    """ Read the rows back, so each one is new, the way they are when they come from chat.db """
+    connection = sqlite3.connect(filename)
+    cursor = connection.execute('select * from message order by rowid')
+    rows = cursor.fetchmany(1000)
+    while rows:
+        yield from rows
+        rows = cursor.fetchmany(1000)
+    connection.close()
+
+
+def as_messages(filename: str, decode: bool) -> tuple:
+    messages = []
+    guids = {}
+    for row in read_rows(filename):
+        message = Message(None, *row, None)
+        guids[message.guid] = message
+        messages.append(message)
+    if decode:
+        for message in messages:
+            message.text
+            message.edits
+    return messages, guids
+
+
+def as_store(filename: str) -> MessageStore:
+    store = MessageStore()
+    for row in read_rows(filename):
+        store.append(row)
+    store.finish()
+    return store
+
+
+def measure(name: str, function, count: int, text_bytes: int) -> None:
+    tracemalloc.start()
+    result = function()
+    (current, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:<40s} {current / count:>8,.0f} bytes/message, {(current - text_bytes) / count:>6,.0f} "
+          f"without the text (peak {peak / count:,.0f})")
+    del result
+
+
+def main() -> None:
+    argument_parser = argparse.ArgumentParser()
+    argument_parser.add_argument('--messages', type=int, default=200000, help="The number of messages")
+    args = argument_parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, 'rows.db')
+        connection = sqlite3.connect(filename)
+        connection.execute('create table message (rowid, guid, date, is_from_me, handle_id, attributed_body, '
+                           'message_summary_info, text, reply_to_guid, thread_originator_guid, '
+                           'thread_originator_part, chat_id)')
+        connection.executemany('insert into message values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                               create_rows(args.messages))
+        connection.commit()
+        connection.close()
+
+        # The UTF-8 text has to be kept one way or another, so it is taken out to show the overhead
+        text_bytes = sum(len(i.text.encode('utf-8')) for i in as_store(filename))
+
+        measure("Message objects", lambda: as_messages(filename, False), args.messages, text_bytes)
+        measure("Message objects, text and edits read", lambda: as_messages(filename, True), args.messages,
+                text_bytes)
+        measure("MessageStore", lambda: as_store(filename), args.messages, text_bytes)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Measures how fast Messages are built from rows, and what decoding the text and the edits adds when they are used.
+
+    python benchmarks/message_benchmark.py --messages 200000
+"""
+
+import argparse
+import plistlib
+import random
+import time
+
+from imessagedb.message import Message
+
+from typedstream_benchmark import create_bodies
+
+
+def create_rows(count: int) -> list:
+    """ Create message rows with the body in attributedBody, and an edit in one message in 20 """
+    bodies = create_bodies(count)
+    plain = plistlib.dumps({'ust': True}, fmt=plistlib.FMT_BINARY)
+    random.seed(2)
+    rows = []
+    for (i, body) in enumerate(bodies):
+        if random.random() < 0.05:
+            summary_info = plistlib.dumps({'ust': True, 'ec': {'0': [{'t': bodies[i - 1], 'd': 700000000.0}]}},
+                                          fmt=plistlib.FMT_BINARY)
+        else:
+            summary_info = plain
+        rows.append((i, f'guid-{i}', 700000000 * 1000000000, i % 2, 1, body, summary_info, None, None, None, None, 1))
+    return rows
+
+
+def measure(name: str, function, rows: list) -> None:
+    start = time.perf_counter()
+    function(rows)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<36s} {len(rows) / elapsed:>12,.0f} messages/sec")
+
+
+def unpack(rows: list) -> None:
+    for row in rows:
+        (rowid, guid, date, is_from_me, handle_id, attributed_body, message_summary_info, text,
+         reply_to_guid, thread_originator_guid, thread_originator_part, chat_id) = row
+
+
+def construct(rows: list) -> list:
+    return [Message(None, *row, None) for row in rows]
+
+
+def construct_and_text(rows: list) -> None:
+    for message in construct(rows):
+        message.text
+
+
+def construct_text_and_edits(rows: list) -> None:
+    for message in construct(rows):
+        message.text
+        message.edits
+
+
+def main() -> None:
+    argument_parser = argparse.ArgumentParser()
+    argument_parser.add_argument('--messages', type=int, default=200000, help="The number of messages to build")
+    args = argument_parser.parse_args()
+
+    rows = create_rows(args.messages)
+    measure("tuple unpack", unpack, rows)
+    measure("Message", construct, rows)
+    measure("Message + text", construct_and_text, rows)
+    measure("Message + text + edits (the old cost)", construct_text_and_edits, rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Compares the read throughput of the ways the database can be opened ('open mode'), with and without the
+cache_size, mmap_size and temp_store pragmas.
+
+    python benchmarks/open_benchmark.py --rows 1000000 --repeat 3
+"""
+
+import argparse
+import configparser
+import os
+import tempfile
+import time
+
+import imessagedb
+from imessagedb.messages import _build_message_query
+from imessagedb.utils import fetch_rows
+
+from fetch_benchmark import create_database
+
+MODES = ['readwrite', 'readonly', 'immutable', 'snapshot', 'snapshot file']
+
+
+def read_messages(filename: str, mode: str, pragmas: bool) -> tuple:
+    """ Open the database and read the whole conversation, returning the open time, read time and row count """
+    config = configparser.ConfigParser()
+    config.read_string(imessagedb.DEFAULT_CONFIGURATION)
+    config.set('CONTROL', 'skip attachments', 'True')
+    if mode == 'snapshot file':
+        mode = 'snapshot'
+        config.set('CONTROL', 'snapshot in memory', 'False')
+    config.set('CONTROL', 'open mode', mode)
+    if not pragmas:
+        for option in ('cache size', 'mmap size', 'temp store'):
+            config.remove_option('CONTROL', option)
+
+    start = time.perf_counter()
+    database = imessagedb.DB(filename, config=config)
+    opened = time.perf_counter() - start
+
+    (select_string, count_string, _, parameters) = _build_message_query(database, 'chat', chat_id=1)
+    start = time.perf_counter()
+    cursor = database.connection
+    cursor.execute(count_string, parameters)
+    cursor.fetchone()
+    cursor.execute(select_string, parameters)
+    count = 0
+    for _ in fetch_rows(cursor, 1000):
+        count += 1
+    read = time.perf_counter() - start
+
+    database.disconnect()
+    return opened, read, count
+
+
+def main() -> None:
+    argument_parser = argparse.ArgumentParser()
+    argument_parser.add_argument('--rows', type=int, default=1000000, help="The number of messages to create")
+    argument_parser.add_argument('--repeat', type=int, default=3, help="The number of times to read each way")
+    args = argument_parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, 'chat.db')
+        print(f"Creating a database with {args.rows:,} messages")
+        create_database(filename, args.rows)
+
+        print(f"{'open mode':<14s} {'pragmas':<8s} {'open':>8s} {'read':>8s} {'rows/sec':>12s}")
+        for pragmas in (False, True):
+            for mode in MODES:
+                # Take the best of the runs, so the page cache of the operating system is warm for every mode
+                (opened, read, count) = min((read_messages(filename, mode, pragmas) for _ in range(args.repeat)),
+                                            key=lambda x: x[0] + x[1])
+                print(f"{mode:<14s} {str(pragmas):<8s} {opened:>7.2f}s {read:>7.2f}s {count / read:>12,.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""
+Measures how long the search index takes to build, to bring up to date when there is nothing new, and to search.
+The messages are made of a few common words, so most queries match a lot of them, and ranking the matches is most
+of the time a query takes.
+
+    python benchmarks/search_benchmark.py --messages 100000
+"""
+
+import argparse
+import configparser
+import os
+import sqlite3
+import statistics
+import tempfile
+import time
+
+import imessagedb
+from imessagedb.search_index import SearchIndex, _match_string
+
+from fetch_benchmark import create_database
+from html_benchmark import create_threads
+
+QUERIES = ['lunch', 'dinner great', 'caf*', 'on my way', 'example.com', 'today sure ok']
+
+
+def main() -> None:
+    argument_parser = argparse.ArgumentParser()
+    argument_parser.add_argument('--messages', type=int, default=100000, help="The number of messages")
+    argument_parser.add_argument('--repeat', type=int, default=20, help="The number of times to run each query")
+    args = argument_parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, 'chat.db')
+        create_database(filename, args.messages)
+        create_threads(filename, args.messages)
+
+        config = configparser.ConfigParser()
+        config.read_string(imessagedb.DEFAULT_CONFIGURATION)
+        config.set('CONTROL', 'search index', os.path.join(directory, 'search.db'))
+        database = imessagedb.DB(filename, config=config)
+        index = SearchIndex(database)
+
+        start = time.perf_counter()
+        index.update()
+        elapsed = time.perf_counter() - start
+        print(f"Build {elapsed:>8.2f} sec, {args.messages / elapsed:>10,.0f} messages/sec, "
+              f"index {os.path.getsize(index.filename) / 2 ** 20:,.1f} MiB")
+
+        start = time.perf_counter()
+        index.update()
+        print(f"Update with nothing new {(time.perf_counter() - start) * 1000:>8.2f} ms")
+
+        # The handles and chats are loaded once, the first time
+        index.search(QUERIES[0])
+        connection = sqlite3.connect(index.filename)
+        for query in QUERIES:
+            (matches,) = connection.execute("select count(*) from message_text where message_text match ?",
+                                            (_match_string(query),)).fetchone()
+            times = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                hits = index.search(query)
+                times.append(time.perf_counter() - start)
+            print(f"{query!r:<18s} {matches:>8,} matches, {len(hits):>4} hits, "
+                  f"median {statistics.median(times) * 1000:>8.2f} ms")
+        connection.close()
+        index.close()
+        database.disconnect()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+Compares counting the messages by month in the database with loading the conversation and counting them, and
+the stats of a loaded conversation as a dict per message, in columns, and written straight to a file.
+
+    python benchmarks/stats_benchmark.py --messages 100000
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from collections import Counter
+
+import imessagedb
+from imessagedb.stats import ConversationStats, write_stats
+
+from fetch_benchmark import create_database
+from html_benchmark import create_threads
+
+
+def count_loaded(database: imessagedb.DB) -> Counter:
+    messages = database.Messages('chat', 'Benchmark', chat_id=1)
+    counts = Counter()
+    for message in messages:
+        counts[message.date[:7]] += len(message.text or '')
+    return counts
+
+
+def measure(name: str, function, argument, count: int) -> None:
+    start = time.perf_counter()
+    function(argument)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<26s} {elapsed:>8.2f} sec, {count / elapsed:>10,.0f} messages/sec")
+
+
+def write_tsv(database: imessagedb.DB, messages) -> None:
+    with open(os.devnull, 'w', newline='') as file:
+        write_stats(database, messages, file)
+
+
+def main() -> None:
+    argument_parser = argparse.ArgumentParser()
+    argument_parser.add_argument('--messages', type=int, default=100000, help="The number of messages")
+    args = argument_parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, 'chat.db')
+        create_database(filename, args.messages)
+        create_threads(filename, args.messages)
+        database = imessagedb.DB(filename)
+        database.control['skip attachments'] = 'True'
+
+        for (name, function) in (("Loaded messages", count_loaded),
+                                 ("DatabaseStats by chat", lambda i: i.DatabaseStats('chat', 'month').stats()),
+                                 ("DatabaseStats by person", lambda i: i.DatabaseStats('person', 'month').stats())):
+            measure(name, function, database, args.messages)
+
+        # The text is decoded once, so each of these only measures the stats
+        messages = database.Messages('chat', 'Benchmark', chat_id=1)
+        for message in messages:
+            message.text
+        print()
+        for (name, function) in (("Messages.stats", lambda i: i.stats()),
+                                 ("Messages.print_stats", lambda i: i.print_stats()),
+                                 ("ConversationStats", lambda i: ConversationStats(database, i)),
+                                 ("write_stats", lambda i: write_tsv(database, i))):
+            measure(name, function, messages, args.messages)
+        stats = ConversationStats(database, messages)
+        for (name, function) in (("reply_latency", lambda i: i.reply_latency()),
+                                 ("messages_per_day", lambda i: i.messages_per_day()),
+                                 ("longest_streak", lambda i: i.longest_streak())):
+            measure(name, function, stats, args.messages)
+        database.disconnect()
+
+
+if __name__ == '__main__':
+    main()
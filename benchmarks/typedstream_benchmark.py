@@ -0,0 +1,67 @@
+"""
+Compares decoding the text of attributedBody with the typedstream reader against the split heuristic it replaced,
+in messages per second.
+
+    python benchmarks/typedstream_benchmark.py --messages 200000
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+from imessagedb.typedstream import attributed_body, attributed_body_text
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'tests'))
+from synthetic_chat_db import WORDS, body_encoder
+
+
+def split_heuristic(encoded: bytes) -> str:
+    """ The way the text used to be found, by splitting on class names and removing bytes """
+    text = encoded.split(b'NSNumber')[0]
+    text = text.split(b'NSString')[1]
+    text = text.split(b'NSDictionary')[0]
+    text = text[6:-12]
+    if b'\x01' in text:
+        text = text.split(b'\x01')[1]
+    if b'\x02' in text:
+        text = text.split(b'\x02')[1]
+    if b'\x00' in text:
+        text = text.split(b'\x00')[1]
+    if b'\x86' in text:
+        text = text.split(b'\x86')[0]
+    return text.decode('utf-8', errors='replace')
+
+
+def create_bodies(count: int) -> list:
+    """ Create bodies like the one in the test database, with random text of 1 to 60 words """
+    encode = body_encoder()
+    random.seed(1)
+    return [encode(' '.join(random.choice(WORDS) for _ in range(random.randint(1, 60)))) for _ in range(count)]
+
+
+def measure(name: str, function, bodies: list) -> None:
+    start = time.perf_counter()
+    for body in bodies:
+        function(body)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<30s} {len(bodies) / elapsed:>12,.0f} messages/sec")
+
+
+def main() -> None:
+    argument_parser = argparse.ArgumentParser()
+    argument_parser.add_argument('--messages', type=int, default=200000, help="The number of bodies to decode")
+    args = argument_parser.parse_args()
+
+    bodies = create_bodies(args.messages)
+    wrong = sum(1 for i in bodies if split_heuristic(i) != attributed_body_text(i))
+    print(f"{args.messages:,} bodies, the split heuristic gets {wrong:,} of them wrong")
+
+    measure("split heuristic", split_heuristic, bodies)
+    measure("typedstream text", attributed_body_text, bodies)
+    measure("typedstream text and runs", attributed_body, bodies)
+
+
+if __name__ == '__main__':
+    main()
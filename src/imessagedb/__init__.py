@@ -8,6 +8,7 @@ from importlib.metadata import version
 
 __version__ = version("imessagedb")
 
+import atexit
 import os
 import configparser
 import logging
@@ -15,6 +16,8 @@ import argparse
 import sys
 import dateutil.parser
 from imessagedb.db import DB
+from imessagedb.profiling import Profile, CPUProfile
+from imessagedb.export_state import ExportState
 from imessagedb.utils import *
 
 DEFAULT_CONFIGURATION = '''
@@ -37,6 +40,30 @@ copy directory = HOME
 
 force copy = False
 
+# How the attachments that don't need to be converted are copied: 'copy' copies them, 'hardlink' and 'symlink'
+#  link to the originals, and 'reflink' makes copies that share the space of the originals, which APFS, btrfs and
+#  xfs can do. 'Auto' makes a reflink, or a copy if it can't, say because the copy directory is on another volume.
+#  It never makes a hard link, since changing one would change the original in the Messages attachments. A copy is
+#  only made again if the size or modification time of the original has changed
+
+copy mode = auto
+
+# The number of attachments to copy or convert at the same time, while the output is being generated. If it is
+#  not specified, it is the number of cores. If it is 0, each attachment is processed before moving on.
+#  'Job timeout' is the number of seconds an audio or video conversion can take before it is stopped
+
+# jobs = 4
+# job timeout = 600
+
+# Converted attachments are kept in the cache directory, so an attachment is only ever converted once, no matter
+#  how many times or for how many people it is output. The cache identifies a file by its path, size and
+#  modification time, and also by a hash of its contents if 'cache hash' is true. The converted files are copied
+#  to the output, or made as reflinks where the file system can, so changing them doesn't change the cache
+
+conversion cache = True
+cache directory = ~/.cache/imessagedb
+cache hash = False
+
 # 'Skip attachments' ignores attachments
 
 skip attachments = False
@@ -50,6 +77,68 @@ additional details = False
 
 verbose = True
 
+# Stream the messages to the output as they are read from the database, instead of loading the whole
+#  conversation first. This keeps the memory use down for very large conversations. 'Message window' is the
+#  number of messages that are read at a time, and the number of recent messages kept to link replies to
+#  their threads. 'Thread replies' is the number of the latest replies of a thread that are kept, to show before
+#  each new reply
+
+stream messages = False
+message window = 10000
+thread replies = 100
+
+# Keep the messages in compact columns instead of as an object each, which takes a lot less memory for very large
+#  conversations, but is a little slower to output
+
+compact messages = False
+
+# Incremental html output only adds the messages since the last export of the same conversation, using the state
+#  that is saved next to the output. If the state is missing, or the settings have changed, everything is output
+
+incremental = False
+
+# The html is written to the output file as it is generated, without keeping a copy of it, so the memory used
+#  stays the same however long the conversation is. Keep a copy if the HTMLOutput is also going to be printed or saved
+
+retain html = False
+
+# The pages of split html output can be rendered in this many processes at the same time. If it is 0 they are
+#  rendered one after another. The output is the same either way, but it isn't used for incremental output
+
+page processes = 0
+
+# With --all-contacts, --all-chats or --batch, the conversations are written by this many processes at the same
+#  time, while the messages of the others are read. If it is not specified, it is the number of cores. If it is 0,
+#  they are written one after another
+
+# batch processes = 4
+
+# How the database is opened. 'readonly' makes sure nothing is changed, and doesn't get in the way of Messages.
+#  'immutable' also skips all locking, which is faster, but is only safe if Messages is not running. 'snapshot'
+#  copies the database first, into memory, or into a temporary file if 'snapshot in memory' is false. 'readwrite'
+#  opens it normally
+
+open mode = readonly
+snapshot in memory = True
+
+# The SQLite page cache size (a negative number is in KiB), the size of the database that is memory mapped, and
+#  where temporary tables and indices are kept (default, file or memory)
+
+cache size = -65536
+# mmap size = 268435456
+temp store = memory
+
+# The number of rows that are fetched from the database at a time
+
+fetch size = 1000
+
+# '--search' keeps a full text index of the messages, in the cache directory unless 'search index' names the file.
+#  The index is brought up to date with the new messages each time it is searched. 'Search results' is the most
+#  messages a search returns
+
+# search index = ~/.cache/imessagedb/search.db
+search results = 50
+
 [DISPLAY]
 
 # Output type, either html or text
@@ -123,6 +212,19 @@ def _create_default_configuration(filename: str) -> None:
     return
 
 
+def _finish_profile(profile: Profile, filename: str) -> None:
+    """Stops the profile and writes its report, when the program ends"""
+    profile.stop()
+    profile.write(filename)
+    print(profile.summary(), file=sys.stderr)
+
+
+def _finish_cpu_profile(profile: CPUProfile, filename: str) -> None:
+    """Stops the CPU profile and writes its statistics and stacks, when the program ends"""
+    profile.stop()
+    profile.write(filename)
+
+
 def _get_contacts(configuration: configparser.ConfigParser) -> dict:
     result = {}
     contact_list = configuration.items('CONTACTS')
@@ -137,6 +239,44 @@ def _get_contacts(configuration: configparser.ConfigParser) -> dict:
     return result
 
 
+def _find_chat(database: DB, chat: str) -> int:
+    """Returns the id of a chat, given its name or id"""
+    if chat in database.chats.chat_names:
+        chats = database.chats.chat_names[chat]
+        if len(chats) != 1:
+            raise KeyError(f"You have {len(chats)} chats named {chat}, but only one can be exported by name")
+        return chats[0].rowid
+    if chat.isdigit() and int(chat) in database.chats.chat_list:
+        return int(chat)
+    raise KeyError(f"{chat} not recognized as a chat")
+
+
+def _add_batch_targets(batch, database: DB, configuration: configparser.ConfigParser,
+                       args: argparse.Namespace) -> None:
+    """Adds the people and chats to export to the batch. In a batch file, each line is either the name of a person
+    in the contacts list, or 'chat:' followed by the name or id of a chat. Blank lines and lines that start with #
+    are ignored."""
+    contacts = _get_contacts(configuration)
+    if args.all_contacts:
+        for (name, numbers) in contacts.items():
+            batch.add_person(name, numbers)
+    elif args.all_chats:
+        for chat_id in sorted(database.chats.chat_list):
+            batch.add_chat(chat_id)
+    else:
+        with open(args.batch) as file:
+            for line in file:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                if line.lower().startswith('chat:'):
+                    batch.add_chat(_find_chat(database, line[5:].strip()))
+                elif line.lower() in contacts:
+                    batch.add_person(line, contacts[line.lower()])
+                else:
+                    raise KeyError(f"{line} not known")
+
+
 def run() -> None:
     """ Run the imessagedb command line"""
 
@@ -152,6 +292,12 @@ def run() -> None:
     type_mutex_group = argument_parser.add_mutually_exclusive_group()
     type_mutex_group.add_argument('--handle', help="A list of handles to search against", nargs='*')
     type_mutex_group.add_argument('--chat', help="A chat to print")
+    type_mutex_group.add_argument('--all_contacts', '--all-contacts', action="store_true",
+                                  help="Export the conversations with each of the people in the contacts list")
+    type_mutex_group.add_argument('--all_chats', '--all-chats', action="store_true",
+                                  help="Export each of the chats in the database")
+    type_mutex_group.add_argument('--batch',
+                                  help="Export each of the people or chats in this file, one on each line")
 
     argument_parser.add_argument("-c", "--configfile", help="Location of the configuration file",
                                  default=f'{os.environ["HOME"]}/.config/iMessageDB.ini')
@@ -165,7 +311,12 @@ def run() -> None:
     copy_mutex_group = argument_parser.add_mutually_exclusive_group()
     copy_mutex_group.add_argument("-f", "--force", help="Force a copy of the attachments", action="store_true")
     copy_mutex_group.add_argument("--no_copy", help="Don't copy the attachments", action="store_true")
+    argument_parser.add_argument('--copy_mode', '--copy-mode',
+                                 choices=['copy', 'hardlink', 'reflink', 'symlink', 'auto'],
+                                 help="How to copy the attachments")
     argument_parser.add_argument("--no_attachments", help="Don't process attachments at all", action="store_true")
+    argument_parser.add_argument("-j", "--jobs", type=int,
+                                 help="The number of attachments to copy or convert at the same time")
     argument_parser.add_argument("-v", "--verbose", help="Turn on additional output", action="store_true")
     argument_parser.add_argument('--start_time', '--start-time',
                                  help="The start date/time of the messages")
@@ -173,10 +324,38 @@ def run() -> None:
                                  help="The end date/time of the messages")
     argument_parser.add_argument('--split_output', '--split-output',
                                  help="Split the html output into files with this many messages per file")
+    argument_parser.add_argument('--stream', help="Stream the messages instead of loading them all first",
+                                 action="store_true")
+    argument_parser.add_argument('--compact', help="Keep the messages in compact columns, to use less memory",
+                                 action="store_true")
+    argument_parser.add_argument('--open_mode', '--open-mode', help="How to open the database",
+                                 choices=['readwrite', 'readonly', 'immutable', 'snapshot'])
+    argument_parser.add_argument('--page_processes', '--page-processes', type=int,
+                                 help="The number of processes to render the pages of split html output in")
+    argument_parser.add_argument('--batch_processes', '--batch-processes', type=int,
+                                 help="The number of processes to write the conversations of a batch export in")
+    argument_parser.add_argument('--incremental',
+                                 help="Only add the messages since the last html export", action="store_true")
     argument_parser.add_argument('--get_handles', '--get-handles',
                                  help="Display the list of handles in the database and exit", action="store_true")
     argument_parser.add_argument('--get_chats', '--get-chats',
                                  help="Display the list of chats in the database and exit", action="store_true")
+    argument_parser.add_argument('--chats_sort', '--chats-sort', default='id',
+                                 choices=['id', 'name', 'messages', 'participants', 'attachments', 'first', 'last'],
+                                 help="What to sort the list of chats by, for --get_chats")
+    argument_parser.add_argument('--stats', choices=['person', 'handle', 'chat'],
+                                 help="Display the number of messages in the database by person, handle or chat, "
+                                      "and exit")
+    argument_parser.add_argument('--stats_period', '--stats-period', default='month',
+                                 choices=['day', 'week', 'month', 'hour_of_week', 'all'],
+                                 help="The period to count the messages by, for --stats")
+    argument_parser.add_argument('--search', help="Display the messages that match the words and exit")
+    argument_parser.add_argument('--profile',
+                                 help="Write the time spent in each stage, the counts of the work done and the "
+                                      "peak memory to this JSON file")
+    argument_parser.add_argument('--profile_cpu', '--profile-cpu',
+                                 help="Profile where the CPU time goes with cProfile, and write the statistics to "
+                                      "this .pstats file and the sampled stacks for a flame graph next to it")
     argument_parser.add_argument('--version', help="Prints the version number", action="store_true")
 
     args = argument_parser.parse_args()
@@ -185,6 +364,17 @@ def run() -> None:
         print(f"imessagedb {__version__}", file=sys.stderr)
         exit(0)
 
+    # The profile covers everything from here on, however the program ends
+    if args.profile:
+        profile = Profile()
+        profile.start()
+        atexit.register(_finish_profile, profile, args.profile)
+    # Registered after the profile, so that it is stopped first and the profile includes writing the statistics
+    if args.profile_cpu:
+        cpu_profile = CPUProfile()
+        cpu_profile.start()
+        atexit.register(_finish_cpu_profile, cpu_profile, args.profile_cpu)
+
     # First read in the configuration file, creating it if need be, then overwrite the values from the command line
     if not os.path.exists(args.configfile):
         _create_default_configuration(args.configfile)
@@ -204,12 +394,28 @@ def run() -> None:
         config.set(CONTROL, 'output type', args.output_type)
     if args.force:
         config.set(CONTROL, 'force copy', 'True')
+    if args.copy_mode:
+        config.set(CONTROL, 'copy mode', args.copy_mode)
     if args.no_attachments:
         config.set(CONTROL, 'skip attachments', 'True')
+    if args.jobs is not None:
+        config.set(CONTROL, 'jobs', str(args.jobs))
     if args.inline:
         config.set(DISPLAY, 'inline attachments', 'True')
     if args.split_output:
         config.set(DISPLAY, 'split output', args.split_output)
+    if args.stream:
+        config.set(CONTROL, 'stream messages', 'True')
+    if args.compact:
+        config.set(CONTROL, 'compact messages', 'True')
+    if args.incremental:
+        config.set(CONTROL, 'incremental', 'True')
+    if args.page_processes is not None:
+        config.set(CONTROL, 'page processes', str(args.page_processes))
+    if args.batch_processes is not None:
+        config.set(CONTROL, 'batch processes', str(args.batch_processes))
+    if args.open_mode:
+        config.set(CONTROL, 'open mode', args.open_mode)
 
     start_date = None
     end_date = None
@@ -235,14 +441,16 @@ def run() -> None:
         exit(1)
 
     generic_database_request = False
-    if args.get_handles or args.get_chats:
+    if args.get_handles or args.get_chats or args.search or args.stats:
         config[CONTROL]['skip attachments'] = 'True'
         generic_database_request = True
 
+    batch_request = args.all_contacts or args.all_chats or args.batch
+
     person = None
     numbers = None
 
-    if not generic_database_request:
+    if not generic_database_request and not batch_request:
         if args.chat:
             person = f"chat_{args.chat}"
             if args.name:
@@ -290,9 +498,36 @@ def run() -> None:
         sys.exit(0)
 
     if args.get_chats:
-        print(f"Available chats in the database:\n{database.chats.get_chats()}")
+        print(f"Available chats in the database:\n{database.chats.get_chats(args.chats_sort)}")
+        sys.exit(0)
+
+    if args.stats:
+        print(database.DatabaseStats(args.stats, args.stats_period, args.me).print_stats())
         sys.exit(0)
 
+    if args.search:
+        for hit in database.search(args.search):
+            chat = hit.chat.chat_name or hit.chat.chat_identifier if hit.chat is not None else ''
+            if hit.message.is_from_me:
+                who = args.me
+            else:
+                who = hit.handle.name if hit.handle is not None else hit.message.handle_id
+            print(f"{hit.message.date} [{chat}] {who}: {hit.snippet}")
+        sys.exit(0)
+
+    if batch_request:
+        batch = database.BatchExport(config.get('DISPLAY', 'me', fallback='Me'))
+        try:
+            _add_batch_targets(batch, database, config, args)
+        except KeyError as exp:
+            logger.error(f"{exp.args[0]}. Please edit your contacts list, or run 'imessagedb --get_chats' to get "
+                         f"the list of chats")
+            exit(1)
+        for (title, count) in batch.run():
+            print(f"Exported {count:,} messages with {title}")
+        database.disconnect()
+        return
+
     if args.chat:
         chat_id = args.chat
         title = args.chat
@@ -319,19 +554,43 @@ def run() -> None:
             argument_parser.print_help()
             exit(1)
 
-        message_list = database.Messages('chat', title, chat_id=chat_id)
     else:
+        title = person
 
-        message_list = database.Messages('person', person, numbers=numbers)
+    filename = os.path.join(copy_directory, safe_filename(person))
+    output_type = config[CONTROL].get('output type', fallback='html')
+
+    # Pick up from the last export, if there is one that matches
+    state = None
+    min_rowid = None
+    if output_type == 'html' and config[CONTROL].getboolean('incremental', fallback=False):
+        state = ExportState.load(filename, ExportState.settings(database, title))
+        if state is not None:
+            min_rowid = state.last_rowid
+
+    stream = config[CONTROL].getboolean('stream messages', fallback=False)
+    if args.chat:
+        if stream:
+            message_list = database.iter_messages('chat', title, chat_id=chat_id, min_rowid=min_rowid)
+        else:
+            message_list = database.Messages('chat', title, chat_id=chat_id, min_rowid=min_rowid)
+    else:
+        if stream:
+            message_list = database.iter_messages('person', person, numbers=numbers, min_rowid=min_rowid)
+        else:
+            message_list = database.Messages('person', person, numbers=numbers, min_rowid=min_rowid)
+
+    if state is not None and len(message_list) == 0:
+        logger.info(f"No new messages for {title} since the last export")
+        database.disconnect()
+        return
 
     me = config.get('DISPLAY', 'me', fallback='Me')
 
-    filename = os.path.join(copy_directory, safe_filename(person))
-    output_type = config[CONTROL].get('output type', fallback='html')
     if output_type == 'text':
         database.TextOutput(me, message_list, output_file=out).print()
     else:
-        database.HTMLOutput(me, message_list, output_file=filename)
+        database.HTMLOutput(me, message_list, output_file=filename, state=state)
 
     database.disconnect()
 
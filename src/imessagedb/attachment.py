@@ -1,10 +1,12 @@
 import os
 import urllib.parse
 import re
-import shutil
+import subprocess
 import ffmpeg
 import heic2png
 
+from imessagedb.file_copy import copy_file, up_to_date
+
 
 class Attachment:
     """ Class for holding information about an attachment """
@@ -45,6 +47,7 @@ class Attachment:
         self._missing = False
         self._needs_conversion = False
         self._force = self._database.control.getboolean('force copy', False)
+        self._copy_mode = self._database.control.get('copy mode', fallback='auto')
 
         # The path is set to use ~, so replace it with the home directory
         self._original_path = self._filename.replace('~', self._home_directory)
@@ -172,13 +175,50 @@ class Attachment:
                 if self.copy:
                     self._destination_filename = f'{self._destination_filename}.mp4'
 
+    def process(self, timeout: float = None, cache=None) -> bool:
+        """ Copy or convert the attachment to its destination, raising an exception if that fails
+
+        Returns False if there was nothing to do. The timeout (in seconds) applies to audio and video
+        conversions. If an imessagedb.ConversionCache is given, conversions are taken from the cache when
+        the attachment has been converted before, by any run or for any conversation."""
+
+        if self._conversion_type == 'HEIC':
+            converter = self._convert_heic_image
+        elif self._conversion_type == 'Audio' or self._conversion_type == 'Video':
+            def converter(original, converted):
+                self._convert_audio_video(original, converted, timeout=timeout)
+        else:
+            converter = None
+
+        if converter is not None and cache is not None:
+            def cache_converter(original, converted):
+                print(f"Converting {os.path.basename(self._destination_path)}")
+                converter(original, converted)
+
+            # The cache checks that the destination holds a finished conversion, rather than trusting that it exists
+            conversion = f'{self._conversion_type}{os.path.splitext(self._destination_path)[1]}'
+            return cache.convert(self._original_path, self._destination_path, conversion, cache_converter)
+
+        if converter is not None:
+            if not self._force and os.path.exists(self._destination_path):
+                return False
+            print(f"Converting {os.path.basename(self._destination_path)}")
+            converter(self._original_path, self._destination_path)
+        else:
+            # A copy is only made again if the original has changed since, by its size and modification time
+            if not self._force and up_to_date(self._original_path, self._destination_path):
+                return False
+            print(f"Copying {self._destination_filename}")
+            copy_file(self._original_path, self._destination_path, self._copy_mode)
+        return True
+
     def copy_attachment(self) -> None:
         """ Copy the attachment """
-        # Skip the file copy if the copy already exists
-        if self._force or not os.path.exists(self._destination_path):
+        # Skip the file copy if the copy is up to date
+        if self._force or not up_to_date(self._original_path, self._destination_path):
             print(f"Copying {self._destination_filename}")
             try:
-                shutil.copyfile(self._original_path, self._destination_path)
+                copy_file(self._original_path, self._destination_path, self._copy_mode)
                 return
             except Exception as exp:
                 print(f"Failed to copy {self._destination_filename}: {exp}")
@@ -187,14 +227,38 @@ class Attachment:
             # If the file already exists, do nothing
             return
 
+    @staticmethod
+    def _convert_heic_image(heic_location: str, png_location: str) -> None:
+        heic_image = heic2png.HEIC2PNG(heic_location)
+        heic_image.save(png_location)
+
+    @staticmethod
+    def _convert_audio_video(original: str, converted: str, timeout: float = None) -> None:
+        stream = ffmpeg.input(original)
+        stream = ffmpeg.output(stream, converted)
+        stream = ffmpeg.overwrite_output(stream)
+        process = ffmpeg.run_async(stream, pipe_stdout=True, pipe_stderr=True)
+        try:
+            out, err = process.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.communicate()
+            # Don't leave a partial file behind, or it will look like it has already been converted
+            if os.path.exists(converted):
+                os.remove(converted)
+            raise
+        if process.returncode != 0:
+            if os.path.exists(converted):
+                os.remove(converted)
+            raise ffmpeg.Error('ffmpeg', out, err)
+
     def convert_heic_image(self, heic_location: str, png_location: str) -> None:
         """ Convert a HEIC image to a PNG so it can be viewed in the browser """
         # Don't do the expensive conversion if we've already converted it
         if self._force or not os.path.exists(png_location):
             try:
                 print(f"Converting {os.path.basename(png_location)}")
-                heic_image = heic2png.HEIC2PNG(heic_location)
-                heic_image.save(png_location)
+                self._convert_heic_image(heic_location, png_location)
                 return
             except Exception as exp:
                 print(f'Failed to convert {heic_location} to {png_location}: {exp}')
@@ -208,10 +272,7 @@ class Attachment:
         if self._force or not os.path.exists(converted):
             try:
                 print(f"Converting {os.path.basename(converted)}")
-                stream = ffmpeg.input(original)
-                stream = ffmpeg.output(stream, converted)
-                stream = ffmpeg.overwrite_output(stream)
-                ffmpeg.run(stream, quiet=True)
+                self._convert_audio_video(original, converted)
                 return
             except Exception as exp:
                 print(f'Failed to convert {original} to {converted}: {exp}')
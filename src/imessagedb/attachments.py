@@ -1,10 +1,13 @@
 from imessagedb.attachment import Attachment
+from imessagedb.utils import fetch_rows
+from imessagedb import profiling
 from alive_progress import alive_bar
 
 
 class Attachments:
-    """ All attachments """
-    def __init__(self, database, copy=None, copy_directory=None) -> None:
+    """ All attachments, or the attachments of a set of messages """
+    def __init__(self, database, copy=None, copy_directory=None, message_filter: str = None,
+                 message_ids: list = None, message_parameters=(), rows: list = None) -> None:
         """
             Parameters
             ----------
@@ -16,6 +19,21 @@ class Attachments:
 
             copy_directory : str
                 The directory to copy attachments into
+
+            message_filter : str
+                A select statement returning message rowids. Only the attachments of those messages are loaded.
+
+            message_ids : list
+                A list of message rowids. Only the attachments of those messages are loaded.
+
+            message_parameters : dict or tuple
+                The parameters of the message_filter statement
+
+            rows : list
+                The attachments, already fetched, as (rowid, filename, mime_type, message_id)
+
+            If none of message_filter, message_ids or rows are given, all the attachments in the database are
+            loaded.
         """
 
         self._database = database
@@ -31,45 +49,87 @@ class Attachments:
 
         self._attachment_list = {}
         self._message_join = {}
+        self._fetch_size = self._database.control.getint('fetch size', fallback=1000)
 
-        # Get the list of all the attachments, unless we are skipping them
+        # Get the list of the attachments, unless we are skipping them
 
         if self._database.control.getboolean('skip attachments', fallback=False):
             return
 
-        self._database.connection.execute('select count(rowid)from attachment')
-        (row_count_total) = self._database.connection.fetchone()
-        row_count_total = row_count_total[0]
+        with profiling.stage('fetch attachments'):
+            if rows is not None:
+                for (rowid, filename, mime_type, message_id) in rows:
+                    self._add_attachment(rowid, filename, mime_type)
+                    self._add_join(message_id, rowid)
+            elif message_filter is not None:
+                self._get_attachments_for_messages(message_filter, message_parameters)
+            elif message_ids is not None:
+                # Stay well under the limit on the number of parameters in a statement
+                for i in range(0, len(message_ids), 500):
+                    chunk = message_ids[i:i + 500]
+                    self._get_attachments_for_messages(', '.join('?' * len(chunk)), chunk, progress=False)
+            else:
+                self._get_all_attachments()
+        profiling.count('attachments fetched', len(self._attachment_list))
+        return
 
-        self._database.connection.execute('select rowid, filename, mime_type from attachment')
+    def _add_attachment(self, rowid: int, filename: str, mime_type: str) -> None:
+        if filename is not None and rowid not in self._attachment_list:
+            self._attachment_list[rowid] = Attachment(self._database, rowid, filename, mime_type,
+                                                      copy=self._copy,
+                                                      copy_directory=self._copy_directory)
+
+    def _add_join(self, message_id: int, attachment_id: int) -> None:
+        if message_id in self._message_join:
+            self._message_join[message_id].append(attachment_id)
+        else:
+            self._message_join[message_id] = [attachment_id]
+
+    def _get_attachments_for_messages(self, message_filter: str, parameters=(), progress=True) -> None:
+        """ Get the attachments and the join for the messages in the filter with a single query """
+
+        from_string = "from message_attachment_join maj, attachment " \
+                      "where attachment.rowid = maj.attachment_id " \
+                      f"and maj.message_id in ({message_filter})"
+        select_string = f"select attachment.rowid, attachment.filename, attachment.mime_type, maj.message_id " \
+                        f"{from_string}"
+
+        if not progress:
+            self._database.connection.execute(select_string, parameters)
+            for (rowid, filename, mime_type, message_id) in fetch_rows(self._database.connection, self._fetch_size):
+                self._add_attachment(rowid, filename, mime_type)
+                self._add_join(message_id, rowid)
+            return
+
+        # The count is answered from the indices, without reading the rows
+        self._database.connection.execute(f"select count(*) {from_string}", parameters)
+        row_count_total = self._database.connection.fetchone()[0]
+
+        self._database.connection.execute(select_string, parameters)
+        rows = fetch_rows(self._database.connection, self._fetch_size)
+        with alive_bar(row_count_total, title="Getting Attachments", stats="({rate}, eta: {eta})") as bar:
+            for (rowid, filename, mime_type, message_id) in rows:
+                self._add_attachment(rowid, filename, mime_type)
+                self._add_join(message_id, rowid)
+                bar()
 
-        i = self._database.connection.fetchone()
+    def _get_all_attachments(self) -> None:
+        # The count is answered from an index, without reading the rows
+        self._database.connection.execute('select count(*) from attachment')
+        row_count_total = self._database.connection.fetchone()[0]
+
+        self._database.connection.execute('select rowid, filename, mime_type from attachment')
+        rows = fetch_rows(self._database.connection, self._fetch_size)
         with alive_bar(row_count_total, title="Getting Attachments", stats="({rate}, eta: {eta})") as bar:
-            while i:
-                rowid = i[0]
-                filename = i[1]
-                mime_type = i[2]
-                if filename is not None:
-                    self.attachment_list[rowid] = Attachment(self._database, rowid, filename, mime_type,
-                                                             copy=self._copy,
-                                                             copy_directory=self._copy_directory)
+            for (rowid, filename, mime_type) in rows:
+                self._add_attachment(rowid, filename, mime_type)
                 bar()
-                i = self._database.connection.fetchone()
 
         # Get the join of attachments and messages
 
         self._database.connection.execute('select message_id, attachment_id from message_attachment_join')
-        i = self._database.connection.fetchone()
-        while i:
-            message_id = i[0]
-            attachment_id = i[1]
-            if message_id in self.message_join:
-                self.message_join[message_id].append(attachment_id)
-            else:
-                self.message_join[message_id] = [attachment_id]
-            i = self._database.connection.fetchone()
-
-        return
+        for (message_id, attachment_id) in fetch_rows(self._database.connection, self._fetch_size):
+            self._add_join(message_id, attachment_id)
 
     @property
     def attachment_list(self) -> dict:
@@ -0,0 +1,295 @@
+import configparser
+import io
+import json
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from imessagedb.attachments import Attachments
+from imessagedb.messages import Messages, _MESSAGE_COLUMNS, _date_rules
+from imessagedb.utils import fetch_rows, safe_filename
+from imessagedb import profiling
+
+# The database of a worker process, which is opened once and used for all the conversations it exports
+_worker_database = None
+
+
+def _start_worker(database_name: str, configuration: str) -> None:
+    global _worker_database
+    from imessagedb.db import DB
+
+    config = configparser.ConfigParser()
+    config.read_string(configuration)
+    _worker_database = DB(database_name, config=config)
+
+
+def _export(database, job: tuple) -> int:
+    """ Write the output of one conversation, and return the number of messages in it """
+    (query_type, title, numbers, chat_id, filename, rows, attachment_rows, me, output_type) = job
+    attachment_directory = f"{filename}_attachments"
+    if attachment_rows and database.control.getboolean('copy', fallback=False):
+        os.makedirs(attachment_directory, exist_ok=True)
+    attachments = Attachments(database, copy_directory=attachment_directory, rows=attachment_rows)
+    messages = Messages(database, query_type, title, numbers=numbers, chat_id=chat_id, rows=rows,
+                        attachment_list=attachments)
+    if output_type == 'text':
+        with open(f"{filename}.txt", 'w') as file:
+            database.TextOutput(me, messages, output_file=file).save()
+    else:
+        database.HTMLOutput(me, messages, output_file=filename)
+    return len(messages)
+
+
+def _export_in_worker(job: tuple) -> int:
+    return _export(_worker_database, job)
+
+
+class _Target:
+    """ A conversation to export, and its messages as they are found """
+    __slots__ = ('index', 'query_type', 'title', 'numbers', 'chat_id', 'filename', 'chats', 'remaining', 'rows',
+                 'attachment_rows', 'rowids')
+
+    def __init__(self, index: int, query_type: str, title: str, numbers: list, chat_id: int, filename: str) -> None:
+        self.index = index
+        self.query_type = query_type
+        self.title = title
+        self.numbers = numbers
+        self.chat_id = chat_id
+        self.filename = filename
+        self.chats = set()
+        self.remaining = set()
+        self.rows = []
+        self.attachment_rows = []
+        self.rowids = set()
+
+
+class BatchExport:
+    """ Exports the conversations with many people, or many chats, in one go
+
+    Exporting each conversation on its own loads the handles and chats, and queries the messages and the
+    attachments, every time. Here, the messages of all the conversations are read in one pass over the database,
+    ordered by chat, along with their attachments. A conversation is handed to a pool of processes to be written as
+    soon as the last of its chats has been read, so only the conversations that are still being read or written
+    are kept in memory. The processes share the conversion cache, so an attachment that is in more than one of the
+    conversations is only converted once.
+
+    The output of each conversation goes where it would if it were exported on its own, in the output directory
+    under the name of the person or chat_{chat id}, with the attachments in a directory next to it.
+
+        batch = database.BatchExport(output_directory='export')
+        batch.add_person('Julio', ['+12025551234', 'julio@example.com'])
+        batch.add_chat(1441)
+        batch.run()
+
+    The CONTROL section of the configuration has
+
+    batch processes :
+        The number of processes that write the conversations, the default is the number of cores. With 0, they
+        are written in this process, one after another.
+    """
+
+    def __init__(self, database, me: str = 'Me', output_directory: str = None, processes: int = None) -> None:
+        """
+            Parameters
+            ----------
+            database : imessagedb.DB
+                An instance of a connected database
+
+            me : str
+                Your display name
+
+            output_directory : str
+                Where to write the conversations, the default is the copy directory
+
+            processes : int
+                The number of processes that write the conversations, the default is the 'batch processes'
+                configuration parameter, or the number of cores
+        """
+        self._database = database
+        self._me = me
+        if output_directory is None:
+            output_directory = self._database.control.get('copy directory', fallback=os.environ['HOME'])
+            if output_directory == 'HOME':
+                output_directory = os.environ['HOME']
+        self._output_directory = output_directory
+        if processes is None:
+            processes = self._database.control.getint('batch processes', fallback=os.cpu_count() or 1)
+        self._processes = processes
+        self._output_type = self._database.control.get('output type', fallback='html')
+        self._targets = []
+
+    def add_person(self, name: str, numbers: list) -> None:
+        """ Add the conversations with a person, in all the chats they are in, as one export
+
+            Parameters
+            ----------
+            name : str
+                The name of the person, which is the name of the output
+
+            numbers : list
+                The handles of the person, as in the handle table
+        """
+        self._targets.append(_Target(len(self._targets), 'person', name, numbers, None,
+                                     os.path.join(self._output_directory, safe_filename(name))))
+
+    def add_chat(self, chat_id: int, title: str = None) -> None:
+        """ Add a chat
+
+            Parameters
+            ----------
+            chat_id : int
+                The rowid of the chat
+
+            title : str
+                The name of the conversation, the default is the name of the chat, or its id if it doesn't have one
+        """
+        if title is None:
+            chat = self._database.chats.chat_list.get(chat_id)
+            title = chat.chat_name if chat is not None and chat.chat_name else chat_id
+        target = _Target(len(self._targets), 'chat', title, None, chat_id,
+                         os.path.join(self._output_directory, safe_filename(f"chat_{chat_id}")))
+        target.chats.add(chat_id)
+        self._targets.append(target)
+
+    def _find_chats(self) -> None:
+        """ Find the chats of each person, in one query """
+        if not any(i.query_type == 'person' for i in self._targets):
+            return
+        chats_of_handle = {}
+        cursor = self._database.cursor()
+        cursor.execute("select handle.id, chj.chat_id from handle "
+                       "join chat_handle_join chj on chj.handle_id = handle.rowid")
+        for (number, chat_id) in cursor.fetchall():
+            chats_of_handle.setdefault(number, set()).add(chat_id)
+        cursor.close()
+        for target in self._targets:
+            if target.query_type == 'person':
+                for number in target.numbers:
+                    target.chats.update(chats_of_handle.get(number, ()))
+
+    def _scan(self, chats: list):
+        """ Yields the rows of the messages in the chats, ordered by chat and then by date, each with the attachments
+        of the message as JSON """
+        parameters = {'chats': json.dumps(chats)}
+        (join_rules, rules) = _date_rules(self._database, parameters)
+        where_clause = ' and '.join(["cmj.chat_id in (select value from json_each(:chats))"] + join_rules + rules)
+        # The attachments are looked up for the messages that have them, in the same pass
+        select_string = f"select {_MESSAGE_COLUMNS}, cmj.chat_id, " \
+                        "case when message.cache_has_attachments then " \
+                        " (select json_group_array(json_array(attachment.rowid, attachment.filename, " \
+                        "  attachment.mime_type)) " \
+                        "  from message_attachment_join maj join attachment on attachment.rowid = maj.attachment_id " \
+                        "  where maj.message_id = message.rowid) end " \
+                        "from chat_message_join cmj " \
+                        "join message on message.rowid = cmj.message_id " \
+                        f"where {where_clause} " \
+                        "order by cmj.chat_id, cmj.message_date"
+        cursor = self._database.cursor()
+        cursor.execute(select_string, parameters)
+        yield from fetch_rows(cursor, self._database.control.getint('fetch size', fallback=1000))
+        cursor.close()
+
+    def _job(self, target: _Target) -> tuple:
+        """ Returns what a process needs to write the conversation, and lets go of the rows """
+        rows = target.rows
+        if len(target.chats) > 1:
+            # The rows are in date order within each chat
+            rows.sort(key=lambda i: i[2])
+        job = (target.query_type, target.title, target.numbers, target.chat_id, target.filename,
+               rows, target.attachment_rows, self._me, self._output_type)
+        target.rows = None
+        target.attachment_rows = None
+        target.rowids = None
+        return job
+
+    def run(self) -> list:
+        """ Export the conversations, and return the title of each and the number of messages in it, in the order
+        they were added. Two conversations can have the same title. """
+        self._find_chats()
+        targets_of_chat = {}
+        for target in self._targets:
+            target.remaining = set(target.chats)
+            for chat_id in target.chats:
+                targets_of_chat.setdefault(chat_id, []).append(target)
+
+        executor = None
+        if self._processes > 0:
+            # The configuration is sent as text, and each process opens the database itself. A snapshot is only
+            #  taken here, the processes only read the handles and the messages that start threads.
+            configuration = io.StringIO()
+            self._database.config.write(configuration)
+            config = configparser.ConfigParser()
+            config.read_string(configuration.getvalue())
+            if config['CONTROL'].get('open mode', fallback='readonly') == 'snapshot':
+                config['CONTROL']['open mode'] = 'readonly'
+            # Each conversation is already written in a process of its own, so its pages aren't
+            config['CONTROL']['page processes'] = '0'
+            configuration = io.StringIO()
+            config.write(configuration)
+            executor = ProcessPoolExecutor(max_workers=self._processes,
+                                           mp_context=multiprocessing.get_context('spawn'),
+                                           initializer=_start_worker,
+                                           initargs=(self._database.database_name, configuration.getvalue()))
+        pending = deque()
+        results = [0] * len(self._targets)
+
+        def finish(target: _Target) -> None:
+            # There is nothing to write for a conversation without any messages
+            if not target.rows:
+                target.rows = None
+                return
+            if executor is None:
+                results[target.index] = _export(self._database, self._job(target))
+                return
+            pending.append((target.index, executor.submit(_export_in_worker, self._job(target))))
+            while len(pending) > self._processes * 2:
+                (index, future) = pending.popleft()
+                results[index] = future.result()
+
+        def finish_chat(chat_id: int) -> None:
+            for target in targets_of_chat[chat_id]:
+                target.remaining.discard(chat_id)
+                if not target.remaining:
+                    finish(target)
+
+        try:
+            current_chat = None
+            row_count = 0
+            with profiling.stage('batch scan'):
+                for row in self._scan(sorted(targets_of_chat)):
+                    row_count += 1
+                    chat_id = row[11]
+                    if chat_id != current_chat:
+                        if current_chat is not None:
+                            finish_chat(current_chat)
+                        current_chat = chat_id
+                    attachments = row[12]
+                    if attachments is not None:
+                        attachments = [(*i, row[0]) for i in json.loads(attachments)]
+                    entry = row[:12]
+                    for target in targets_of_chat[chat_id]:
+                        if len(target.chats) > 1:
+                            # A message can be in more than one of the chats of a person, and is shown in the first
+                            if row[0] in target.rowids:
+                                continue
+                            target.rowids.add(row[0])
+                        target.rows.append(entry)
+                        if attachments:
+                            target.attachment_rows.extend(attachments)
+                if current_chat is not None:
+                    finish_chat(current_chat)
+            profiling.count('rows fetched', row_count)
+
+            # The conversations with no messages at all
+            for target in self._targets:
+                if target.rows is not None:
+                    finish(target)
+
+            for (index, future) in pending:
+                results[index] = future.result()
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+
+        return [(i.title, results[i.index]) for i in self._targets]
@@ -5,7 +5,8 @@ class Chat:
     """ Class for holding information about a chat """
 
     def __init__(self, database, rowid: str, chat_identifier: str, chat_name: str,
-                 last_message_date=None) -> None:
+                 last_message_date=None, first_message_date=None, message_count: int = 0,
+                 attachment_bytes: int = 0) -> None:
         """
             Parameters
             ----------
@@ -15,14 +16,23 @@ class Chat:
             rowid, chat_identifier, chat_name : str
                 The parameters are the fields in the database
 
-            last_message_date : date
-                The date the last message in this chat was sent"""
+            last_message_date, first_message_date : date
+                The date the last and the first message in this chat were sent
+
+            message_count : int
+                The number of messages in the chat
+
+            attachment_bytes : int
+                The size of all the attachments in the chat"""
 
         self._database = database
         self._rowid = rowid
         self._chat_identifier = chat_identifier
         self._chat_name = chat_name
         self._last_message_date = last_message_date
+        self._first_message_date = first_message_date
+        self._message_count = message_count
+        self._attachment_bytes = attachment_bytes
         self._participants = []
 
     def __repr__(self) -> str:
@@ -49,6 +59,25 @@ class Chat:
     def last_message_date(self, date: datetime):
         self._last_message_date = date
 
+    @property
+    def first_message_date(self) -> datetime:
+        return self._first_message_date
+
+    @property
+    def message_count(self) -> int:
+        """ Returns the number of messages in the chat """
+        return self._message_count
+
+    @property
+    def attachment_bytes(self) -> int:
+        """ Returns the size of all the attachments in the chat """
+        return self._attachment_bytes
+
+    @property
+    def participant_count(self) -> int:
+        """ Returns the number of people in the chat, not counting me """
+        return len(self._participants)
+
     @property
     def participants(self) -> str:
         """ Returns the participants in the chat """
@@ -29,13 +29,30 @@ class Chats:
         return len(self._chat_list)
 
     def _get_chats_from_database(self) -> None:
-        self._database.connection.execute('select rowid, chat_identifier, display_name from chat')
+        # The first and last dates of each chat are read from the ends of its range of the (chat_id, message_date,
+        #  message_id) index, and its messages are counted from the range, which is quicker than grouping the
+        #  whole index. The sizes of the attachments are added up from the attachments, which are far fewer than
+        #  the messages, so they go first.
+        first_last = "datetime((select {}(message_date) from chat_message_join cmj where cmj.chat_id = chat.rowid)" \
+                     "/1000000000 + strftime('%s', '2001-01-01'), 'unixepoch', 'localtime')"
+        select_string = "select chat.rowid, chat.chat_identifier, chat.display_name, " \
+                        f"{first_last.format('max')}, {first_last.format('min')}, " \
+                        "(select count(*) from chat_message_join cmj where cmj.chat_id = chat.rowid), " \
+                        "coalesce(attachments.bytes, 0) " \
+                        "from chat " \
+                        "left join (select cmj.chat_id, sum(attachment.total_bytes) as bytes " \
+                        "           from message_attachment_join maj " \
+                        "           cross join attachment on attachment.rowid = maj.attachment_id " \
+                        "           cross join chat_message_join cmj on cmj.message_id = maj.message_id " \
+                        "           group by cmj.chat_id) attachments " \
+                        " on attachments.chat_id = chat.rowid"
+        self._database.connection.execute(select_string)
         rows = self._database.connection.fetchall()
         for row in rows:
-            rowid = row[0]
-            chat_identifier = row[1]
-            display_name = row[2]
-            new_chat = Chat(self._database, rowid, chat_identifier, display_name)
+            (rowid, chat_identifier, display_name, last_message_date, first_message_date, message_count,
+             attachment_bytes) = row
+            new_chat = Chat(self._database, rowid, chat_identifier, display_name, last_message_date,
+                            first_message_date, message_count, attachment_bytes)
             self.chat_list[new_chat.rowid] = new_chat
 
             # Add the chat to the chat_identifiers
@@ -51,16 +68,6 @@ class Chats:
                 else:
                     self._chat_names[new_chat.chat_name] = [new_chat]
 
-        # Add the last chat date to all the chats
-        for i in self.chat_list.values():
-            select_string = "select " \
-                    "datetime(max(message_date)/1000000000 + strftime('%s', '2001-01-01'),'unixepoch','localtime') " \
-                    f"from chat_message_join cmj where chat_id = {i.rowid}"
-
-            self._database.connection.execute(select_string)
-            rows = self._database.connection.fetchall()
-            i.last_message_date = rows[0][0]
-
         # Add the participants for all the chats
         self._database.connection.execute('select chat_id, handle_id from chat_handle_join')
         rows = self._database.connection.fetchall()
@@ -72,17 +79,39 @@ class Chats:
 
         return
 
-    def get_chats(self) -> str:
-        """ Return a string with the list of chats in the database"""
+    def get_chats(self, sort_by: str = 'id') -> str:
+        """ Return a string with the list of chats in the database
+
+            Parameters
+            ----------
+            sort_by : str
+                What to sort the chats by, one of
+                    id, name: in order
+                    messages, participants, attachments: the largest first
+                    first, last: the date of the first or last message, the most recent first
+        """
+        keys = {'id': (lambda i: i.rowid, False),
+                'name': (lambda i: (i.chat_name or i.chat_identifier or '').lower(), False),
+                'messages': (lambda i: i.message_count, True),
+                'participants': (lambda i: i.participant_count, True),
+                'attachments': (lambda i: i.attachment_bytes, True),
+                'first': (lambda i: i.first_message_date or '', True),
+                'last': (lambda i: i.last_message_date or '', True)}
+        if sort_by not in keys:
+            raise ValueError(f"Unknown sort {sort_by}, it must be one of {', '.join(keys)}")
+        (key, reverse) = keys[sort_by]
+
         return_array = []
-        for chat_id in sorted(self._chat_list):
-            chat = self._chat_list[chat_id]
+        for chat in sorted(self._chat_list.values(), key=key, reverse=reverse):
             chat_name = ""
             if chat.chat_name and chat.chat_name != '':
                 chat_name = f"{chat.rowid} ({chat.chat_name}):"
             else:
                 chat_name = f"{chat.rowid}:"
-            chat_string = f"{chat_name} Participants: {chat.participants}, Last Message Sent: {chat.last_message_date}"
+            chat_string = f"{chat_name} Participants: {chat.participants}, " \
+                          f"Last Message Sent: {chat.last_message_date}, " \
+                          f"First Message Sent: {chat.first_message_date}, Messages: {chat.message_count:,}, " \
+                          f"Attachments: {chat.attachment_bytes / 2 ** 20:,.1f} MiB"
             return_array.append(chat_string)
         return '\n'.join(return_array)
 
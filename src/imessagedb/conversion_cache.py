@@ -0,0 +1,157 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from imessagedb.file_copy import copy_file, up_to_date
+
+
+class ConversionCache:
+    """ A cache of converted attachments that is kept across runs and conversations
+
+    Each conversion is stored once in the cache directory, keyed by the source file (its path, size and
+    modification time, and optionally a hash of its contents) and by the conversion. A SQLite manifest records
+    the outputs, with their size and modification time, so that an output that has been changed is converted
+    again. The outputs are put in each output directory as reflinks, or as copies where the file system can't make
+    them, and never as hard links, so that changing an exported file doesn't change the cache.
+    """
+
+    def __init__(self, directory: str, use_hash: bool = False) -> None:
+        """
+            Parameters
+            ----------
+            directory : str
+                The directory to keep the converted files and the manifest in
+
+            use_hash : bool
+                Whether to include a hash of the contents of the source file in the key, default is False
+        """
+
+        self._directory = os.path.expanduser(directory)
+        self._use_hash = use_hash
+        os.makedirs(os.path.join(self._directory, 'objects'), exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._connection = sqlite3.connect(os.path.join(self._directory, 'manifest.db'), timeout=30,
+                                           check_same_thread=False)
+        with self._lock:
+            self._connection.execute('create table if not exists conversions ('
+                                      ' key text primary key, source text, size integer, mtime_ns integer,'
+                                      ' digest text, conversion text, output text, output_size integer,'
+                                      ' created real, output_mtime_ns integer)')
+            # The manifests from before the modification time of the outputs was kept
+            columns = [i[1] for i in self._connection.execute('pragma table_info(conversions)')]
+            if 'output_mtime_ns' not in columns:
+                self._connection.execute('alter table conversions add column output_mtime_ns integer')
+            self._connection.commit()
+
+    def _digest(self, source: str) -> str:
+        digest = hashlib.sha256()
+        with open(source, 'rb') as file_handle:
+            for chunk in iter(lambda: file_handle.read(1024 * 1024), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def key(self, source: str, conversion: str) -> tuple:
+        """ Return the key of the conversion of the source, and the fields it was made from """
+        stat = os.stat(source)
+        digest = self._digest(source) if self._use_hash else ''
+        fields = (source, stat.st_size, stat.st_mtime_ns, digest, conversion)
+        key = hashlib.sha256('\0'.join(map(str, fields)).encode('utf-8')).hexdigest()
+        return key, fields
+
+    def lookup(self, key: str) -> str:
+        """ Return the path of the converted file, or None if it has not been converted """
+        with self._lock:
+            row = self._connection.execute('select output, output_size, output_mtime_ns from conversions '
+                                           'where key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        (output, output_size, output_mtime_ns) = row
+        try:
+            stat = os.stat(output)
+        except OSError:
+            return None
+        # An output that has been changed since it was made, say through a hard link from an older version, has to
+        #  be made again
+        if stat.st_size != output_size or stat.st_mtime_ns != output_mtime_ns:
+            return None
+        return output
+
+    def _key_lock(self, key: str) -> threading.Lock:
+        with self._lock:
+            if key not in self._key_locks:
+                self._key_locks[key] = threading.Lock()
+            return self._key_locks[key]
+
+    def convert(self, source: str, destination: str, conversion: str, converter) -> bool:
+        """ Put the converted source at the destination, only converting it if it has never been converted
+
+            Parameters
+            ----------
+            source : str
+                The file to convert
+
+            destination : str
+                Where the converted file should end up
+
+            conversion : str
+                A description of the conversion, including its parameters
+
+            converter : callable
+                Called with the source and the file to write the conversion to
+
+            Returns True if the converter was run.
+        """
+
+        (key, fields) = self.key(source, conversion)
+        extension = os.path.splitext(destination)[1]
+        with self._key_lock(key):
+            output = self.lookup(key)
+            converted = False
+            if output is None:
+                output = os.path.join(self._directory, 'objects', key[:2], f'{key}{extension}')
+                os.makedirs(os.path.dirname(output), exist_ok=True)
+
+                # Convert to a temporary file, so a partial conversion is never mistaken for a finished one
+                partial = os.path.join(os.path.dirname(output),
+                                       f'{key}.{os.getpid()}.{threading.get_ident()}.partial{extension}')
+                try:
+                    converter(source, partial)
+                    os.replace(partial, output)
+                finally:
+                    if os.path.exists(partial):
+                        os.remove(partial)
+
+                stat = os.stat(output)
+                with self._lock:
+                    self._connection.execute('insert or replace into conversions (key, source, size, mtime_ns, digest, '
+                                             'conversion, output, output_size, created, output_mtime_ns) '
+                                             'values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                             (key, *fields, output, stat.st_size, time.time(), stat.st_mtime_ns))
+                    self._connection.commit()
+                converted = True
+
+            self._place(output, destination)
+        return converted
+
+    @staticmethod
+    def _place(output: str, destination: str) -> None:
+        """ Put a reflink or a copy of the cached output at the destination, unless one is already there """
+        # A hard link from an older version is replaced, so the cache can't be changed through it
+        if os.path.exists(destination) and not os.path.samefile(output, destination) and \
+                up_to_date(output, destination):
+            return
+        copy_file(output, destination, mode='reflink')
+
+    def close(self) -> None:
+        """ Close the manifest """
+        with self._lock:
+            self._connection.close()
+
+    @property
+    def directory(self) -> str:
+        """ Return the directory the cache is kept in """
+        return self._directory
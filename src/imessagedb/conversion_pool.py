@@ -0,0 +1,115 @@
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from imessagedb.attachment import Attachment
+from imessagedb import profiling
+
+
+class ConversionPool:
+    """ Copies and converts attachments in a pool of worker threads, so the output can continue while they run
+
+    The work itself is done by ffmpeg processes and native image libraries, so threads are enough to keep
+    every core busy. If the number of jobs is 0, the attachments are processed as they are submitted.
+    """
+
+    def __init__(self, jobs: int = None, timeout: float = None, cache=None) -> None:
+        """
+            Parameters
+            ----------
+            jobs : int
+                The number of attachments to process at the same time, default is the number of cores
+
+            timeout : float
+                The number of seconds an audio or video conversion may take before it is stopped, default
+                is no limit
+
+            cache : imessagedb.ConversionCache
+                A cache of conversions to use, default is to not use one
+        """
+
+        if jobs is None:
+            jobs = os.cpu_count() or 1
+        self._jobs = jobs
+        self._timeout = timeout
+        self._cache = cache
+        self._executor = None
+        if self._jobs > 0:
+            self._executor = ThreadPoolExecutor(max_workers=self._jobs, thread_name_prefix='attachment')
+
+        self._submitted = {}  # The pending jobs by destination path
+        self._processed = 0
+        self._skipped = 0
+        self._failures = []
+        self._timeouts = []
+
+    def submit(self, attachment: Attachment) -> None:
+        """ Queue the attachment to be copied or converted """
+
+        # The same attachment can be in more than one message, only process it once
+        if attachment.destination_path in self._submitted:
+            return
+
+        if self._executor is None:
+            self._submitted[attachment.destination_path] = None
+            self._record(attachment, attachment.process, self._timeout, self._cache)
+        else:
+            future = self._executor.submit(attachment.process, self._timeout, self._cache)
+            self._submitted[attachment.destination_path] = (attachment, future)
+
+    def _record(self, attachment: Attachment, function, *args) -> None:
+        """ Run the function, or get the result of a job, and keep track of how it went """
+        try:
+            if function(*args):
+                self._processed += 1
+            else:
+                self._skipped += 1
+        except subprocess.TimeoutExpired:
+            print(f"Timed out converting {attachment.original_path} after {self._timeout} seconds")
+            self._timeouts.append(attachment)
+        except Exception as exp:
+            print(f"Failed to process {attachment.original_path}: {exp}")
+            self._failures.append((attachment, exp))
+
+    def wait(self) -> None:
+        """ Wait for all the jobs to finish, and report on any that failed """
+        if self._executor is not None:
+            for (attachment, future) in self._submitted.values():
+                self._record(attachment, future.result)
+            self._executor.shutdown()
+
+        profile = profiling.active
+        if profile is not None:
+            profile.count('attachments processed', self._processed)
+            profile.count('attachments skipped', self._skipped)
+            profile.count('attachments failed', len(self._failures))
+            profile.count('attachments timed out', len(self._timeouts))
+
+        if self._failures or self._timeouts:
+            print(f"Processed {self._processed:,} attachments, {len(self._failures):,} failed "
+                  f"and {len(self._timeouts):,} timed out")
+
+    @property
+    def jobs(self) -> int:
+        """ Return the number of jobs run at the same time """
+        return self._jobs
+
+    @property
+    def processed(self) -> int:
+        """ Return the number of attachments copied or converted """
+        return self._processed
+
+    @property
+    def skipped(self) -> int:
+        """ Return the number of attachments that were already at their destination """
+        return self._skipped
+
+    @property
+    def failures(self) -> list:
+        """ Return the list of (attachment, exception) for the attachments that failed """
+        return self._failures
+
+    @property
+    def timeouts(self) -> list:
+        """ Return the list of attachments whose conversion timed out """
+        return self._timeouts
@@ -1,13 +1,22 @@
 import configparser
 import os
+import pathlib
 import sqlite3
+import tempfile
+import threading
 
 import imessagedb
+from imessagedb import profiling
+from imessagedb.profiling import CPUProfile
 from imessagedb.attachments import Attachments
+from imessagedb.batch_export import BatchExport
 from imessagedb.chats import Chats
 from imessagedb.handles import Handles
 from imessagedb.generate_html import HTMLOutput
-from imessagedb.messages import Messages
+from imessagedb.export_state import ExportState
+from imessagedb.messages import Messages, MessageStream
+from imessagedb.search_index import SearchIndex
+from imessagedb.stats import DatabaseStats
 from imessagedb.generate_text import TextOutput
 
 
@@ -38,37 +47,181 @@ class DB:
 
         self._control = self._configuration['CONTROL']
 
-        self._chat_connection = sqlite3.connect(database_name)
+        # The handles, chats and attachments may be loaded from other threads, so the connection can be
+        #  shared, and the loading is serialized with the lock
+        self._snapshot_filename = None
+        self._chat_connection = self._connect(database_name, self._control.get('open mode', fallback='readonly'))
+        self._set_pragmas()
         self._cursor = self._chat_connection.cursor()
+        self._load_lock = threading.RLock()
 
-        # Preload some of the data
-        self._handles = Handles(self)
-        self._chats = Chats(self)
-        self._attachment_list = Attachments(self)
+        # The handles, chats and attachments are loaded the first time they are used
+        self._handles = None
+        self._chats = None
+        self._attachment_list = None
+        self._search_index = None
         return
 
-    def Messages(self, query_type: str, title: str, numbers: list = None, chat_id: str = None) -> Messages:
+    def _connect(self, database_name: str, mode: str) -> sqlite3.Connection:
+        """Opens the database in the given mode
+
+        readwrite opens it normally. readonly opens it without write access, so it can't interfere with
+        Messages writing to it. immutable also tells SQLite that the database won't change, so it doesn't
+        take any locks or look at the write-ahead log, which is only safe if Messages isn't running, and
+        misses anything that is still in the log.
+        snapshot copies the database with the backup API, into memory or into a temporary file if
+        'snapshot in memory' is false, and reads the copy.
+        """
+        uri = pathlib.Path(os.path.abspath(database_name)).as_uri()
+        if mode == 'readwrite':
+            return sqlite3.connect(database_name, check_same_thread=False)
+        if mode == 'readonly':
+            return sqlite3.connect(f"{uri}?mode=ro", uri=True, check_same_thread=False)
+        if mode == 'immutable':
+            return sqlite3.connect(f"{uri}?mode=ro&immutable=1", uri=True, check_same_thread=False)
+        if mode == 'snapshot':
+            source = sqlite3.connect(f"{uri}?mode=ro", uri=True)
+            if self._control.getboolean('snapshot in memory', fallback=True):
+                connection = sqlite3.connect(':memory:', check_same_thread=False)
+            else:
+                (handle, self._snapshot_filename) = tempfile.mkstemp(prefix='chat-', suffix='.db')
+                os.close(handle)
+                connection = sqlite3.connect(self._snapshot_filename, check_same_thread=False)
+            try:
+                source.backup(connection)
+            except Exception:
+                # Don't leave a partial copy of the database behind
+                connection.close()
+                if self._snapshot_filename is not None:
+                    os.remove(self._snapshot_filename)
+                    self._snapshot_filename = None
+                raise
+            finally:
+                source.close()
+            return connection
+        raise ValueError(f"Unknown open mode {mode}, it must be one of readwrite, readonly, immutable or snapshot")
+
+    def _set_pragmas(self) -> None:
+        """Sets the cache size, memory map size and temporary storage of the connection from the configuration
+        """
+        cache_size = self._control.getint('cache size', fallback=None)
+        if cache_size is not None:
+            self._chat_connection.execute(f"pragma cache_size = {cache_size}")
+        mmap_size = self._control.getint('mmap size', fallback=None)
+        if mmap_size is not None:
+            self._chat_connection.execute(f"pragma mmap_size = {mmap_size}")
+        temp_store = self._control.get('temp store', fallback=None)
+        if temp_store is not None:
+            if temp_store.lower() not in ('default', 'file', 'memory'):
+                raise ValueError(f"Unknown temp store {temp_store}, it must be one of default, file or memory")
+            self._chat_connection.execute(f"pragma temp_store = {temp_store}")
+
+    def _load(self, attribute: str, loader):
+        """Returns the value of the attribute, calling the loader to create it the first time it is used
+        """
+        value = getattr(self, attribute)
+        if value is None:
+            with self._load_lock:
+                # Another thread may have loaded it while we were waiting for the lock
+                value = getattr(self, attribute)
+                if value is None:
+                    with profiling.stage(f"load {attribute.strip('_').replace('_', ' ')}"):
+                        value = loader(self)
+                    setattr(self, attribute, value)
+        return value
+
+    def Messages(self, query_type: str, title: str, numbers: list = None, chat_id: str = None,
+                 min_rowid: int = None) -> Messages:
         """A wrapper to create a Messages class
         """
-        return Messages(self, query_type, title, numbers=numbers, chat_id=chat_id)
+        return Messages(self, query_type, title, numbers=numbers, chat_id=chat_id, min_rowid=min_rowid)
 
-    def HTMLOutput(self, me: str, message_list: Messages, inline=False, output_file=None) -> HTMLOutput:
+    def iter_messages(self, query_type: str, title: str, numbers: list = None, chat_id: str = None,
+                      window: int = None, min_rowid: int = None, thread_replies: int = None) -> MessageStream:
+        """Returns a MessageStream, which yields the messages in date order without loading them all
+        """
+        return MessageStream(self, query_type, title, numbers=numbers, chat_id=chat_id, window=window,
+                             min_rowid=min_rowid, thread_replies=thread_replies)
+
+    def HTMLOutput(self, me: str, message_list: Messages, inline=False, output_file=None,
+                   state: ExportState = None) -> HTMLOutput:
         """A wrapper to create an HTMLOutput class
         """
-        return HTMLOutput(self, me, message_list, inline, output_file)
+        return HTMLOutput(self, me, message_list, inline, output_file, state=state)
 
     def TextOutput(self, me: str, message_list: Messages, output_file=None) -> TextOutput:
         """A wrapper to create a TextOutput class
         """
         return TextOutput(self, me, message_list, output_file)
 
+    def BatchExport(self, me: str = 'Me', output_directory: str = None, processes: int = None) -> BatchExport:
+        """A wrapper to create a BatchExport class, which exports many conversations in one pass over the database
+        """
+        return BatchExport(self, me, output_directory, processes)
+
+    def DatabaseStats(self, group_by: str = 'person', period: str = 'month', me: str = 'Me') -> DatabaseStats:
+        """Returns the number of messages, characters and attachments in the whole database, by person, handle
+        or chat and by period, counted in the database
+        """
+        return DatabaseStats(self, group_by, period, me)
+
+    def profile_cpu(self, filename: str = None, interval: float = 0.005) -> CPUProfile:
+        """Returns a context manager that records where the CPU time goes while it is entered, with cProfile and
+        by sampling the stacks, and writes them to a .pstats file and a .collapsed file for a flame graph
+
+        Parameters
+        ----------
+        filename : str
+            The .pstats file to write, the collapsed stacks are written next to it with a .collapsed extension
+
+        interval : float
+            The number of seconds between samples of the stacks
+        """
+        return CPUProfile(filename, interval)
+
+    def search(self, query: str, limit: int = None) -> list:
+        """Returns the messages that match the query, the best matches first, as a list of SearchHit.
+        The search index is brought up to date with the new messages first.
+
+        Parameters
+        ----------
+        query : str
+            The words to search for. A word that ends in * matches the words that start with it
+
+        limit : int
+            The most messages to return (the default is the 'search results' configuration parameter)
+        """
+        if limit is None:
+            limit = self._control.getint('search results', fallback=50)
+        if self._search_index is None:
+            self._search_index = SearchIndex(self)
+        self._search_index.update()
+        return self._search_index.search(query, limit)
+
     def disconnect(self) -> None:
         """Disconnects from the database
 
         """
+        if self._search_index is not None:
+            self._search_index.close()
+            self._search_index = None
         self._chat_connection.close()
+        if self._snapshot_filename is not None:
+            os.remove(self._snapshot_filename)
+            self._snapshot_filename = None
         return
 
+    def cursor(self) -> sqlite3.Cursor:
+        """Returns a new cursor, for queries that are read while other queries run
+        """
+        return self._chat_connection.cursor()
+
+    @property
+    def database_name(self) -> str:
+        """Returns the name of the database file
+        """
+        return self._database_name
+
     @property
     def connection(self) -> sqlite3.Cursor:
         """Returns a connection to query the database
@@ -79,19 +232,19 @@ class DB:
     def handles(self) -> Handles:
         """Returns an imessagedb.Handles class with all the handles
         """
-        return self._handles
+        return self._load('_handles', Handles)
 
     @property
     def chats(self) -> Chats:
         """Returns an imessagedb.Chats class with all the chats
         """
-        return self._chats
+        return self._load('_chats', Chats)
 
     @property
     def attachment_list(self) -> Attachments:
         """Returns an imessagedb.Attachments class with all the attachments
         """
-        return self._attachment_list
+        return self._load('_attachment_list', Attachments)
 
     @property
     def config(self) -> configparser.ConfigParser:
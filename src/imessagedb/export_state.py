@@ -0,0 +1,85 @@
+import json
+import os
+
+
+class ExportState:
+    """ What the last html export of a conversation wrote, so that the next export only has to add to it
+
+    The state is kept in a json file next to the html output. It has the last message that was exported and
+    the layout of the final page, which is the only page that is rewritten by the next export.
+    """
+
+    VERSION = 1
+
+    def __init__(self, output_filename: str, values: dict = None) -> None:
+        """
+            Parameters
+            ----------
+            output_filename : str
+                The name of the html output, without the .html
+
+            values : dict
+                The saved state, default is an empty state
+        """
+        self._output_filename = output_filename
+        self._values = values if values is not None else {}
+
+    @staticmethod
+    def state_filename(output_filename: str) -> str:
+        """ Return the name of the state file for the output """
+        return f'{output_filename}.state.json'
+
+    @staticmethod
+    def settings(database, title: str) -> dict:
+        """ Return the settings that change the layout of the output, which must not change between exports """
+        return {'title': str(title),
+                'split output': database.config.getint('DISPLAY', 'split output', fallback=0),
+                'start time': database.control.get('start time', fallback=None),
+                'end time': database.control.get('end time', fallback=None)}
+
+    @classmethod
+    def load(cls, output_filename: str, settings: dict):
+        """ Return the state of the last export, or None if there isn't one that can be added to
+
+            Parameters
+            ----------
+            output_filename : str
+                The name of the html output, without the .html
+
+            settings : dict
+                The settings of this export, from ExportState.settings
+        """
+        try:
+            with open(cls.state_filename(output_filename)) as file_handle:
+                values = json.load(file_handle)
+        except (OSError, ValueError):
+            return None
+
+        if values.get('version') != cls.VERSION or values.get('settings') != settings:
+            return None
+
+        # The final page must still be what we wrote
+        final_page = values.get('current_output_filename')
+        if final_page is None or not os.path.exists(final_page) or \
+                os.path.getsize(final_page) != values.get('final_page_size'):
+            return None
+
+        return cls(output_filename, values)
+
+    def save(self) -> None:
+        """ Write the state next to the html output """
+        self._values['version'] = self.VERSION
+        filename = self.state_filename(self._output_filename)
+        with open(f'{filename}.partial', 'w') as file_handle:
+            json.dump(self._values, file_handle, indent=1)
+        os.replace(f'{filename}.partial', filename)
+
+    @property
+    def last_rowid(self) -> int:
+        """ Return the rowid of the last message that was exported """
+        return self._values.get('last_rowid')
+
+    @property
+    def values(self) -> dict:
+        """ Return the saved values """
+        return self._values
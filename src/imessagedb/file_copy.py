@@ -0,0 +1,117 @@
+import ctypes
+import errno
+import os
+import shutil
+import sys
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+COPY_MODES = ('copy', 'hardlink', 'reflink', 'symlink', 'auto')
+
+# The ioctl that clones a file on Linux file systems that support it, like btrfs and xfs
+_FICLONE = 0x40049409
+
+_libc = None
+
+
+def _reflink(source: str, destination: str) -> None:
+    """ Make the destination a copy of the source that shares its blocks until either is changed, raising
+    OSError if the file system can't """
+    global _libc
+    if sys.platform == 'darwin':
+        # clonefile() is in libSystem, and works on APFS
+        if _libc is None:
+            _libc = ctypes.CDLL(None, use_errno=True)
+        if _libc.clonefile(os.fsencode(source), os.fsencode(destination), 0) != 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error), destination)
+    elif fcntl is not None:
+        with open(source, 'rb') as source_file, open(destination, 'wb') as destination_file:
+            fcntl.ioctl(destination_file.fileno(), _FICLONE, source_file.fileno())
+    else:
+        raise OSError(errno.EOPNOTSUPP, "Reflinks are not supported", destination)
+
+
+def _copy(source: str, destination: str) -> None:
+    shutil.copyfile(source, destination)
+
+
+def _methods(mode: str) -> list:
+    """ The ways to try to put the source at the destination, in order """
+    if mode == 'auto':
+        # Never a hard link, which would let a change to the copy change the original
+        return [('reflink', _reflink), ('copy', _copy)]
+    elif mode == 'reflink':
+        return [('reflink', _reflink), ('copy', _copy)]
+    elif mode == 'hardlink':
+        return [('hardlink', os.link), ('copy', _copy)]
+    elif mode == 'symlink':
+        return [('symlink', os.symlink)]
+    elif mode == 'copy':
+        return [('copy', _copy)]
+    raise ValueError(f"Unknown copy mode {mode}, it must be one of {', '.join(COPY_MODES)}")
+
+
+def up_to_date(source: str, destination: str) -> bool:
+    """ Return if the destination is already a copy of the source: the same file, or a file with the same size
+    and modification time """
+    try:
+        source_stat = os.stat(source)
+        destination_stat = os.stat(destination)
+    except OSError:
+        return False
+    if os.path.samestat(source_stat, destination_stat):
+        return True
+    # Some file systems only keep the modification time to the second, or even two seconds
+    return source_stat.st_size == destination_stat.st_size and \
+        abs(source_stat.st_mtime - destination_stat.st_mtime) < 2
+
+
+def copy_file(source: str, destination: str, mode: str = 'auto') -> str:
+    """ Put a copy of the source at the destination, replacing whatever is there, and return how it was done
+
+    A copy is given the modification time of the source, so that up_to_date() can tell it doesn't need to be
+    copied again. If the mode can't be used, say because a hard link can't be made across file systems or the file
+    system doesn't support reflinks, the file is copied instead.
+
+        Parameters
+        ----------
+        source, destination : str
+            The file to copy, and where to put it
+
+        mode : str
+            How to copy the file, one of
+                copy: copy the contents
+                hardlink: make another name for the source file, which takes no space, but if the copy is changed
+                    then so is the source
+                reflink: make a copy that shares the blocks of the source until one of them is changed, which is
+                    as quick as a hard link. APFS, btrfs and xfs support them.
+                symlink: link to the source, which only works as long as the source is there
+                auto: a reflink, or a copy if there can't be one. It never makes a hard link, that has to be
+                    asked for.
+
+        Returns the way the file was copied, one of copy, hardlink, reflink or symlink
+    """
+    methods = _methods(mode)
+
+    # Make the copy under another name, so that an interrupted copy is never mistaken for a finished one
+    partial = f'{destination}.partial'
+    for (index, (method, function)) in enumerate(methods):
+        if os.path.lexists(partial):
+            os.remove(partial)
+        try:
+            function(source, partial)
+        except OSError:
+            if index == len(methods) - 1:
+                if os.path.lexists(partial):
+                    os.remove(partial)
+                raise
+            continue
+        if method in ('copy', 'reflink'):
+            stat = os.stat(source)
+            os.utime(partial, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        os.replace(partial, destination)
+        return method
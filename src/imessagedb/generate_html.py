@@ -1,25 +1,253 @@
 from datetime import datetime
+import os
 import re
 import string
 import imessagedb
 from imessagedb.message import Message
 from imessagedb.messages import Messages
-from alive_progress import alive_bar
+from imessagedb.conversion_pool import ConversionPool
+from imessagedb.conversion_cache import ConversionCache
+from imessagedb.export_state import ExportState
+from imessagedb.page_pool import PagePool
+from imessagedb.utils import local_day, day_names, unix_time
+from imessagedb import profiling
+from alive_progress import alive_bar, config_handler
 
 url_pattern = re.compile(r'((https?):((//)|(\\\\))+[\w\d:#@%/;$()~_?+-=\\.&]*)', re.MULTILINE | re.UNICODE)
 mailto_pattern = re.compile(r'([\w\-.]+@(\w[\w\-]+\.)+[\w\-]+)', re.MULTILINE | re.UNICODE)
 
+# The pages are written through a large buffer, since they are written a row at a time
+_WRITE_BUFFER_SIZE = 1024 * 1024
+
+# The options of the progress bar, once it is known which of them this version of alive-progress takes
+_bar_options = None
+
+
+def _progress_bar_options() -> dict:
+    """ The count is shown with commas, by the versions of alive-progress that have the option """
+    global _bar_options
+    if _bar_options is None:
+        try:
+            config_handler(comma=True)
+            _bar_options = {'comma': True}
+        except ValueError:
+            _bar_options = {}
+    return _bar_options
+
 
 def _replace_url_to_link(value: str) -> str:
     """ From https://gist.github.com/guillaumepiot/4539986 """
 
-    # Replace url to link
-    value = url_pattern.sub(r'<a href="\1" target="_blank">\1</a>', value)
+    # Replace url to link. Most messages have neither, so the patterns are only run if they can match
+    if ':' in value:
+        value = url_pattern.sub(r'<a href="\1" target="_blank">\1</a>', value)
     # Replace email to mailto
-    value = mailto_pattern.sub(r'<a href="mailto:\1">\1</a>', value)
+    if '@' in value:
+        value = mailto_pattern.sub(r'<a href="mailto:\1">\1</a>', value)
     return value
 
 
+class _RowRenderer:
+    """ Turns the messages into rows of html
+
+    Everything it needs is passed in, so it can be sent to another process to render pages there.
+    """
+
+    def __init__(self, inline: bool, floating: bool, additional_details: bool) -> None:
+        self._inline = inline
+        self._floating = floating
+        self._additional_details = additional_details
+
+    def render(self, parts: list) -> str:
+        """ Returns a page, from its parts, which are either strings or the arguments for a row """
+        return ''.join([i if isinstance(i, str) else self.generate_row(*i) for i in parts])
+
+    @staticmethod
+    def _generate_thread_row(who_data: dict, rowid: int, text: str) -> str:
+        style = who_data['style']
+        row_string = f'                <tr>\n' \
+                     f'                  <td class="reply_name" style="color: {who_data["name_color"]};"> ' \
+                     f'{who_data["name"]}: </td>\n' \
+                     f'                  <td class="reply_text_thread">\n' \
+                     f'                    <a href="#{rowid}">\n' \
+                     f'                      <button class="reply_text_{style}" style="background: ' \
+                     f'{who_data["background_color"]};"> ' \
+                     f'{text}</button>\n' \
+                     f'                    </a>\n' \
+                     f'                  </td>\n' \
+                     f'                </tr>\n'
+        return row_string
+
+    def _generate_thread_table(self, thread: list, style: str) -> str:
+        rows = ''.join([self._generate_thread_row(*i) for i in thread])
+        return f'              <table class="thread_table_{style}">\n' \
+               f'{rows}' \
+               f'              </table>\n' \
+               f'              <p>\n'
+
+    def generate_row(self, message: Message, day: str, who_data: dict, thread: list, attachments: list) -> str:
+        """ Returns the row for a message
+
+            Parameters
+            ----------
+            message : Message
+                The message
+
+            day : str
+                The day of the week of the message
+
+            who_data : dict
+                The name and colors of who sent the message
+
+            thread : list
+                The name and colors, rowid and text of the messages in the thread before this one, or None
+
+            attachments : list
+                The rowid, skip, missing, popup type and html path of each attachment, or None if it isn't known
+        """
+        who = who_data['name']
+        style = who_data['style']
+
+        thread_table = ""
+        if thread is not None:
+            thread_table = self._generate_thread_table(thread, style)
+
+        # Generate the attachment string
+        attachments_array = []
+        for attachment in attachments:
+            # If the attachment listed does not exist, then just list is as missing and continue to the next one
+            if attachment is None:
+                attachments_array.append(' <span class="missing"> Attachment missing </span> ')
+                continue
+
+            (rowid, skip, missing, popup_type, html_path) = attachment
+            # If the attachment exists, but we have it marked to skip, skip it
+            if skip:
+                continue
+
+            # If the attachment exists, but is marked as missing, list it as missing and continue
+            if missing:
+                attachments_array.append(' <span class="missing"> Attachment missing </span> ')
+                continue
+
+            if self._floating:
+                box_name = f'PopUp{rowid}'
+                image_box = f'<div class="imageBox" id="PopUp{rowid}">  <img src="" /> </div>'
+            else:
+                box_name = 'picbox'
+                image_box = ''
+
+            if popup_type == 'Picture':
+                if self._inline:
+                    attachment_string = f'<p><a href="{html_path}" target="_blank">' \
+                                        f'<img src="{html_path}" target="_blank"/><p>' \
+                                        f' {html_path} </a>\n'
+                else:
+                    attachment_string = f'''<a href="{html_path}" target="_blank"
+            onMouseOver="ShowPicture('{box_name}',1,'{html_path}')" 
+            onMouseOut="ShowPicture('{box_name}',0)"> {html_path} </a>
+'''
+            elif popup_type == 'Audio':
+                # Not going to do popups for audio, just inline
+                attachment_string = f'<p><audio controls>  <source src="{html_path}" ' \
+                                    f'type="audio/mp3"></audio> <a href="{html_path}" ' \
+                                    f'target="_blank"> {html_path} </a>\n'
+            elif popup_type == 'Video':
+                if self._inline:
+                    attachment_string = f'<p><video controls>  <source src="{html_path}" ' \
+                                        f' type="video/mp4"></video> <p><a href="{html_path}"' \
+                                        f' target="_blank"> {html_path} </a>\n'
+                else:
+                    attachment_string = f'''<a href="{html_path}" target="_blank"
+            onMouseOver="ShowMovie('{box_name}', 1, '{html_path}')"> {html_path} </a>
+'''
+
+            else:
+                attachment_string = f'<a href="{html_path}" target="_blank"> ' \
+                                    f'{html_path} </a>\n'
+
+            attachments_array.append(f' <p> {attachment_string} {image_box} ')
+        attachments_string = ''.join(attachments_array)
+
+        # Structure of the text row. The first three columns are normal, the fourth column is complex
+        #   <tr>
+        #     <td> date
+        #     <td> who
+        #     <td>
+        #       <table>
+        #         <tr hidden>
+        #           <td> Edited Row
+        #         </tr>
+        #         <tr>
+        #           <td> Text of message (edited if required)
+        #           <td hidden> extra text
+        #           <td> info button (if configured)
+        #         <tr>
+
+        text = _replace_url_to_link(f'{message.text} {attachments_string}')
+
+        # Check for edits on the text. If there are edits, then set up the html to allow for that. The row
+        #   doesn't exist if there is no edits
+
+        edited_string = ""
+        text_cell_edit_row = ""
+
+        if len(message.edits) > 0:
+            edits = ''.join([f'                "{i["text"]} <p>\n' for i in message.edits])
+            edit_table = f'              <div class="edits_{style}">\n' \
+                         f'{edits}' \
+                         f'              </div>\n'
+            edited_string = f'<sub><button class="edited_button"' \
+                            f' onclick="ToggleDisplay(\'{message.rowid}editTable\')"> Edited </button></sub>'
+            text_cell_edit_row = f'          <tr id={message.rowid}editTable class="edits">\n' \
+                                 f'            <td>\n' \
+                                 f'{edit_table} ' \
+                                 f'            </td>\n ' \
+                                 f'          </tr>\n'
+
+        # Check for if we want additional data
+
+        info_text = ""
+        info_button = ""
+        if self._additional_details:
+            info_text = f'            <td class="infocell" id={message.rowid}info>\n ' \
+                        f'              <table>\n' \
+                        f'                <tr>\n' \
+                        f'                  <td> ChatID: {message.chat_id} </td>\n' \
+                        f'                </tr>\n' \
+                        f'              </table>\n' \
+                        f'            </td>\n'
+            info_button = f'            <td class="button-wrapper"> <button class="text_{style}" ' \
+                          f'onclick="ToggleDisplay(\'{message.rowid}info\')"> ℹ️ </button> </td>\n'
+
+        # Put together the row cells
+
+        date_cell = f'      <td class="date"> {day} {message.date} </td>\n'
+        name_cell = f'      <td class="name_{style}" style="color: {who_data["name_color"]};"> {who}: </td>\n'
+
+        text_cell = f'      <td>\n ' \
+                    f'        <table>\n' \
+                    f'{text_cell_edit_row}' \
+                    f'          <tr>\n' \
+                    f'            <td class="text_{style}" style="background: {who_data["background_color"]};">\n' \
+                    f'{thread_table}' \
+                    f'              {text} {edited_string}\n' \
+                    f'            </td>\n' \
+                    f'{info_text}' \
+                    f'{info_button}' \
+                    f'          </tr>\n' \
+                    f'        </table>\n' \
+                    f'      </td>\n'
+
+        row_string = f'    <tr id={message.rowid}>\n' \
+                     f'{date_cell}' \
+                     f'{name_cell}' \
+                     f'{text_cell}' \
+                     f'    </tr>\n'
+
+        return row_string
+
+
 class HTMLOutput:
     """ Creates an HTML file (or string) from a Messages list
 
@@ -37,6 +265,14 @@ class HTMLOutput:
     skip attachments = False :
                 If true, attachments will not be available in the HTML output
 
+    page processes = 0 :
+                The number of processes to render the pages of split output in at the same time. With 0, the
+                pages are rendered one after another. The output is the same either way.
+
+    retain html = False :
+                When writing to a file, the html is only written, so the memory used stays the same however long
+                the conversation is. If true, a copy is also kept, so that it can be printed or saved again.
+
     In the DISPLAY section, the following impact the output:
 
     inline attachments = False :
@@ -60,7 +296,8 @@ class HTMLOutput:
         The background color of the thread in replies
     """
 
-    def __init__(self, database, me: str, messages: Messages, inline: bool = False, output_file: str = None) -> None:
+    def __init__(self, database, me: str, messages: Messages, inline: bool = False, output_file: str = None,
+                 state: ExportState = None) -> None:
         """
             Parameters
             ----------
@@ -77,12 +314,15 @@ class HTMLOutput:
                 Display attachments inline or not
 
             output_file : str
-                The name of the output file"""
+                The name of the output file
+
+            state : imessagedb.ExportState
+                The state of the last export to the output file. If it is given, the messages are added to the
+                end of that export instead of starting a new one"""
 
         self._database = database
         self._me = me
         self._messages = messages
-        self._attachment_list = self._database.attachment_list
         self._inline = inline
 
         self._name_map = {}
@@ -95,13 +335,51 @@ class HTMLOutput:
         self._file_end_date: datetime = None
         self._previous_range: str = None
         self._last_row_had_conversion = False
-
+        self._previous_day = ''
+        self._last_rowid = None
+        self._total_messages = len(self._messages)
+        self._state = state if output_file is not None else None
+        self._replace_summary = False
+
+        # Without an output file, the copy is the only place the html goes
+        self._retain = output_file is None or self._database.control.getboolean('retain html', fallback=False)
+
+        self._incremental = self._database.control.getboolean('incremental', fallback=False)
+        self._renderer = _RowRenderer(
+            inline=self._inline,
+            floating=self._database.config['DISPLAY'].get('popup location', fallback='floating') == 'floating',
+            additional_details=self._database.control.getboolean('additional details', fallback=False))
+
+        # Attachments are copied and converted in the background while the HTML is generated
+        jobs = self._database.control.getint('jobs', fallback=None)
+        timeout = self._database.control.getfloat('job timeout', fallback=None)
+        self._conversion_cache = None
+        if self._database.control.getboolean('conversion cache', fallback=True) and \
+                self._database.control.getboolean('copy', fallback=False) and \
+                not self._database.control.getboolean('skip attachments', fallback=False):
+            self._conversion_cache = ConversionCache(
+                self._database.control.get('cache directory', fallback='~/.cache/imessagedb'),
+                use_hash=self._database.control.getboolean('cache hash', fallback=False))
+        self._conversion_pool = ConversionPool(jobs=jobs, timeout=timeout, cache=self._conversion_cache)
+
+        self._page_pool = None
+        self._page_filenames = []
         if output_file is not None:
             self._output_filename = output_file
             self._split_output = self._database.config.getint('DISPLAY', 'split output', fallback=0)
             self._previous_output_filename = None
             self._current_output_filename = f"{self._output_filename}.html"
-            self._output_file_handle = open(self._current_output_filename, "w")
+
+            # The pages of split output can be rendered at the same time, unless they are being added to, or a
+            #  copy is being kept
+            page_processes = self._database.control.getint('page processes', fallback=0)
+            if page_processes > 0 and self._split_output > 0 and not self._incremental and not self._retain:
+                self._page_pool = PagePool(page_processes)
+
+            if self._state is not None:
+                self._resume(self._state.values)
+            else:
+                self._output_file_handle = self._open_page(self._current_output_filename)
         else:
             self._output_filename = None
 
@@ -113,17 +391,90 @@ class HTMLOutput:
         if end_time:
             date_string = f"{date_string} until {end_time}"
 
-        self._file_header_string = f'  <div id="file_summary">Exchanged {len(self._messages):,} total messages with ' \
-                                   f'{self._messages.title}{date_string}.</div><p>\n'
+        self._file_summary = f'Exchanged {self._total_messages:,} total messages with ' \
+                             f'{self._messages.title}{date_string}.'
+        self._file_header_string = f'  <div id="file_summary">{self._file_summary}</div><p>\n'
 
-        self._html_array.append(self._generate_table(self._messages))
-        self._print_and_save('</body>\n</html>\n', self._html_array, eof=True)
+        with profiling.stage('html output'):
+            self._html_array.append(self._generate_table(self._messages))
+            self._print_and_save('</body>\n</html>\n', self._html_array, eof=True)
+        if self._output_filename is not None:
+            self._output_file_handle.close()
+            if self._page_pool is not None:
+                with profiling.stage('wait for pages'):
+                    self._page_pool.wait()
+            if self._incremental:
+                self._save_state()
+            if profiling.active is not None:
+                profiling.count('html bytes written', sum(os.path.getsize(i) for i in self._page_filenames))
+
+        with profiling.stage('wait for attachments'):
+            self._conversion_pool.wait()
+        if self._conversion_cache is not None:
+            self._conversion_cache.close()
 
     def __repr__(self) -> str:
         return ''.join(self._html_array)
 
+    def _open_page(self, filename: str):
+        """ Returns the file to write a page to, or a page to be rendered in the page pool """
+        self._page_filenames.append(filename)
+        profiling.count('html pages')
+        if self._page_pool is not None:
+            return self._page_pool.open(filename, self._renderer)
+        return open(filename, "w", buffering=_WRITE_BUFFER_SIZE)
+
+    def _resume(self, values: dict) -> None:
+        """ Pick up where the last export left off, on its final page just before its last table was closed """
+        self._current_output_filename = values['current_output_filename']
+        self._previous_output_filename = values['previous_output_filename']
+        self._previous_range = values['previous_range']
+        self._current_messages_file = values['current_messages_file']
+        self._current_messages_processed = values['current_messages_processed']
+        self._file_start_date = datetime.fromisoformat(values['file_start_date'])
+        self._file_end_date = datetime.fromisoformat(values['file_end_date'])
+        self._previous_day = values['previous_day']
+        self._day = values['day']
+        self._last_rowid = values['last_rowid']
+        self._total_messages += values['total_messages']
+
+        # Keep the colors the same as the last export
+        for (handle_id, who_data) in values['name_map']:
+            next(self._color_list)
+            self._name_map[handle_id] = who_data
+
+        # The summary at the top of this page is from the last export, so it has to be replaced
+        self._replace_summary = True
+
+        self._page_filenames.append(self._current_output_filename)
+        self._output_file_handle = open(self._current_output_filename, "r+", buffering=_WRITE_BUFFER_SIZE)
+        self._output_file_handle.seek(values['final_page_offset'])
+        self._output_file_handle.truncate()
+
+    def _save_state(self) -> None:
+        """ Save what was written, so the next export can add to it """
+        if self._last_rowid is None:
+            return
+        state = ExportState(self._output_filename, {
+            'settings': ExportState.settings(self._database, self._messages.title),
+            'last_rowid': self._last_rowid,
+            'total_messages': self._total_messages,
+            'current_output_filename': self._current_output_filename,
+            'previous_output_filename': self._previous_output_filename,
+            'previous_range': self._previous_range,
+            'current_messages_file': self._current_messages_file,
+            'current_messages_processed': self._final_page_messages_processed,
+            'file_start_date': self._file_start_date.isoformat(),
+            'file_end_date': self._file_end_date.isoformat(),
+            'previous_day': self._previous_day,
+            'day': self._day,
+            'name_map': list(self._name_map.items()),
+            'final_page_offset': self._final_page_offset,
+            'final_page_size': os.path.getsize(self._current_output_filename)})
+        state.save()
+
     def save(self, filename: str) -> None:
-        """ Write the output to the output file"""
+        """ Write the output to the output file, which needs 'retain html' if it was written to a file already """
         file_handle = open(filename, "w")
         print('\n'.join(self._html_array), file=file_handle)
         file_handle.close()
@@ -135,7 +486,10 @@ class HTMLOutput:
         return
 
     def _print_and_save(self, message: str, array: list, new_day: bool = False, eof: bool = False) -> None:
-        """ Save to the output file while it is processing """
+        """ Save to the output file while it is processing
+
+        When the pages are rendered in the page pool, a row is the arguments for the renderer instead of a string.
+        """
 
         if self._current_messages_processed == 0:
             # If this is a new file, because it is either the first pass through, or if we need to create new file
@@ -157,12 +511,13 @@ class HTMLOutput:
                                   f'{" ":4s}</tr>\n{" ":2s}</table>\n\n')
             new_file_array.append(f'{" ":2s}<table class="main_table">\n{" ":2s}</table>\n')
 
-            for i in new_file_array:
-                array.append(i)
-                if self._output_filename is not None:
-                    print(i, end="", file=self._output_file_handle)
+            if self._retain:
+                array.extend(new_file_array)
+            if self._output_filename is not None:
+                self._output_file_handle.write(''.join(new_file_array))
 
-        array.append(message)
+        if self._retain:
+            array.append(message)
         self._current_messages_processed += 1
         if self._output_filename is None:  # We are not writing to a file
             return
@@ -174,13 +529,14 @@ class HTMLOutput:
             description_string = f' This page contains {self._current_messages_processed:,} messages from ' \
                                  f'{self._file_start_date.strftime("%A %Y-%m-%d")} to ' \
                                  f'{self._file_end_date.strftime("%A %Y-%m-%d")}.'
-            print(f' <script>\n'
-                  f'  el = document.getElementById("file_summary")\n'
-                  f'  new_text = el.innerHTML.concat("{description_string}")\n'
-                  f'  el.innerHTML = new_text\n',
-                  f' </script>\n', file=self._output_file_handle)
+            self._output_file_handle.write(f' <script>\n'
+                                           f'  el = document.getElementById("file_summary")\n'
+                                           f'{self._summary_replacement()}'
+                                           f'  new_text = el.innerHTML.concat("{description_string}")\n'
+                                           f'  el.innerHTML = new_text\n'
+                                           f'  </script>\n\n')
 
-        print(message, end="", file=self._output_file_handle)
+        self._output_file_handle.write(message)
 
         if new_day and 0 < self._split_output < self._current_messages_processed:
             total_processed = self._current_messages_processed
@@ -189,74 +545,60 @@ class HTMLOutput:
             self._previous_output_filename = self._current_output_filename
             self._current_output_filename = f"{self._output_filename}_{self._current_messages_file:02d}.html"
 
-            print(f'    <p><div class="next_file"><a href="file://{self._current_output_filename}">'
-                  f' Next Messages </a></div>\n', end="", file=self._output_file_handle)
+            self._output_file_handle.write(f'    <p><div class="next_file"><a href="file://'
+                                           f'{self._current_output_filename}"> Next Messages </a></div>\n')
             description_string = f' This page contains {total_processed:,} messages from ' \
                                  f'{self._file_start_date.strftime("%A %Y-%m-%d")} to ' \
                                  f'{self._file_end_date.strftime("%A %Y-%m-%d")}.'
             self._previous_range = f'<br><div style="font-size: 50%;">' \
                                    f'({self._file_start_date.strftime("%A %Y-%m-%d")} to ' \
                                    f'{self._file_end_date.strftime("%A %Y-%m-%d")})</div>'
-            print(f' <script>\n'
-                  f'  el = document.getElementById("file_summary")\n'
-                  f'  new_text = el.innerHTML.concat("{description_string}")\n'
-                  f'  el.innerHTML = new_text\n'
-                  f'  document.getElementById("next_page").innerHTML = '
-                  f'   "<a href=\'file://{self._current_output_filename}\'> Next Page &gt </a>"\n'
-                  f' </script>', file=self._output_file_handle)
-            print('</body>\n</html>\n', end="", file=self._output_file_handle)
+            self._output_file_handle.write(f' <script>\n'
+                                           f'  el = document.getElementById("file_summary")\n'
+                                           f'{self._summary_replacement()}'
+                                           f'  new_text = el.innerHTML.concat("{description_string}")\n'
+                                           f'  el.innerHTML = new_text\n'
+                                           f'  document.getElementById("next_page").innerHTML = '
+                                           f'   "<a href=\'file://{self._current_output_filename}\'>'
+                                           f' Next Page &gt </a>"\n'
+                                           f' </script>\n'
+                                           f'</body>\n</html>\n')
             self._output_file_handle.close()
             print(f"Creating output file {self._current_output_filename}")
-            self._output_file_handle = open(self._current_output_filename, "w")
-
-    def _generate_thread_row(self, message: Message) -> str:
-        if message.is_from_me:
-            who_data = self._get_name(0)
-        else:
-            who_data = self._get_name(message.handle_id)
-        style = who_data['style']
-
-        text = message.text
-        row_string = f'{" ":16s}<tr>\n' \
-                     f'{" ":18s}<td class="reply_name" style="color: {who_data["name_color"]};"> ' \
-                     f'{who_data["name"]}: </td>\n' \
-                     f'{" ":18s}<td class="reply_text_thread">\n' \
-                     f'{" ":20s}<a href="#{message.rowid}">\n' \
-                     f'{" ":22s}<button class="reply_text_{style}" style="background: ' \
-                     f'{who_data["background_color"]};"> ' \
-                     f'{text}</button>\n' \
-                     f'{" ":20s}</a>\n' \
-                     f'{" ":18s}</td>\n' \
-                     f'{" ":16s}</tr>\n'
-        return row_string
+            self._output_file_handle = self._open_page(self._current_output_filename)
 
-    def _generate_thread_table(self, message_list: list, style: str) -> str:
-        table_string = f'{" ":14s}<table class="thread_table_{style}">\n'
-        for message in message_list:
-            table_string = f'{table_string}{self._generate_thread_row(message)}'
-        table_string = f'{table_string}' \
-                       f'{" ":14s}</table>\n' \
-                       f'{" ":14s}<p>\n'
-        return table_string
+    def _summary_replacement(self) -> str:
+        """ The script to replace the summary at the top of a page that was started by the last export """
+        if not self._replace_summary:
+            return ''
+        # Only the page that was picked up from the last export has an old summary
+        self._replace_summary = False
+        return f'  el.innerHTML = "{self._file_summary}"\n'
 
     def _generate_table(self, message_list: Messages) -> str:
         table_array = []
-        self._print_and_save(f'{" ":2s}<table class="main_table">\n', table_array)
+        # When adding to the last export, its last table is still open
+        if self._state is None:
+            self._print_and_save(f'{" ":2s}<table class="main_table">\n', table_array)
 
-        previous_day = ''
+        previous_day = self._previous_day
+        # The days are compared as numbers, and only named when they change
+        current_day = None
 
         message_count = 0
-        with alive_bar(len(message_list), title="Generating HTML", stats="({rate}, eta: {eta})", comma=True) as bar:
+        with alive_bar(len(message_list), title="Generating HTML", stats="({rate}, eta: {eta})",
+                       **_progress_bar_options()) as bar:
             for message in message_list:
                 message_count = message_count + 1
 
-                today = message.date[:10]
+                day = local_day(message.database_date)
+                if day != current_day:
+                    current_day = day
+                    (today, weekday) = day_names(day)
                 if today != previous_day:
                     previous_day = today
 
-                    message_date = datetime(int(message.date[0:4]), int(message.date[5:7]), int(message.date[8:10]),
-                                            int(message.date[11:13]), int(message.date[14:16]),
-                                            int(message.date[17:19]))
+                    message_date = datetime.fromtimestamp(unix_time(message.database_date))
 
                     if self._file_start_date is None:
                         self._file_start_date = message_date
@@ -266,14 +608,26 @@ class HTMLOutput:
                     self._print_and_save(f'{" ":2s}</table>\n\n', table_array, new_day=True)
                     self._print_and_save(f'{" ":2s}<table class="main_table">\n', table_array)
 
-                    self._day = message_date.strftime('%a')
+                    self._day = weekday
                 self._last_row_had_conversion = False
-                self._print_and_save(self._generate_row(message), table_array)
+                if self._page_pool is not None:
+                    # The row is rendered with the rest of its page
+                    self._print_and_save(self._row_job(message), table_array)
+                else:
+                    self._print_and_save(self._generate_row(message), table_array)
+                if self._last_rowid is None or message.rowid > self._last_rowid:
+                    self._last_rowid = message.rowid
                 if self._last_row_had_conversion:
                     bar()
                 else:
                     bar(skipped=True)
 
+        # Remember where the final page can be picked up again by the next export
+        self._previous_day = previous_day
+        if self._incremental and self._output_filename is not None:
+            self._final_page_offset = self._output_file_handle.tell()
+            self._final_page_messages_processed = self._current_messages_processed
+
         self._print_and_save(f'{" ":2s}</table>\n', table_array)
         return ''.join(table_array)
 
@@ -315,180 +669,42 @@ class HTMLOutput:
 
         return self._name_map[handle_id]
 
-    def _generate_row(self, message: Message) -> str:
-        # Specify if the message is from me, or the other person
+    def _row_job(self, message: Message) -> tuple:
+        """ Returns what the renderer needs for a row, doing the parts that depend on the rows before it """
+        # Specify if the message is from me, or the other person. The colors go to people in the order they appear
         if message.is_from_me:
             who_data = self._get_name(0)
         else:
             who_data = self._get_name(message.handle_id)
-        who = who_data['name']
-        style = who_data['style']
-
-        # Check to see if we want the media box floating or fixed
-        floating_option = self._database.config['DISPLAY'].get('popup location', fallback='floating')
-        floating = floating_option == 'floating'
 
         # If this message is part of a thread, then show the messages in the thread before it
-        thread_table = ""
-        if message.thread_originator_guid:
-            if message.thread_originator_guid in self._messages.guids:
-                original_message = self._messages.guids[message.thread_originator_guid]
-                thread_list = original_message.thread
-                thread_list[original_message.rowid] = original_message
-                print_thread = []
-                # sort the threads by the date sent
-                for i in sorted(thread_list.values(), key=lambda x: x.date):
-                    if i == message:  # stop at the current message
-                        break
-                    print_thread.append(i)
-                thread_table = self._generate_thread_table(print_thread, style)
+        thread = None
+        print_thread = self._messages.thread_before(message)
+        if print_thread is not None:
+            thread = [(self._get_name(0) if i.is_from_me else self._get_name(i.handle_id), i.rowid, i.text)
+                      for i in print_thread]
 
-        # Generate the attachment string
-        attachments_string = ""
+        attachments = []
         if message.attachments:
+            attachment_list = self._messages.attachment_list.attachment_list
             for attachment_key in message.attachments:
-                # If the attachment listed does not exist, then just list is as missing and continue to the next one
-                if attachment_key not in self._attachment_list.attachment_list:
-                    attachments_string = f'{attachments_string} <span class="missing"> Attachment missing </span> '
-                    continue
-
-                attachment = self._attachment_list.attachment_list[attachment_key]
-                # If the attachment exists, but we have it marked to skip, skip it
-                if attachment.skip:
+                if attachment_key not in attachment_list:
+                    attachments.append(None)
                     continue
-
-                # If the attachment exists, but is marked as missing, list it as missing and continue
-                if attachment.missing:
-                    attachments_string = f'{attachments_string} <span class="missing"> Attachment missing </span> '
+                attachment = attachment_list[attachment_key]
+                if attachment.skip or attachment.missing:
+                    attachments.append((attachment.rowid, attachment.skip, attachment.missing, None, None))
                     continue
-
-                # If we should copy the attachment, copy it or convert it
+                # If we should copy the attachment, have it copied or converted
                 if attachment.copy:
-                    if attachment.conversion_type == 'HEIC':
-                        attachment.convert_heic_image(attachment.original_path, attachment.destination_path)
-                        self._last_row_had_conversion = True
-                    elif attachment.conversion_type == 'Audio' or attachment.conversion_type == 'Video':
-                        attachment.convert_audio_video(attachment.original_path, attachment.destination_path)
-                        self._last_row_had_conversion = True
-                    else:
-                        attachment.copy_attachment()
-                        self._last_row_had_conversion = True
-
-                if floating:
-                    box_name = f'PopUp{attachment.rowid}'
-                    image_box = f'<div class="imageBox" id="PopUp{attachment.rowid}">  <img src="" /> </div>'
-                else:
-                    box_name = 'picbox'
-                    image_box = ''
-
-                if attachment.popup_type == 'Picture':
-                    if self._inline:
-                        attachment_string = f'<p><a href="{attachment.html_path}" target="_blank">' \
-                                            f'<img src="{attachment.html_path}" target="_blank"/><p>' \
-                                            f' {attachment.html_path} </a>\n'
-                    else:
-                        attachment_string = f'''<a href="{attachment.html_path}" target="_blank"
-            onMouseOver="ShowPicture('{box_name}',1,'{attachment.html_path}')" 
-            onMouseOut="ShowPicture('{box_name}',0)"> {attachment.html_path} </a>
-'''
-                elif attachment.popup_type == 'Audio':
-                    # Not going to do popups for audio, just inline
-                    attachment_string = f'<p><audio controls>  <source src="{attachment.html_path}" ' \
-                                        f'type="audio/mp3"></audio> <a href="{attachment.html_path}" ' \
-                                        f'target="_blank"> {attachment.html_path} </a>\n'
-                elif attachment.popup_type == 'Video':
-                    if self._inline:
-                        attachment_string = f'<p><video controls>  <source src="{attachment.html_path}" ' \
-                                            f' type="video/mp4"></video> <p><a href="{attachment.html_path}"' \
-                                            f' target="_blank"> {attachment.html_path} </a>\n'
-                    else:
-                        attachment_string = f'''<a href="{attachment.html_path}" target="_blank"
-            onMouseOver="ShowMovie('{box_name}', 1, '{attachment.html_path}')"> {attachment.html_path} </a>
-'''
-
-                else:
-                    attachment_string = f'<a href="{attachment.html_path}" target="_blank"> ' \
-                                        f'{attachment.html_path} </a>\n'
-
-                attachments_string = f'{attachments_string} <p> {attachment_string} {image_box} '
-
-        # Structure of the text row. The first three columns are normal, the fourth column is complex
-        #   <tr>
-        #     <td> date
-        #     <td> who
-        #     <td>
-        #       <table>
-        #         <tr hidden>
-        #           <td> Edited Row
-        #         </tr>
-        #         <tr>
-        #           <td> Text of message (edited if required)
-        #           <td hidden> extra text
-        #           <td> info button (if configured)
-        #         <tr>
-
-        text = _replace_url_to_link(f'{message.text} {attachments_string}')
-
-        # Check for edits on the text. If there are edits, then set up the html to allow for that. The row
-        #   doesn't exist if there is no edits
-
-        edited_string = ""
-        text_cell_edit_row = ""
-
-        if len(message.edits) > 0:
-            edit_table = f'{" ":14s}<div class="edits_{style}">\n'
-            for i in range(0, len(message.edits)):
-                edit_table = f'{edit_table}{" ":16s}"{message.edits[i]["text"]} <p>\n'
-            edit_table = f'{edit_table}{" ":14s}</div>\n'
-            edited_string = f'<sub><button class="edited_button"' \
-                            f' onclick="ToggleDisplay(\'{message.rowid}editTable\')"> Edited </button></sub>'
-            text_cell_edit_row = f'{" ":10s}<tr id={message.rowid}editTable class="edits">\n' \
-                                 f'{" ":12s}<td>\n' \
-                                 f'{edit_table} ' \
-                                 f'{" ":12s}</td>\n ' \
-                                 f'{" ":10s}</tr>\n'
-
-        # Check for if we want additional data
-
-        info_text = ""
-        info_button = ""
-        if self._database.control.getboolean('additional details', fallback=False):
-            info_text = f'{" ":12s}<td class="infocell" id={message.rowid}info>\n ' \
-                        f'{" ":14s}<table>\n' \
-                        f'{" ":16s}<tr>\n' \
-                        f'{" ":18s}<td> ChatID: {message.chat_id} </td>\n' \
-                        f'{" ":16s}</tr>\n' \
-                        f'{" ":14s}</table>\n' \
-                        f'{" ":12s}</td>\n'
-            info_button = f'{" ":12s}<td class="button-wrapper"> <button class="text_{style}" ' \
-                          f'onclick="ToggleDisplay(\'{message.rowid}info\')"> ℹ️ </button> </td>\n'
-
-        # Put together the row cells
+                    self._conversion_pool.submit(attachment)
+                    self._last_row_had_conversion = True
+                attachments.append((attachment.rowid, False, False, attachment.popup_type, attachment.html_path))
 
-        date_cell = f'{" ":6s}<td class="date"> {self._day} {message.date} </td>\n'
-        name_cell = f'{" ":6s}<td class="name_{style}" style="color: {who_data["name_color"]};"> {who}: </td>\n'
+        return message, self._day, who_data, thread, attachments
 
-        text_cell = f'{" ":6s}<td>\n ' \
-                    f'{" ":8s}<table>\n' \
-                    f'{text_cell_edit_row}' \
-                    f'{" ":10s}<tr>\n' \
-                    f'{" ":12s}<td class="text_{style}" style="background: {who_data["background_color"]};">\n' \
-                    f'{thread_table}' \
-                    f'{" ":14s}{text} {edited_string}\n' \
-                    f'{" ":12s}</td>\n' \
-                    f'{info_text}' \
-                    f'{info_button}' \
-                    f'{" ":10s}</tr>\n' \
-                    f'{" ":8s}</table>\n' \
-                    f'{" ":6s}</td>\n'
-
-        row_string = f'{" ":4s}<tr id={message.rowid}>\n' \
-                     f'{date_cell}' \
-                     f'{name_cell}' \
-                     f'{text_cell}' \
-                     f'{" ":4s}</tr>\n'
-
-        return row_string
+    def _generate_row(self, message: Message) -> str:
+        return self._renderer.generate_row(*self._row_job(message))
 
     def _generate_head(self) -> str:
         popup = self._database.config['DISPLAY'].get('popup location', fallback='upper right')
@@ -1,6 +1,7 @@
 from termcolor import colored
-from datetime import datetime
 import string
+from imessagedb import profiling
+from imessagedb.utils import local_day, day_names
 
 
 class TextOutput:
@@ -29,13 +30,16 @@ class TextOutput:
 
 
         reply text color = light_grey :
-                    The color for the reply text """
+                    The color for the reply text
+
+        With an output file, each line is written to it as it is made, so the text of a long conversation isn't
+        all kept in memory, and save() and print() have nothing left to write. Without one, the lines are kept
+        for save(), print() and str(). """
 
     def __init__(self, database, me: str, messages, output_file=None) -> None:
         self._database = database
         self._me = me
         self._messages = messages
-        self._attachment_list = self._database.attachment_list
         self._output_file = output_file
         self._color_list = self._get_next_color()
         self._name_map = {}
@@ -53,10 +57,12 @@ class TextOutput:
         if end_time:
             date_string = f"{date_string} until {end_time}"
 
-        header_string = f"Exchanged {len(self._messages.message_list):,} messages with " \
+        header_string = f"Exchanged {len(self._messages):,} messages with " \
                         f"{self._messages.title} {date_string}"
-        self._string_array = [header_string]
-        self._get_messages()
+        self._string_array = []
+        self._write(header_string)
+        with profiling.stage('text output'):
+            self._get_messages()
         return
 
     def _get_name(self, handle_id: str) -> dict:
@@ -73,26 +79,19 @@ class TextOutput:
 
         return self._name_map[handle_id]
 
-    def _print_thread(self, thread_header, current_message: str) -> str:
+    def _print_thread(self, thread_list: list) -> str:
         thread_string = ""
-        thread_list = thread_header.thread
-        thread_list[thread_header.rowid] = thread_header
-        for i in sorted(thread_list.values(), key=lambda x: x.date):
-            if i == current_message:
-                break
+        for i in thread_list:
             attachment_string = ""
             if i.attachments is not None:
                 attachment_string = f" Attachments: {i.attachments}"
-            thread_string = f'{thread_string}[{self._name_map[i.handle_id]["name"]}: {i.text}{attachment_string}] '
+            thread_string = f'{thread_string}[{self._get_name(i.handle_id)["name"]}: {i.text}{attachment_string}] '
         return thread_string
 
     def _get_messages(self) -> None:
-        for message in self._messages.message_list:
+        for message in self._messages:
             date = message.date
-
-            day = datetime(int(date[0:4]), int(date[5:7]), int(date[8:10]),
-                           int(date[11:13]), int(date[14:16]),
-                           int(date[17:19])).strftime('%a')
+            day = day_names(local_day(message.database_date))[1]
 
             if message.is_from_me:
                 who_data = self._get_name(0)
@@ -105,7 +104,7 @@ class TextOutput:
 
             if message.attachments:
                 attachments_array = []
-                attachment_list = self._database.attachment_list.attachment_list
+                attachment_list = self._messages.attachment_list.attachment_list
                 for i in message.attachments:
                     if i in attachment_list:
                         attachments_array.append(attachment_list[i].original_path)
@@ -113,12 +112,18 @@ class TextOutput:
                         attachments_array.append(f"Missing attachment ({i})")
 
                 attachment_string = f'Attachments: {",".join(attachments_array)}'
-            if message.thread_originator_guid:
-                if message.thread_originator_guid in self._messages.guids:
-                    original_message = self._messages.guids[message.thread_originator_guid]
-                    reply_to = self._color(f'Reply to: {self._print_thread(original_message, message)}',
-                                           self._reply_color)
-            self._string_array.append(f'<{day} {date}> {who}: {message.text} {reply_to} {attachment_string}')
+            thread_list = self._messages.thread_before(message)
+            if thread_list is not None:
+                reply_to = self._color(f'Reply to: {self._print_thread(thread_list)}', self._reply_color)
+            self._write(f'<{day} {date}> {who}: {message.text} {reply_to} {attachment_string}')
+
+    def _write(self, line: str) -> None:
+        """ Write a line to the output file, or keep it if there isn't one """
+        if self._output_file is None:
+            self._string_array.append(line)
+        else:
+            profiling.count('text characters written', len(line) + 1)
+            print(line, file=self._output_file)
 
     def _get_next_color(self):
         """ A generator function to return the next color"""
@@ -141,13 +146,21 @@ class TextOutput:
             return text
 
     def save(self) -> None:
-        """ Save the text output to the file """
-        print('\n'.join(self._string_array), file=self._output_file)
+        """ Save the text output to the file, which is already written, or print it without one """
+        if self._output_file is None:
+            self.print()
+            return
+        self._output_file.flush()
         return
 
     def print(self) -> None:
-        """ Print the text output to stdout """
-        print('\n'.join(self._string_array))
+        """ Print the text output to stdout, if it wasn't already written to an output file """
+        if self._output_file is not None:
+            self._output_file.flush()
+            return
+        text = '\n'.join(self._string_array)
+        profiling.count('text characters written', len(text) + 1)
+        print(text)
         return
 
     def __repr__(self) -> str:
@@ -1,34 +1,57 @@
 import plistlib
+import time
 from datetime import datetime
+from itertools import islice
 
 from imessagedb.utils import *
+from imessagedb.typedstream import attributed_body_text, TypedStreamError
+from imessagedb import profiling
 import imessagedb
 
 
 def _convert_attributed_body(encoded: bytes) -> str:
-    # This general logic was copied from
-    # https://github.com/my-other-github-account/imessage_tools/blob/master/imessage_tools.py, however
-    # I needed to make some improvements
-
-    text = encoded.split(b'NSNumber')[0]
-    text = text.split(b'NSString')[1]
-    text = text.split(b'NSDictionary')[0]
-    text = text[6:-12]
-    if b'\x01' in text:
-        text = text.split(b'\x01')[1]
-    if b'\x02' in text:
-        text = text.split(b'\x02')[1]
-    if b'\x00' in text:
-        text = text.split(b'\x00')[1]
-    if b'\x86' in text:
-        text = text.split(b'\x86')[0]
-    return text.decode('utf-8', errors='replace')
+    """ Returns the text of an attributedBody, or None if it can't be decoded """
+    profile = profiling.active
+    if profile is not None:
+        start = time.perf_counter()
+    try:
+        text = attributed_body_text(encoded)
+    except TypedStreamError:
+        if profile is not None:
+            profile.count('attributedBody not decoded')
+        return None
+    finally:
+        if profile is not None:
+            profile.add_time('decode attributedBody', time.perf_counter() - start)
+    if profile is not None:
+        profile.count('attributedBody decoded')
+        profile.count('attributedBody bytes decoded', len(encoded))
+    return text
+
+
+def _message_text(text: str, attributed_body: bytes) -> str:
+    """ Returns the text of a message, from the attributedBody if the text field is blank """
+
+    # There are a lot of messages that are saved into attributed_body instead of the text field
+    if (text is None or text == '' or text == ' ') and attributed_body is not None:
+        converted = _convert_attributed_body(attributed_body)
+        if converted is not None:
+            return converted
+    return text
+
+
+_NO_EDITS = ()
 
 
 class Message:
     """ Class for holding information about a message """
 
-    def __init__(self, database, rowid: int, guid: str, date: str, is_from_me: bool, handle_id: str,
+    __slots__ = ('_rowid', '_guid', '_date', '_is_from_me', '_handle_id', '_attributed_body',
+                 '_message_summary_info', '_text', '_reply_to_guid', '_thread_originator_guid',
+                 '_thread_originator_part', '_chat_id', '_attachments', '_thread', '_thread_position', '_text_decoded',
+                 '_edits')
+
+    def __init__(self, database, rowid: int, guid: str, date: int, is_from_me: bool, handle_id: str,
                  attributed_body: bytes, message_summary_info: bytes, text: str, reply_to_guid: str,
                  thread_originator_guid: str, thread_originator_part: str, chat_id: str, message_attachments: list):
         """
@@ -52,39 +75,110 @@ class Message:
         self._attributed_body = attributed_body
         self._message_summary_info = message_summary_info
         self._text = text
-        self._attributed_body = attributed_body
         self._reply_to_guid = reply_to_guid
         self._thread_originator_guid = thread_originator_guid
         self._thread_originator_part = thread_originator_part
         self._chat_id = chat_id
         self._attachments = message_attachments
-        self._thread = {}
-        self._edits = []
+        self._thread = None  # Most messages don't start a thread, so it is created when it is first used
+        self._thread_position = None
 
-        # There are a lot of messages that are saved into attributed_body instead of the text field.
-        #  There isn't a good way to convert this in Python that I've found, so I have to run a
-        #  program to do it. I need to fix this.
+        # The text and the edits are decoded the first time they are used, since a lot of messages never are
+        self._text_decoded = False
+        self._edits = None
 
-        if (self._text is None or text == '' or text == ' ') and self._attributed_body is not None:
-            self._text = _convert_attributed_body(self._attributed_body)
+    def _decode_text(self) -> None:
+        self._text = _message_text(self._text, self._attributed_body)
+        self._attributed_body = None
+        self._text_decoded = True
 
+    def _decode_edits(self) -> None:
         # Edits are stored in message_summary_info
-        try:
-            plist = plistlib.loads(self._message_summary_info)
-            if 'ec' in plist:
-                for row in plist['ec']['0']:
-                    self._edits.append({'text': _convert_attributed_body(row['t']),
-                                        'date': convert_from_database_date(row['d'])})
-        except plistlib.InvalidFileException as exp:
-            pass
+        edits = []
+        # The keys of a binary plist are stored as plain strings, so if there's no 'ec' there are no edits
+        if self._message_summary_info and b'ec' in self._message_summary_info:
+            try:
+                plist = plistlib.loads(self._message_summary_info)
+                if 'ec' in plist:
+                    profiling.count('edits parsed', len(plist['ec']['0']))
+                    for row in plist['ec']['0']:
+                        edits.append({'text': _convert_attributed_body(row['t']) or '',
+                                      'date': convert_from_database_date(row['d'])})
+            except plistlib.InvalidFileException as exp:
+                pass
+        self._message_summary_info = None
+        # Most messages have no edits, so they share one empty tuple instead of having a list each
+        self._edits = edits or _NO_EDITS
+
+    def __eq__(self, other) -> bool:
+        # The same message can be read more than once, like from a MessageStore
+        if isinstance(other, Message):
+            return self._rowid == other._rowid
+        return NotImplemented
+
+    def __hash__(self) -> int:
+        return hash(self._rowid)
+
+    def __reduce__(self) -> tuple:
+        # A message is sent to another process on its own, without its thread, which is much faster than copying
+        #  each slot
+        return (Message, (None, self._rowid, self._guid, self._date, self._is_from_me, self._handle_id,
+                          self._attributed_body, self._message_summary_info, self._text, self._reply_to_guid,
+                          self._thread_originator_guid, self._thread_originator_part, self._chat_id,
+                          self._attachments), (self._edits, ))
+
+    def __setstate__(self, state: tuple) -> None:
+        # The edits are dropped from message_summary_info once they are decoded, so they are sent as they are
+        (self._edits, ) = state
+
+    def add_reply(self, message, keep: int = None) -> None:
+        """ Add a message to the thread that this message started
+
+        The replies have to be added in date order, so the thread stays sorted and each reply knows how many
+        messages are before it.
+
+            Parameters
+            ----------
+            message : Message
+                The reply
+
+            keep : int
+                Only keep this many of the latest replies, the default is to keep all of them. The positions of
+                the replies still count the ones that were dropped.
+        """
+        thread = self.thread
+        if thread:
+            position = next(reversed(thread.values()))._thread_position + 1
+        else:
+            position = 1
+        thread[message.rowid] = message
+        message._thread_position = position
+        if keep is not None and len(thread) > keep:
+            del thread[next(iter(thread))]
+
+    def thread_before(self, message) -> list:
+        """ Returns the messages in the thread that this message started, up to a reply, starting with this one
+
+            Parameters
+            ----------
+            message : Message
+                A reply in the thread. If it isn't one, the whole thread is returned
+        """
+        replies = self.thread.values()
+        reply = self._thread.get(message.rowid)
+        if reply is not None:
+            # The earliest replies may have been dropped
+            first = next(iter(replies))._thread_position
+            replies = islice(replies, reply._thread_position - first)
+        return [self, *replies]
 
     def __repr__(self) -> str:
         return_string = f'RowID: {self._rowid}' \
                         f' GUID: {self._guid}' \
-                        f' Date: {self._date}' \
+                        f' Date: {self.date}' \
                         f' From me: {self._is_from_me}' \
                         f' HandleID: {self._handle_id}' \
-                        f' Message: {self._text}' \
+                        f' Message: {self.text}' \
                         f' Originator Thread: {self._thread_originator_guid}' \
                         f' Reply Message: {self._reply_to_guid}' \
                         f' Thread Part: {self._thread_originator_part}' \
@@ -102,6 +196,12 @@ class Message:
 
     @property
     def date(self) -> str:
+        """ The date in local time, as 'YYYY-MM-DD HH:MM:SS' """
+        return format_database_date(self._date)
+
+    @property
+    def database_date(self) -> int:
+        """ The date as it is in the database, in nanoseconds since 2001-01-01 UTC """
         return self._date
 
     @property
@@ -114,19 +214,25 @@ class Message:
 
     @property
     def attributed_body(self) -> bytes:
+        """ The attributedBody from the database, which is dropped once the text has been decoded """
         return self._attributed_body
 
     @property
     def message_summary_info(self) -> bytes:
+        """ The message_summary_info from the database, which is dropped once the edits have been decoded """
         return self._message_summary_info
 
     @property
     def text(self) -> str:
+        if not self._text_decoded:
+            self._decode_text()
         return self._text
 
     @property
     def edits(self) -> list:
-        return self._edits
+        if self._edits is None:
+            self._decode_edits()
+        return self._edits or []
 
     @property
     def reply_to_guid(self) -> str:
@@ -144,6 +250,13 @@ class Message:
     def attachments(self) -> list:
         return self._attachments
 
+    @property
+    def thread_position(self) -> int:
+        """ The number of messages before this one in its thread, or None if it isn't a reply """
+        return self._thread_position
+
     @property
     def thread(self) -> dict:
+        if self._thread is None:
+            self._thread = {}
         return self._thread
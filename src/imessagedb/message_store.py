@@ -0,0 +1,224 @@
+from array import array
+from bisect import bisect_left
+from collections.abc import Mapping, Sequence
+
+from imessagedb.message import Message, _message_text
+
+_IS_FROM_ME = 1
+_TEXT_IS_NONE = 2
+
+
+class _Guids(Mapping):
+    """ The messages of a MessageStore by guid """
+
+    def __init__(self, store) -> None:
+        self._store = store
+
+    def __getitem__(self, guid: str) -> Message:
+        index = self._store.find(guid)
+        if index is None:
+            raise KeyError(guid)
+        return self._store.message(index)
+
+    def __contains__(self, guid) -> bool:
+        return self._store.find(guid) is not None
+
+    def __iter__(self):
+        for index in range(len(self._store)):
+            yield self._store.guid(index)
+
+    def __len__(self) -> int:
+        return len(self._store)
+
+
+class MessageStore(Sequence):
+    """ The messages of a conversation, kept in columns instead of as a Message object each
+
+    The numbers are kept in arrays, and the guids and the text in byte buffers with an array of where each one
+    starts. The fields that most messages don't have, like replies and attachments, are only kept for the
+    messages that have them. The text is decoded from the attributedBody as the message is added, so the raw
+    body isn't kept. A Message is created when one is read, so each one only lasts as long as it is used.
+    """
+
+    def __init__(self) -> None:
+        self._rowids = array('q')
+        self._dates = array('q')
+        self._handle_ids = array('q')
+        self._chat_ids = array('q')
+        self._flags = array('B')
+        self._guid_buffer = bytearray()
+        self._guid_offsets = array('q', [0])
+        self._text_buffer = bytearray()
+        self._text_offsets = array('q', [0])
+
+        # Only for the messages that have them
+        self._reply_to_guids = {}
+        self._thread_originator_guids = {}
+        self._thread_originator_parts = {}
+        self._summary_info = {}
+        self._attachments = {}
+        self._threads = {}
+        self._thread_positions = {}
+
+        self._order = None
+        self._guid_hashes = None
+        self._guid_hash_order = None
+
+    def append(self, row: tuple, attachments: list = None) -> int:
+        """ Add a message, returning its index
+
+            Parameters
+            ----------
+            row : tuple
+                The row of the message, from the Messages query
+
+            attachments : list
+                The attachments for this message
+        """
+        (rowid, guid, date, is_from_me, handle_id, attributed_body, message_summary_info, text,
+         reply_to_guid, thread_originator_guid, thread_originator_part, chat_id) = row
+
+        index = len(self._rowids)
+        self._rowids.append(rowid)
+        self._dates.append(date or 0)
+        self._handle_ids.append(handle_id or 0)
+        self._chat_ids.append(chat_id or 0)
+        self._guid_buffer += guid.encode('utf-8')
+        self._guid_offsets.append(len(self._guid_buffer))
+
+        flags = _IS_FROM_ME if is_from_me else 0
+        text = _message_text(text, attributed_body)
+        if text is None:
+            flags |= _TEXT_IS_NONE
+        else:
+            self._text_buffer += text.encode('utf-8', errors='surrogatepass')
+        self._text_offsets.append(len(self._text_buffer))
+        self._flags.append(flags)
+
+        if reply_to_guid:
+            self._reply_to_guids[index] = reply_to_guid
+        if thread_originator_guid:
+            self._thread_originator_guids[index] = thread_originator_guid
+        if thread_originator_part:
+            self._thread_originator_parts[index] = thread_originator_part
+        # Only the summaries with edits in them are needed
+        if message_summary_info and b'ec' in message_summary_info:
+            self._summary_info[index] = message_summary_info
+        if attachments:
+            self._attachments[index] = attachments
+        return index
+
+    def finish(self) -> None:
+        """ Index the guids, link the replies to their threads and sort the messages by date, once they are all
+        added """
+        hashes = array('q', (hash(self.guid(i)) for i in range(len(self._rowids))))
+        self._guid_hash_order = array('q', sorted(range(len(hashes)), key=hashes.__getitem__))
+        self._guid_hashes = array('q', (hashes[i] for i in self._guid_hash_order))
+
+        # A reply is only linked to a message that was added before it
+        for (index, guid) in self._thread_originator_guids.items():
+            originator = self.find(guid)
+            if originator is not None and originator < index:
+                thread = self._threads.setdefault(originator, array('q'))
+                thread.append(index)
+                self._thread_positions[index] = (originator, len(thread))
+
+        if any(self._dates[i] > self._dates[i + 1] for i in range(len(self._dates) - 1)):
+            self._order = array('q', sorted(range(len(self._dates)), key=self._dates.__getitem__))
+
+    def find(self, guid: str) -> int:
+        """ Returns the index of the message with the guid, or None """
+        if self._guid_hashes is None:
+            raise RuntimeError("The message store has to be finished before it can be searched")
+        value = hash(guid)
+        position = bisect_left(self._guid_hashes, value)
+        while position < len(self._guid_hashes) and self._guid_hashes[position] == value:
+            index = self._guid_hash_order[position]
+            if self.guid(index) == guid:
+                return index
+            position += 1
+        return None
+
+    def unlinked_replies(self):
+        """ Yields the index and the thread originator guid of the replies to messages that aren't in the store """
+        for (index, guid) in self._thread_originator_guids.items():
+            if self.find(guid) is None:
+                yield index, guid
+
+    def thread_before(self, message: Message) -> list:
+        """ Returns the messages in the thread of a reply that are before it, starting with the message that
+        started the thread, or None if it isn't a reply to a message in the store
+
+            Parameters
+            ----------
+            message : Message
+                A message from the store
+        """
+        index = self.find(message.guid)
+        if index not in self._thread_positions:
+            return None
+        (originator, position) = self._thread_positions[index]
+        return [self.message(originator, thread=False),
+                *(self.message(i, thread=False) for i in self._threads[originator][:position - 1])]
+
+    def guid(self, index: int) -> str:
+        return self._guid_buffer[self._guid_offsets[index]:self._guid_offsets[index + 1]].decode('utf-8')
+
+    def text(self, index: int) -> str:
+        if self._flags[index] & _TEXT_IS_NONE:
+            return None
+        return self._text_buffer[self._text_offsets[index]:self._text_offsets[index + 1]].decode(
+            'utf-8', errors='surrogatepass')
+
+    def message(self, index: int, thread: bool = True) -> Message:
+        """ Returns a Message for the message at the index, in the order they were added
+
+            Parameters
+            ----------
+            index : int
+                The index of the message
+
+            thread : bool
+                Whether to fill in the thread of replies, if the message started one
+        """
+        message = Message(None, self._rowids[index], self.guid(index), self._dates[index],
+                          self._flags[index] & _IS_FROM_ME, self._handle_ids[index], None,
+                          self._summary_info.get(index), self.text(index), self._reply_to_guids.get(index),
+                          self._thread_originator_guids.get(index), self._thread_originator_parts.get(index),
+                          self._chat_ids[index], self._attachments.get(index))
+        if thread and index in self._threads:
+            for reply in self._threads[index]:
+                message.add_reply(self.message(reply, thread=False))
+        return message
+
+    def __getitem__(self, position):
+        """ Returns the message at the position, in date order """
+        if isinstance(position, slice):
+            return [self[i] for i in range(*position.indices(len(self)))]
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError(position)
+        return self.message(self._order[position] if self._order is not None else position)
+
+    def __iter__(self):
+        for position in range(len(self)):
+            yield self[position]
+
+    def __len__(self) -> int:
+        return len(self._rowids)
+
+    @property
+    def guids(self) -> Mapping:
+        """ Returns a mapping of the messages by guid """
+        return _Guids(self)
+
+    @property
+    def nbytes(self) -> int:
+        """ Returns the number of bytes in the columns and buffers, not counting the sparse fields """
+        columns = (self._rowids, self._dates, self._handle_ids, self._chat_ids, self._flags, self._guid_offsets,
+                   self._text_offsets)
+        total = sum(len(i) * i.itemsize for i in columns) + len(self._guid_buffer) + len(self._text_buffer)
+        if self._guid_hashes is not None:
+            total += 2 * len(self._guid_hashes) * self._guid_hashes.itemsize
+        return total
@@ -1,12 +1,125 @@
+import json
+from collections import OrderedDict
+
 from imessagedb.utils import *
 from alive_progress import alive_bar
 from imessagedb.message import Message
+from imessagedb.message_store import MessageStore
+from imessagedb.attachments import Attachments
+from imessagedb.stats import stats_rows
+from imessagedb import profiling
+
+
+# The columns of a message, in the order Message takes them. The date is left as it is in the database, and
+#  only formatted when it is shown.
+_MESSAGE_COLUMNS = "message.rowid, message.guid, message.date, message.is_from_me, message.handle_id, " \
+                   " message.attributedBody, message.message_summary_info, message.text, " \
+                   "message.reply_to_guid, message.thread_originator_guid, message.thread_originator_part"
+
+
+def _fetch_messages_by_guid(database, guids: set) -> dict:
+    """ Returns the messages with the guids by guid, in one query
+
+    This is for the messages that started a thread before the messages that were asked for, like before the
+    start time or the last export, so only what is needed to show them in the thread is read.
+    """
+    result = {}
+    if not guids:
+        return result
+    cursor = database.cursor()
+    cursor.execute(f"select {_MESSAGE_COLUMNS}, null from message "
+                   "where message.guid in (select value from json_each(:guids))", {'guids': json.dumps(list(guids))})
+    for row in cursor.fetchall():
+        result[row[1]] = Message(database, *row, None)
+    cursor.close()
+    return result
+
+
+def _date_rules(database, parameters: dict) -> tuple:
+    """ Returns the rules on chat_message_join and on message for the start and end time, adding their values to
+    the parameters
+
+    The date range is on chat_message_join's copy of the message date, so that the messages of each chat are
+    found with a range of its (chat_id, message_date, message_id) index.
+    """
+    join_rules = []
+    rules = []
+    start_time = database.control.get('start time', fallback=None)
+    end_time = database.control.get('end time', fallback=None)
+    if start_time:
+        parameters['start_date'] = convert_to_database_date(start_time)
+        join_rules.append("cmj.message_date >= :start_date")
+        rules.append("message.date >= :start_date")
+    if end_time:
+        parameters['end_date'] = convert_to_database_date(end_time)
+        join_rules.append("cmj.message_date <= :end_date")
+        rules.append("message.date <= :end_date")
+    return join_rules, rules
+
+
+def _build_message_query(database, query_type: str, numbers: list = None, chat_id: str = None,
+                         min_rowid: int = None) -> tuple:
+    """ Returns the select string for the messages in a conversation, a cheap query for the number of rows,
+    a query for just the rowids of the messages, and the parameters for all three
+
+    The messages are found by joining handle to chat_handle_join to chat_message_join to message, and the
+    values are bound as named parameters, so the statements are the same from run to run. A message can be in
+    more than one of the chats of a person, so those are grouped into one row. The count only reads the
+    chat_message_join index, instead of scanning the message table a second time.
+    """
+
+    parameters = {}
+    if query_type == "person":
+        handle_names = []
+        for (i, number) in enumerate(numbers):
+            parameters[f'handle_{i}'] = number
+            handle_names.append(f':handle_{i}')
+        from_clause = "handle " \
+                      "join chat_handle_join chj on chj.handle_id = handle.rowid " \
+                      "join chat_message_join cmj on cmj.chat_id = chj.chat_id "
+        chat_rule = f"handle.id in ({', '.join(handle_names)})"
+        group_clause = "group by message.rowid "
+        chat_column = "min(cmj.chat_id)"
+        count_column = "count(distinct cmj.message_id)"
+
+    elif query_type == "chat":
+        parameters['chat_id'] = chat_id
+        from_clause = "chat_message_join cmj "
+        chat_rule = "cmj.chat_id = :chat_id"
+        group_clause = ""
+        chat_column = "cmj.chat_id"
+        count_column = "count(*)"
+
+    else:
+        raise KeyError
+
+    (join_rules, rules) = _date_rules(database, parameters)
+    join_rules.insert(0, chat_rule)
+    if min_rowid is not None:
+        parameters['min_rowid'] = int(min_rowid)
+        join_rules.append("cmj.message_id > :min_rowid")
+    join_where_clause = ' and '.join(join_rules)
+    where_clause = ' and '.join(join_rules + rules)
+
+    select_string = f"select {_MESSAGE_COLUMNS}, {chat_column} " \
+                    f"from {from_clause}" \
+                    "join message on message.rowid = cmj.message_id " \
+                    f"where {where_clause} " \
+                    f"{group_clause}" \
+                    "order by message.date asc"
+    count_string = f"select {count_column} from {from_clause}where {join_where_clause}"
+    rowid_string = f"select message.rowid from {from_clause}" \
+                   "join message on message.rowid = cmj.message_id " \
+                   f"where {where_clause}"
+
+    return select_string, count_string, rowid_string, parameters
 
 
 class Messages:
     """ All messages in a conversation or conversations with a particular person """
 
-    def __init__(self, database, query_type: str, title: str, numbers: list = None, chat_id: str = None) -> None:
+    def __init__(self, database, query_type: str, title: str, numbers: list = None, chat_id: str = None,
+                 min_rowid: int = None, rows: list = None, attachment_list: Attachments = None) -> None:
         """
                 Parameters
                 ----------
@@ -24,6 +137,13 @@ class Messages:
 
                 chat_id : str
                     The id of the chat
+
+                min_rowid : int
+                    Only get the messages after this one, default is all of them
+
+                rows, attachment_list : list, Attachments
+                    The messages, already fetched, as rows of the message query, and their attachments. They are
+                    used instead of querying the database, as BatchExport does.
                 """
 
         self._database = database
@@ -32,101 +152,134 @@ class Messages:
         self._chat_id = chat_id
         self._title = title
         self._guids = {}
-        self._message_list = {}
-
-        time_rules = []
-        time_where_clause = ""
-        start_time = self._database.control.get('start time', fallback=None)
-        end_time = self._database.control.get('end time', fallback=None)
-        if start_time:
-            database_start_date = convert_to_database_date(start_time)
-            time_rules.append(f"message.date >= {database_start_date}")
-        if end_time:
-            database_end_date = convert_to_database_date(end_time)
-            time_rules.append(f"message.date <= {database_end_date}")
-        if len(time_rules) > 0:
-            time_where_clause = f" and {' AND '.join(time_rules)}"
-
-        if self._query_type == "person":
-            numbers_string = "','".join(self._numbers)
-            where_clause = "rowid in (" \
-                           " select message_id from chat_message_join where chat_id in (" \
-                           "  select chat_id from chat_handle_join where handle_id in (" \
-                           f"   select rowid from handle where id in ('{numbers_string}')" \
-                           "  )" \
-                           " )" \
-                           f") {time_where_clause}"
-            select_string = "select message.rowid, guid, " \
-                            "datetime(message.date/1000000000 + " \
-                            "strftime('%s', '2001-01-01'),'unixepoch','localtime'), " \
-                            "message.is_from_me, message.handle_id, " \
-                            " message.attributedBody, message.message_summary_info, message.text, " \
-                            "reply_to_guid, thread_originator_guid, thread_originator_part, cmj.chat_id  " \
-                            "from message, chat_message_join cmj " \
-                            f"where message.rowid = cmj.message_id and {where_clause} " \
-                            "order by message.date asc"
-
-        elif self._query_type == "chat":
-            where_clause = f"rowid in (select message_id from chat_message_join where chat_id = {self._chat_id}) " \
-                           f" {time_where_clause}"
-            select_string = "select message.rowid, guid, " \
-                            "datetime(message.date/1000000000 + " \
-                            "strftime('%s', '2001-01-01'),'unixepoch','localtime'), " \
-                            "message.is_from_me, message.handle_id, " \
-                            " message.attributedBody, message.message_summary_info, message.text, " \
-                            "reply_to_guid, thread_originator_guid, thread_originator_part, cmj.chat_id  " \
-                            "from message, chat_message_join cmj " \
-                            f"where message.rowid = cmj.message_id and {where_clause} " \
-                            "order by message.date asc"
+        self._message_list = []
+        self._originators = {}
+        self._attachment_list = attachment_list
+
+        # A large conversation can be kept in columns, instead of as a Message object each
+        store = None
+        if self._database.control.getboolean('compact messages', fallback=False):
+            store = MessageStore()
+        self._store = store
+
+        with profiling.stage('fetch messages'):
+            if rows is not None:
+                self._add_messages(store, rows, lambda: None)
+            else:
+                self._get_messages(store, min_rowid)
 
-        else:
-            raise KeyError
+        with profiling.stage('sort messages'):
+            if store is not None:
+                store.finish()
+                self._guids = store.guids
+                self._sorted_message_list = store
+            else:
+                # The query returns them in date order, but make sure
+                self._message_list.sort(key=lambda x: x.database_date)
+                self._sorted_message_list = self._message_list
+        with profiling.stage('link threads'):
+            self._link_threads()
 
-        row_count_string = f"select count (*) from message where {where_clause}"
+    def _get_messages(self, store: MessageStore, min_rowid: int) -> None:
+        """ Fetch the messages, into the store if there is one """
+        (select_string, count_string, rowid_string, parameters) = _build_message_query(
+            self._database, self._query_type, self._numbers, self._chat_id, min_rowid=min_rowid)
 
-        self._database.connection.execute(row_count_string)
-        (row_count_total) = self._database.connection.fetchone()
-        row_count_total = row_count_total[0]
+        # Only get the attachments for the messages we are going to display
+        self._attachment_list = Attachments(self._database, message_filter=rowid_string,
+                                            message_parameters=parameters)
 
-        self._database.connection.execute(select_string)
+        self._database.connection.execute(count_string, parameters)
+        row_count_total = self._database.connection.fetchone()[0]
 
-        i = self._database.connection.fetchone()
-        skip_attachment = self._database.control.getboolean('skip attachments', fallback=False)
+        fetch_size = self._database.control.getint('fetch size', fallback=1000)
+        self._database.connection.execute(select_string, parameters)
 
         with alive_bar(row_count_total, title="Getting Messages", stats="({rate}, eta: {eta})") as bar:
-            message_count = 0
-            while i:
-                (rowid, guid, date, is_from_me, handle_id, attributed_body, message_summary_info, text,
-                 reply_to_guid, thread_originator_guid, thread_originator_part, chat_id) = i
-                message_count = message_count + 1
+            self._add_messages(store, fetch_rows(self._database.connection, fetch_size), bar)
+        profiling.count('rows fetched', row_count_total)
 
-                attachment_list = None
-                if not skip_attachment:
-                    if rowid in self._database.attachment_list.message_join:
-                        attachment_list = self._database.attachment_list.message_join[rowid]
+    def _add_messages(self, store: MessageStore, rows, bar) -> None:
+        """ Add the rows of the message query, into the store if there is one, calling bar for each """
+        skip_attachment = self._database.control.getboolean('skip attachments', fallback=False)
+        message_join = self._attachment_list.message_join if self._attachment_list is not None else {}
 
-                new_message = Message(self._database, rowid, guid, date, is_from_me, handle_id, attributed_body,
-                                      message_summary_info, text, reply_to_guid, thread_originator_guid,
-                                      thread_originator_part, chat_id, attachment_list)
-                self._guids[guid] = new_message
-                self._message_list[rowid] = new_message
+        for i in rows:
+            (rowid, guid, date, is_from_me, handle_id, attributed_body, message_summary_info, text,
+             reply_to_guid, thread_originator_guid, thread_originator_part, chat_id) = i
 
-                # Manage the thread
-                if thread_originator_guid and thread_originator_guid in self._guids:
-                    self._guids[thread_originator_guid].thread[rowid] = new_message
+            attachment_list = None
+            if not skip_attachment:
+                if rowid in message_join:
+                    attachment_list = message_join[rowid]
 
+            if store is not None:
+                store.append(i, attachment_list)
                 bar()
-                i = self._database.connection.fetchone()
-
-        self._sorted_message_list = sorted(self._message_list.values(), key=lambda x: x.date)
+                continue
+
+            new_message = Message(self._database, rowid, guid, date, is_from_me, handle_id, attributed_body,
+                                  message_summary_info, text, reply_to_guid, thread_originator_guid,
+                                  thread_originator_part, chat_id, attachment_list)
+            self._guids[guid] = new_message
+            self._message_list.append(new_message)
+            bar()
+
+    def _link_threads(self) -> None:
+        """ Link each reply to the message that started its thread, in date order, so that the messages before a
+        reply can be read straight from the thread. The ones that started before these messages are fetched in one
+        query. """
+        if self._store is not None:
+            # The store links the replies to the messages in it
+            replies = list(self._store.unlinked_replies())
+            self._originators = _fetch_messages_by_guid(self._database, {i[1] for i in replies})
+            for (index, guid) in replies:
+                if guid in self._originators:
+                    self._originators[guid].add_reply(self._store.message(index, thread=False))
+            return
+
+        missing = {i.thread_originator_guid for i in self._message_list
+                   if i.thread_originator_guid and i.thread_originator_guid not in self._guids}
+        self._originators = _fetch_messages_by_guid(self._database, missing)
+        for message in self._message_list:
+            guid = message.thread_originator_guid
+            if guid:
+                originator = self._guids.get(guid) or self._originators.get(guid)
+                if originator is not None and originator is not message:
+                    originator.add_reply(message)
+
+    def thread_before(self, message: Message) -> list:
+        """ Returns the messages in the thread of a reply that are before it, starting with the message that
+        started the thread, or None if the message isn't a reply to a message that can be found
+
+            Parameters
+            ----------
+            message : Message
+                One of the messages
+        """
+        guid = message.thread_originator_guid
+        if not guid:
+            return None
+        if self._store is not None:
+            thread = self._store.thread_before(message)
+            if thread is not None:
+                return thread
+            originator = self._originators.get(guid)
+        else:
+            originator = self._guids.get(guid) or self._originators.get(guid)
+        if originator is None:
+            return None
+        return originator.thread_before(message)
 
     @property
     def message_list(self) -> list:
-        """ Returns a list of messages sorted by the date of the message"""
+        """ Returns a list of messages sorted by the date of the message, which is a MessageStore if the
+        messages are compact"""
         return self._sorted_message_list
 
-    def stats(self) -> list:
+    def stats(self, me: str = 'Me') -> list:
         """ Returns a list of stats about the message list suitable for importing into a spreadsheet.
+        For a long conversation, ConversationStats keeps the same fields in columns instead.
 
          The fields returned are:
             name: The name of the person sending the message
@@ -136,35 +289,27 @@ class Messages:
             text: The text of the message
         """
 
-        result = []
-
-        for i in self._sorted_message_list:
-            if i.text is not None:
-                # Take out the carriage returns so this can be parsed by a spreadsheet
-                text = i.text.replace('\n', ' ')
-                text_len = len(i.text)
-                word_count = len(i.text.split(' '))
-            else:
-                text = ""
-                text_len = 0
-                word_count = 0
-            date = i.date
-            stats = {'name': i.name, 'date': date, 'character_count': text_len, 'word_count': word_count, 'text': text}
-            result.append(stats)
-        return result
+        return [{'name': name, 'date': date, 'character_count': text_len, 'word_count': word_count, 'text': text}
+                for (name, date, text_len, word_count, text) in stats_rows(self._database, self, me)]
 
-    def print_stats(self) -> str:
+    def print_stats(self, me: str = 'Me') -> str:
         """ Returns a string of stats about the message list suitable for importing into a spreadsheet """
 
         result = ["Name\tDate\tCharacter Count\tWord Count\tText"]
-        for i in self.stats():
-            result.append(f"{i['name']}\t{i['date']}\t{i['character_count']}\t{i['word_count']}\t{i['text']}")
+        for (name, date, text_len, word_count, text) in stats_rows(self._database, self, me):
+            result.append(f"{name}\t{date}\t{text_len}\t{word_count}\t{text}")
         return '\n'.join(result)
 
     @property
     def guids(self) -> dict:
+        """ Returns the messages by guid """
         return self._guids
 
+    @property
+    def attachment_list(self) -> Attachments:
+        """ Returns the attachments of the messages """
+        return self._attachment_list
+
     @property
     def title(self) -> str:
         return self._title
@@ -174,3 +319,186 @@ class Messages:
 
     def __len__(self) -> int:
         return len(self._sorted_message_list)
+
+
+class MessageStream:
+    """ Messages in a conversation, yielded in date order straight from the database cursor
+
+    Unlike Messages, the conversation is never fully materialized, so the output can start as soon as the
+    first rows are read. Only the most recent messages (the window) are remembered, which is what is needed to
+    link replies to the message that started their thread. The messages that started a thread before that are
+    fetched once for each window of rows, in one query. Up to a window of thread originators are kept, the least
+    recently replied to are forgotten first, and each keeps only its latest replies.
+    """
+
+    def __init__(self, database, query_type: str, title: str, numbers: list = None, chat_id: str = None,
+                 window: int = None, min_rowid: int = None, thread_replies: int = None) -> None:
+        """
+                Parameters
+                ----------
+                database : imessagedb.DB
+                    An instance of a connected database
+
+                query_type : str
+                    The type of messages, either 'person' or 'chat'
+
+                title : str
+                    The name of the conversation
+
+                numbers : list
+                    A list of numbers associated with the person, as represented in the handle data table
+
+                chat_id : str
+                    The id of the chat
+
+                window : int
+                    The number of messages to fetch at a time and to keep for threading. The default is
+                    to use the 'message window' configuration parameter
+
+                min_rowid : int
+                    Only get the messages after this one, default is all of them
+
+                thread_replies : int
+                    The number of the latest replies of a thread to keep. The default is to use the
+                    'thread replies' configuration parameter
+                """
+
+        self._database = database
+        self._query_type = query_type
+        self._numbers = numbers
+        self._chat_id = chat_id
+        self._title = title
+        self._guids = OrderedDict()
+        self._originators = OrderedDict()
+        self._row_count = None
+        self._attachment_list = None
+
+        if window is None:
+            window = self._database.control.getint('message window', fallback=10000)
+        self._window = max(window, 1)
+        if thread_replies is None:
+            thread_replies = self._database.control.getint('thread replies', fallback=100)
+        self._thread_replies = max(thread_replies, 1)
+
+        (self._select_string, self._count_string, _, self._parameters) = _build_message_query(
+            self._database, self._query_type, self._numbers, self._chat_id, min_rowid=min_rowid)
+
+    def _remember(self, message: Message) -> None:
+        """ Keep the message for threading, forgetting the oldest one once the window is full """
+        self._guids[message.guid] = message
+        if len(self._guids) > self._window:
+            (guid, oldest) = self._guids.popitem(last=False)
+            # A thread keeps going after the message that started it leaves the window
+            if oldest.thread:
+                self._keep_originator(guid, oldest)
+
+    def _keep_originator(self, guid: str, message: Message) -> None:
+        self._originators[guid] = message
+        if len(self._originators) > self._window:
+            self._originators.popitem(last=False)
+
+    def _originator(self, guid: str) -> Message:
+        """ Returns the message that started a thread, if it is kept, marking it as the most recently used """
+        originator = self._guids.get(guid)
+        if originator is None:
+            originator = self._originators.get(guid)
+            if originator is not None:
+                self._originators.move_to_end(guid)
+        return originator
+
+    def _fetch_originators(self, rows: list) -> None:
+        """ Fetch the messages that started the threads of the rows, that aren't in the window """
+        fetched = {row[1] for row in rows}
+        missing = set()
+        for row in rows:
+            guid = row[9]
+            if guid and guid not in fetched and guid not in self._guids:
+                if guid in self._originators:
+                    # It is needed again, so it shouldn't be forgotten to make room for the ones being fetched
+                    self._originators.move_to_end(guid)
+                else:
+                    missing.add(guid)
+        for (guid, message) in _fetch_messages_by_guid(self._database, missing).items():
+            self._keep_originator(guid, message)
+
+    def thread_before(self, message: Message) -> list:
+        """ Returns the messages in the thread of a reply that are before it, starting with the message that
+        started the thread, or None if the message isn't a reply to a message that can be found
+
+            Parameters
+            ----------
+            message : Message
+                One of the messages
+        """
+        guid = message.thread_originator_guid
+        if not guid:
+            return None
+        originator = self._originator(guid)
+        if originator is None:
+            return None
+        return originator.thread_before(message)
+
+    def __iter__(self):
+        skip_attachment = self._database.control.getboolean('skip attachments', fallback=False)
+
+        # Use a cursor of our own, so that the caller can query the database while we are iterating
+        cursor = self._database.cursor()
+        with profiling.stage('fetch messages'):
+            cursor.execute(self._select_string, self._parameters)
+            rows = cursor.fetchmany(self._window)
+        while rows:
+            # The attachments are loaded a window at a time, for just the messages that were fetched
+            with profiling.stage('fetch messages'):
+                self._attachment_list = Attachments(self._database, message_ids=[row[0] for row in rows])
+                self._fetch_originators(rows)
+            profiling.count('rows fetched', len(rows))
+            for row in rows:
+                (rowid, guid, date, is_from_me, handle_id, attributed_body, message_summary_info, text,
+                 reply_to_guid, thread_originator_guid, thread_originator_part, chat_id) = row
+
+                attachment_list = None
+                if not skip_attachment:
+                    if rowid in self._attachment_list.message_join:
+                        attachment_list = self._attachment_list.message_join[rowid]
+
+                new_message = Message(self._database, rowid, guid, date, is_from_me, handle_id, attributed_body,
+                                      message_summary_info, text, reply_to_guid, thread_originator_guid,
+                                      thread_originator_part, chat_id, attachment_list)
+
+                # Manage the thread
+                if thread_originator_guid:
+                    originator = self._originator(thread_originator_guid)
+                    if originator is not None:
+                        originator.add_reply(new_message, keep=self._thread_replies)
+
+                self._remember(new_message)
+                yield new_message
+            with profiling.stage('fetch messages'):
+                rows = cursor.fetchmany(self._window)
+        cursor.close()
+
+    @property
+    def guids(self) -> dict:
+        """ Returns the most recent messages by guid """
+        return self._guids
+
+    @property
+    def attachment_list(self) -> Attachments:
+        """ Returns the attachments of the messages in the current window """
+        return self._attachment_list
+
+    @property
+    def title(self) -> str:
+        return self._title
+
+    @property
+    def window(self) -> int:
+        return self._window
+
+    def __len__(self) -> int:
+        if self._row_count is None:
+            cursor = self._database.cursor()
+            cursor.execute(self._count_string, self._parameters)
+            self._row_count = cursor.fetchone()[0]
+            cursor.close()
+        return self._row_count
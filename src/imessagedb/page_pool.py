@@ -0,0 +1,76 @@
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+
+class _PendingPage:
+    """ A page of output that is collected instead of written, then rendered in the pool when it is closed """
+
+    def __init__(self, pool, filename: str, renderer) -> None:
+        self._pool = pool
+        self._filename = filename
+        self._renderer = renderer
+        self._parts = []
+
+    def write(self, part) -> None:
+        """ Add a part of the page, either a string or something for the renderer to turn into one """
+        self._parts.append(part)
+
+    def close(self) -> None:
+        self._pool.submit(self._filename, self._renderer, self._parts)
+        self._parts = None
+
+
+class PagePool:
+    """ Renders the pages of the output in a pool of processes, and writes them out in order
+
+    The pages are laid out as they would be if they were written one after another, so everything that depends on
+    the pages before, like the links between them, is already filled in. Only the parts of the page that stand on
+    their own are left to the renderer, which runs in another process. Just a few pages are rendered at a time, so
+    the memory used doesn't grow with the length of the conversation.
+    """
+
+    def __init__(self, processes: int) -> None:
+        """
+            Parameters
+            ----------
+            processes : int
+                The number of pages to render at the same time
+        """
+        # The processes are started fresh, instead of forked, so they don't inherit the threads and the database
+        #  connection of this one
+        self._executor = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn'))
+        self._pending = deque()
+        self._max_pending = processes * 2
+
+    def open(self, filename: str, renderer) -> _PendingPage:
+        """ Start a page, which is rendered and written once it is closed
+
+            Parameters
+            ----------
+            filename : str
+                The file to write the page to
+
+            renderer
+                Something that can be sent to another process, with a render method that takes the parts of
+                the page and returns the page
+        """
+        return _PendingPage(self, filename, renderer)
+
+    def submit(self, filename: str, renderer, parts: list) -> None:
+        self._pending.append((filename, self._executor.submit(renderer.render, parts)))
+        while len(self._pending) > self._max_pending:
+            self._write_next()
+
+    def _write_next(self) -> None:
+        (filename, future) = self._pending.popleft()
+        with open(filename, "w") as file_handle:
+            file_handle.write(future.result())
+
+    def wait(self) -> None:
+        """ Write the pages that are left, and stop the processes """
+        try:
+            while self._pending:
+                self._write_next()
+        finally:
+            self._executor.shutdown(cancel_futures=True)
@@ -0,0 +1,317 @@
+import contextlib
+import cProfile
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+# The profile that is being recorded, if there is one. The code that is run for every message checks this before
+#  doing anything else, so there is next to no cost when nothing is being recorded.
+active = None
+
+_NO_STAGE = contextlib.nullcontext()
+
+# The innermost frames of a thread that is waiting for something to do, which are left out of the sampled stacks
+_IDLE_FRAMES = {('threading.py', 'wait'), ('thread.py', '_worker'), ('queue.py', 'get')}
+
+
+class _Stage:
+    """ A context manager that records the time and the peak memory of a stage """
+    __slots__ = ('_profile', '_name')
+
+    def __init__(self, profile, name: str) -> None:
+        self._profile = profile
+        self._name = name
+
+    def __enter__(self):
+        self._profile._enter(self._name)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self._profile._exit()
+
+
+class Profile:
+    """ The time spent in each stage of a run, counts of the work done, and the peak memory
+
+    The stages are parts of the run, like fetching the messages or writing the html, and can be inside one another,
+    so the time of a stage includes the stages inside it. Decoding happens as the messages are output, so its time
+    is counted as it goes rather than as a stage. Only one profile is recorded at a time, from when it is started
+    until it is stopped, and it is used as a context manager:
+
+        with imessagedb.Profile() as profile:
+            ...
+        print(profile.summary())
+    """
+
+    def __init__(self, memory: bool = True) -> None:
+        """
+            Parameters
+            ----------
+            memory : bool
+                Whether to trace the memory that is allocated, with tracemalloc, to find the peak of each stage.
+                Tracing makes the run a lot slower, so the times are less accurate when it is on.
+        """
+        self._memory = memory
+        self._stages = {}
+        self._counters = Counter()
+        self._times = Counter()
+        self._lock = threading.Lock()
+        self._stacks = {}  # The stages that each thread is in, by thread id
+        self._start = None
+        self._seconds = None
+        self._peak_memory = 0
+        self._started_tracing = False
+
+    def start(self) -> None:
+        global active
+        if active is not None:
+            raise RuntimeError("Another profile is already being recorded")
+        if self._memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        if self._memory:
+            tracemalloc.reset_peak()
+        self._start = time.perf_counter()
+        active = self
+
+    def stop(self) -> None:
+        global active
+        self._seconds = time.perf_counter() - self._start
+        if self._memory:
+            # The peak is reset by each stage, so the peaks of the stages are taken into account too
+            self._peak_memory = max(self._peak_memory, tracemalloc.get_traced_memory()[1])
+            if self._started_tracing:
+                tracemalloc.stop()
+        active = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.stop()
+
+    def _stack(self) -> list:
+        return self._stacks.setdefault(threading.get_ident(), [])
+
+    def _enter(self, name: str) -> None:
+        stack = self._stack()
+        if self._memory:
+            # The peak is reset for the new stage, so the peak so far is passed on to the stage around it
+            peak = tracemalloc.get_traced_memory()[1]
+            if stack:
+                stack[-1][2] = max(stack[-1][2], peak)
+            tracemalloc.reset_peak()
+        stack.append([name, time.perf_counter(), 0])
+
+    def _exit(self) -> None:
+        (name, start, peak) = self._stack().pop()
+        seconds = time.perf_counter() - start
+        if self._memory:
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+            stack = self._stack()
+            if stack:
+                stack[-1][2] = max(stack[-1][2], peak)
+        with self._lock:
+            if self._memory:
+                self._peak_memory = max(self._peak_memory, peak)
+            stage = self._stages.get(name)
+            if stage is None:
+                stage = self._stages[name] = {'seconds': 0.0, 'calls': 0, 'peak_memory': None}
+            stage['seconds'] += seconds
+            stage['calls'] += 1
+            if self._memory:
+                stage['peak_memory'] = max(stage['peak_memory'] or 0, peak)
+
+    def stage(self, name: str) -> _Stage:
+        """ Returns a context manager that records the time of a stage
+
+            Parameters
+            ----------
+            name : str
+                The name of the stage. The times of the stages with the same name are added up.
+        """
+        return _Stage(self, name)
+
+    def count(self, name: str, amount: int = 1) -> None:
+        """ Add to a counter """
+        with self._lock:
+            self._counters[name] += amount
+
+    def add_time(self, name: str, seconds: float) -> None:
+        """ Add to the time of something that is done too often to be a stage of its own """
+        with self._lock:
+            self._times[name] += seconds
+
+    @property
+    def current_stage(self) -> str:
+        """ The innermost stage that this thread is in, or None """
+        return self.stage_of(threading.get_ident())
+
+    def stage_of(self, thread_id: int) -> str:
+        """ The innermost stage that a thread is in, or None """
+        stack = self._stacks.get(thread_id)
+        try:
+            return stack[-1][0]
+        except (TypeError, IndexError):
+            # The thread has no stages, or has just left its last one
+            return None
+
+    def report(self) -> dict:
+        """ Returns the times, counters and memory as a dictionary, which can be saved as JSON """
+        return {'seconds': self._seconds, 'peak_memory': self._peak_memory if self._memory else None,
+                'stages': self._stages, 'times': dict(self._times), 'counters': dict(self._counters)}
+
+    def write(self, filename: str) -> None:
+        """ Write the report to a JSON file """
+        with open(filename, 'w') as file:
+            json.dump(self.report(), file, indent=2)
+
+    def summary(self) -> str:
+        """ Returns the report as a table """
+        result = [f"{'Stage':<28s} {'Seconds':>10s} {'Calls':>8s} {'Peak memory':>14s}"]
+        for (name, stage) in sorted(self._stages.items(), key=lambda i: -i[1]['seconds']):
+            memory = f"{stage['peak_memory'] / 2 ** 20:>10,.1f} MiB" if stage['peak_memory'] is not None else ''
+            result.append(f"{name:<28s} {stage['seconds']:>10.3f} {stage['calls']:>8,} {memory}")
+        for (name, seconds) in sorted(self._times.items()):
+            result.append(f"{name:<28s} {seconds:>10.3f}")
+        if self._seconds is not None:
+            result.append(f"{'total':<28s} {self._seconds:>10.3f}")
+        if self._memory:
+            result.append(f"Peak memory {self._peak_memory / 2 ** 20:,.1f} MiB")
+        for (name, value) in sorted(self._counters.items()):
+            result.append(f"{name:<28s} {value:>14,}")
+        return '\n'.join(result)
+
+
+class CPUProfile:
+    """ Where the CPU time of a run goes, as cProfile statistics and as collapsed stacks for a flame graph
+
+    cProfile records every call made by the thread that starts the profile, which is written as a .pstats file
+    that can be read by pstats, snakeviz and the like. At the same time, the stacks of all the threads are sampled
+    every few milliseconds and written as a .collapsed file, one stack per line with the number of times it was
+    seen, which is the input of flamegraph.pl, speedscope and most other flame graph tools. The bottom frame of
+    each stack is the stage the thread was in, like "fetch messages" or "html output", or the name of the thread
+    if it was not in a stage, like the attachment conversion threads. Threads that are waiting for a lock or for
+    work to do are left out. The pages of split html output that are
+    rendered in other processes are not included.
+
+        with database.profile_cpu('export.pstats'):
+            ...
+    """
+
+    def __init__(self, filename: str = None, interval: float = 0.005) -> None:
+        """
+            Parameters
+            ----------
+            filename : str
+                The .pstats file to write when the profile is used as a context manager, the collapsed stacks are
+                written next to it with a .collapsed extension. Default is to not write anything.
+
+            interval : float
+                The number of seconds between samples of the stacks
+        """
+        self._filename = filename
+        self._interval = interval
+        self._profiler = cProfile.Profile()
+        self._stage_profile = None
+        self._samples = Counter()
+        self._labels = {}
+        self._stopped = threading.Event()
+        self._sampler = None
+
+    def start(self) -> None:
+        # The stages come from the active profile, so one is started, without tracing memory, if there isn't one
+        if active is None:
+            self._stage_profile = Profile(memory=False)
+            self._stage_profile.start()
+        self._stopped.clear()
+        self._sampler = threading.Thread(target=self._sample, name='cpu profile', daemon=True)
+        self._sampler.start()
+        self._profiler.enable()
+
+    def stop(self) -> None:
+        self._profiler.disable()
+        self._stopped.set()
+        self._sampler.join()
+        if self._stage_profile is not None:
+            self._stage_profile.stop()
+            self._stage_profile = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.stop()
+        if self._filename is not None:
+            self.write(self._filename)
+
+    def _label(self, code) -> str:
+        """ The name of the frame of a code object, like generate_html.py:HTMLOutput._generate_row """
+        label = self._labels.get(code)
+        if label is None:
+            # co_qualname is only there from Python 3.11
+            name = getattr(code, 'co_qualname', code.co_name)
+            label = f"{os.path.basename(code.co_filename)}:{name}".replace(';', ':')
+            self._labels[code] = label
+        return label
+
+    def _sample(self) -> None:
+        own_id = threading.get_ident()
+        while not self._stopped.wait(self._interval):
+            profile = active
+            names = None
+            for (thread_id, frame) in sys._current_frames().items():
+                if thread_id == own_id or \
+                        (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name) in _IDLE_FRAMES:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(frame.f_code)
+                    frame = frame.f_back
+                tag = profile.stage_of(thread_id) if profile is not None else None
+                if tag is None:
+                    if names is None:
+                        names = {i.ident: i.name for i in threading.enumerate()}
+                    tag = names.get(thread_id, 'thread')
+                self._samples[(tag, tuple(reversed(stack)))] += 1
+
+    @property
+    def stats(self):
+        """ The cProfile statistics, as a pstats.Stats """
+        return pstats.Stats(self._profiler)
+
+    def collapsed(self) -> list:
+        """ Returns the sampled stacks in the collapsed format, "stage;frame;frame count" """
+        stacks = Counter()
+        for ((tag, codes), samples) in self._samples.items():
+            stacks[';'.join([tag.replace(';', ':')] + [self._label(i) for i in codes])] += samples
+        return [f"{stack} {samples}" for (stack, samples) in sorted(stacks.items())]
+
+    def write(self, filename: str) -> None:
+        """ Write the cProfile statistics to the file, and the collapsed stacks to the same name with a .collapsed
+        extension """
+        self._profiler.dump_stats(filename)
+        with open(f"{os.path.splitext(filename)[0]}.collapsed", 'w') as file:
+            for line in self.collapsed():
+                file.write(f"{line}\n")
+
+
+def stage(name: str):
+    """ Returns a context manager that records the time of a stage in the active profile, or does nothing if
+    there isn't one """
+    if active is None:
+        return _NO_STAGE
+    return active.stage(name)
+
+
+def count(name: str, amount: int = 1) -> None:
+    """ Add to a counter of the active profile, if there is one """
+    if active is not None:
+        active.count(name, amount)
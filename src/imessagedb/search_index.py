@@ -0,0 +1,213 @@
+import hashlib
+import json
+import os
+import sqlite3
+
+from alive_progress import alive_bar
+from imessagedb.message import Message, _message_text
+from imessagedb.messages import _MESSAGE_COLUMNS
+from imessagedb.utils import fetch_rows
+
+
+def _match_string(query: str) -> str:
+    """ Returns the FTS5 query for a search, with each word searched for as it is, so that punctuation in it isn't
+    taken as query syntax. A word that ends in * matches the words that start with it. """
+    terms = []
+    for word in query.split():
+        prefix = word.endswith('*') and len(word) > 1
+        if prefix:
+            word = word[:-1]
+        word = word.replace('"', '""')
+        terms.append(f'"{word}"*' if prefix else f'"{word}"')
+    return ' '.join(terms)
+
+
+class SearchHit:
+    """ A message that matched a search, with the chat it is in and who sent it """
+
+    def __init__(self, message: Message, chat, handle, snippet: str) -> None:
+        """
+            Parameters
+            ----------
+            message : Message
+                The message
+
+            chat : imessagedb.Chat
+                The chat the message is in, or None if it isn't in one
+
+            handle : imessagedb.Handle
+                Who sent the message, or None if it is from me or the handle isn't known
+
+            snippet : str
+                The part of the text that matched, with the matching words in [brackets]
+        """
+        self._message = message
+        self._chat = chat
+        self._handle = handle
+        self._snippet = snippet
+
+    def __repr__(self) -> str:
+        chat = self._chat.chat_name or self._chat.chat_identifier if self._chat is not None else ''
+        who = 'Me' if self._message.is_from_me else self._handle.name if self._handle is not None else \
+            self._message.handle_id
+        return f'<{self._message.date}> [{chat}] {who}: {self._snippet}'
+
+    @property
+    def message(self) -> Message:
+        return self._message
+
+    @property
+    def chat(self):
+        return self._chat
+
+    @property
+    def handle(self):
+        return self._handle
+
+    @property
+    def snippet(self) -> str:
+        return self._snippet
+
+
+class SearchIndex:
+    """ A full text index of the messages, kept in a database of its own next to the conversion cache
+
+    The text of a lot of messages is only in attributedBody, which a LIKE on message.text can't find, so the text
+    is decoded the same way as it is for the output. The index remembers the last message in it, so bringing it up
+    to date only reads the messages that have arrived since. A message that is edited after it is indexed is found
+    by its original text.
+    """
+
+    VERSION = 1
+
+    def __init__(self, database, filename: str = None) -> None:
+        """
+            Parameters
+            ----------
+            database : imessagedb.DB
+                An instance of a connected database
+
+            filename : str
+                The file to keep the index in. The default is the 'search index' configuration parameter, or if
+                that isn't set, a file for this database in the cache directory
+        """
+        self._database = database
+        self._database_name = os.path.abspath(database.database_name)
+        if filename is None:
+            filename = self._database.control.get('search index', fallback=None)
+        if not filename:
+            key = hashlib.sha256(self._database_name.encode('utf-8')).hexdigest()[:16]
+            filename = os.path.join(self._database.control.get('cache directory', fallback='~/.cache/imessagedb'),
+                                    'search', f'{key}.db')
+        self._filename = os.path.expanduser(filename)
+        os.makedirs(os.path.dirname(self._filename) or '.', exist_ok=True)
+
+        self._connection = sqlite3.connect(self._filename)
+        self._connection.execute('create table if not exists meta (key text primary key, value)')
+        self._connection.execute("create virtual table if not exists message_text "
+                                 "using fts5(text, tokenize = 'unicode61 remove_diacritics 2')")
+        self._connection.commit()
+
+    def _get(self, key: str):
+        row = self._connection.execute('select value from meta where key = ?', (key,)).fetchone()
+        return row[0] if row is not None else None
+
+    def _set(self, key: str, value) -> None:
+        self._connection.execute('insert or replace into meta (key, value) values (?, ?)', (key, value))
+
+    def _clear(self) -> None:
+        self._connection.execute('delete from message_text')
+        self._connection.execute('delete from meta')
+        self._set('version', self.VERSION)
+        self._set('database', self._database_name)
+        self._set('last_rowid', 0)
+
+    def update(self) -> int:
+        """ Add the messages that have arrived since the index was last brought up to date, returning how many
+        were added. The index is started over if it is from another database, or if the database has gone back
+        to before the last message in it. """
+        last_rowid = self._get('last_rowid')
+        cursor = self._database.cursor()
+        cursor.execute('select max(rowid) from message')
+        max_rowid = cursor.fetchone()[0] or 0
+        if last_rowid is None or self._get('version') != self.VERSION or \
+                self._get('database') != self._database_name or last_rowid > max_rowid:
+            self._clear()
+            last_rowid = 0
+
+        added = 0
+        if max_rowid > last_rowid:
+            # Only up to the last message when the update started, as messages can arrive while it runs, and they
+            #  are added by the next one
+            parameters = {'last_rowid': last_rowid, 'max_rowid': max_rowid}
+            cursor.execute('select count(*) from message where rowid > :last_rowid and rowid <= :max_rowid',
+                           parameters)
+            row_count = cursor.fetchone()[0]
+            fetch_size = self._database.control.getint('fetch size', fallback=1000)
+            cursor.execute('select rowid, text, attributedBody from message '
+                           'where rowid > :last_rowid and rowid <= :max_rowid order by rowid', parameters)
+            batch = []
+            with alive_bar(row_count, title="Indexing Messages", stats="({rate}, eta: {eta})") as bar:
+                for (rowid, text, attributed_body) in fetch_rows(cursor, fetch_size):
+                    text = _message_text(text, attributed_body)
+                    if text:
+                        batch.append((rowid, text))
+                    if len(batch) >= fetch_size:
+                        self._connection.executemany('insert into message_text (rowid, text) values (?, ?)', batch)
+                        added += len(batch)
+                        batch = []
+                    bar()
+            self._connection.executemany('insert into message_text (rowid, text) values (?, ?)', batch)
+            added += len(batch)
+            self._set('last_rowid', max_rowid)
+        cursor.close()
+        self._connection.commit()
+        return added
+
+    def search(self, query: str, limit: int = 50) -> list:
+        """ Returns the messages that match the query, the best matches first, as a list of SearchHit
+
+            Parameters
+            ----------
+            query : str
+                The words to search for. All of them have to be in a message for it to match, and a word that
+                ends in * matches the words that start with it
+
+            limit : int
+                The most messages to return
+        """
+        match = _match_string(query)
+        if not match:
+            return []
+        snippets = self._connection.execute("select rowid, snippet(message_text, 0, '[', ']', '…', 16) "
+                                            "from message_text where message_text match :match "
+                                            "order by rank limit :limit", {'match': match, 'limit': limit}).fetchall()
+        if not snippets:
+            return []
+
+        # The messages are read from the database, so they are as they are now, and deleted ones are left out
+        cursor = self._database.cursor()
+        cursor.execute(f"select {_MESSAGE_COLUMNS}, "
+                       "(select min(chat_id) from chat_message_join cmj where cmj.message_id = message.rowid) "
+                       "from message where message.rowid in (select value from json_each(:rowids))",
+                       {'rowids': json.dumps([i[0] for i in snippets])})
+        messages = {row[0]: Message(self._database, *row, None) for row in cursor.fetchall()}
+        cursor.close()
+
+        chat_list = self._database.chats.chat_list
+        handle_list = self._database.handles.handles
+        hits = []
+        for (rowid, snippet) in snippets:
+            if rowid not in messages:
+                continue
+            message = messages[rowid]
+            handle = None if message.is_from_me else handle_list.get(message.handle_id)
+            hits.append(SearchHit(message, chat_list.get(message.chat_id), handle, snippet))
+        return hits
+
+    def close(self) -> None:
+        self._connection.close()
+
+    @property
+    def filename(self) -> str:
+        return self._filename
@@ -0,0 +1,397 @@
+import csv
+import operator
+from array import array
+from collections import Counter
+from datetime import date, datetime
+from itertools import compress, groupby, islice
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from imessagedb.message import _message_text
+from imessagedb.utils import convert_to_database_date, local_day, unix_time
+
+# The date ordinal of 1970-01-01, the first day of local_day()
+_UNIX_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+_DAYS = ['Sun', 'Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat']
+
+# The SQLite date modifiers for each period, applied to the unix time of the message in local time
+_PERIODS = {
+    'day': "date({}, 'unixepoch', 'localtime')",
+    'week': "date({}, 'unixepoch', 'localtime', 'weekday 0', '-6 days')",
+    'month': "strftime('%Y-%m', {}, 'unixepoch', 'localtime')",
+    'hour_of_week': "strftime('%w %H', {}, 'unixepoch', 'localtime')",
+    'all': "''",
+}
+
+
+def _text_length(text: str, attributed_body: bytes) -> int:
+    """ The number of characters in a message whose text is only in the attributedBody """
+    text = _message_text(text, attributed_body)
+    return len(text) if text is not None else 0
+
+
+def _sender_name(database, message, me: str) -> str:
+    if message.is_from_me:
+        return me
+    handle = database.handles.handles.get(message.handle_id)
+    return handle.name if handle is not None else str(message.handle_id)
+
+
+def stats_rows(database, messages, me: str = 'Me'):
+    """ Yields the name, date, character count, word count and text of each message, as a tuple, the way
+    Messages.stats() has them
+
+        Parameters
+        ----------
+        database : imessagedb.DB
+            An instance of a connected database
+
+        messages
+            The messages, in any form that can be iterated, like Messages, a MessageStream or a MessageStore
+
+        me : str
+            The name to use for the messages that I sent
+    """
+    names = {}
+    for message in messages:
+        key = 0 if message.is_from_me else message.handle_id
+        name = names.get(key)
+        if name is None:
+            name = names[key] = _sender_name(database, message, me)
+        text = message.text
+        if text is None:
+            yield name, message.date, 0, 0, ""
+        else:
+            # The number of words is the number of pieces between spaces, the same as len(text.split(' '))
+            yield name, message.date, len(text), text.count(' ') + 1, text.replace('\n', ' ')
+
+
+def write_stats(database, messages, file, me: str = 'Me', delimiter: str = '\t') -> int:
+    """ Writes the stats of the messages to a file as they are read, one line each, for importing into a
+    spreadsheet, and returns the number of messages. The fields are the ones that Messages.stats() returns.
+
+        Parameters
+        ----------
+        database : imessagedb.DB
+            An instance of a connected database
+
+        messages
+            The messages, in any form that can be iterated, like Messages, a MessageStream or a MessageStore
+
+        file
+            A file opened for writing text, with newline=''
+
+        me : str
+            The name to use for the messages that I sent
+
+        delimiter : str
+            A tab for TSV, or a comma for CSV
+    """
+    count = 0
+    if delimiter == '\t':
+        # The line breaks are already out of the text, and with the tabs out too nothing has to be quoted, which
+        #  is twice as fast as the csv module
+        file.write("Name\tDate\tCharacter Count\tWord Count\tText\n")
+        for (name, date_, character_count, word_count, text) in stats_rows(database, messages, me):
+            if '\t' in text:
+                text = text.replace('\t', ' ')
+            file.write(f"{name}\t{date_}\t{character_count}\t{word_count}\t{text}\n")
+            count += 1
+        return count
+
+    writer = csv.writer(file, delimiter=delimiter, lineterminator='\n')
+    writer.writerow(["Name", "Date", "Character Count", "Word Count", "Text"])
+    for row in stats_rows(database, messages, me):
+        writer.writerow(row)
+        count += 1
+    return count
+
+
+def _as_numpy(column: array):
+    """ A NumPy view of an array column, without a copy """
+    return numpy.frombuffer(column, dtype=f'i{column.itemsize}')
+
+
+class ConversationStats:
+    """ The date, sender, character count and word count of each message of a conversation, in columns
+
+    Each column is an array, with one entry per message in date order, so a conversation of any length takes a
+    few bytes a message, and the arrays can be handed to NumPy without a copy (numpy.frombuffer). The senders
+    are numbers that index the names. The measures that are made from the whole conversation, like how long
+    people take to answer, work on the columns: with array operations if NumPy is installed, and otherwise with
+    map(), compress() and groupby() over them, which only go through Python for each answer or run of days
+    rather than for each message.
+    """
+
+    def __init__(self, database, messages, me: str = 'Me') -> None:
+        """
+            Parameters
+            ----------
+            database : imessagedb.DB
+                An instance of a connected database
+
+            messages
+                The messages in date order, in any form that can be iterated, like Messages, a MessageStream or
+                a MessageStore
+
+            me : str
+                The name to use for the messages that I sent
+        """
+        self._dates = array('q')  # Seconds since 1970
+        self._days = array('l')  # The day, as a date ordinal
+        self._senders = array('l')
+        self._characters = array('l')
+        self._words = array('l')
+        self._names = []
+
+        senders = {}
+        for message in messages:
+            key = 0 if message.is_from_me else message.handle_id
+            sender = senders.get(key)
+            if sender is None:
+                sender = senders[key] = len(self._names)
+                self._names.append(_sender_name(database, message, me))
+            self._dates.append(unix_time(message.database_date))
+            self._days.append(local_day(message.database_date) + _UNIX_EPOCH_ORDINAL)
+            self._senders.append(sender)
+            text = message.text
+            if text is None:
+                self._characters.append(0)
+                self._words.append(0)
+            else:
+                self._characters.append(len(text))
+                self._words.append(text.count(' ') + 1)
+
+    def __len__(self) -> int:
+        return len(self._dates)
+
+    def reply_latency(self) -> dict:
+        """ Returns how long each person took to answer, in seconds, as an array for each name. An answer is a
+        message that follows a message from someone else. """
+        latencies = [array('q') for _ in self._names]
+        if numpy is not None:
+            senders = _as_numpy(self._senders)
+            answers = senders[1:] != senders[:-1]
+            waits = numpy.diff(_as_numpy(self._dates))[answers]
+            answered_by = senders[1:][answers]
+            for (sender, latency) in enumerate(latencies):
+                latency.frombytes(waits[answered_by == sender].astype(numpy.int64).tobytes())
+        else:
+            answers = map(operator.ne, islice(self._senders, 1, None), self._senders)
+            waits = map(operator.sub, islice(self._dates, 1, None), self._dates)
+            for (sender, wait) in compress(zip(islice(self._senders, 1, None), waits), answers):
+                latencies[sender].append(wait)
+        return dict(zip(self._names, latencies))
+
+    def messages_per_day(self) -> dict:
+        """ Returns the number of messages on each day that has any, by the date 'YYYY-MM-DD', in date order """
+        if numpy is not None:
+            (days, counts) = numpy.unique(_as_numpy(self._days), return_counts=True)
+            counts = zip(days.tolist(), counts.tolist())
+        else:
+            counts = sorted(Counter(self._days).items())
+        return {date.fromordinal(day).isoformat(): count for (day, count) in counts}
+
+    def longest_streak(self) -> tuple:
+        """ Returns the first and last dates and the number of days of the longest run of days in a row with a
+        message on each, or (None, None, 0) if there are no messages """
+        if not self._days:
+            return None, None, 0
+        if numpy is not None:
+            days = numpy.unique(_as_numpy(self._days))
+            # Where each run of days starts and ends, as indexes into the days
+            starts = numpy.flatnonzero(numpy.diff(days, prepend=days[0] - 2) != 1)
+            lengths = numpy.diff(starts, append=len(days))
+            best = int(numpy.argmax(lengths))
+            (best_start, best_length) = (int(days[starts[best]]), int(lengths[best]))
+        else:
+            days = sorted(set(self._days))
+            # Each day less its position is the same for all the days in a run
+            (best_start, best_length) = (days[0], 0)
+            position = 0
+            for (_, run) in groupby(map(operator.sub, days, range(len(days)))):
+                length = sum(1 for _ in run)
+                if length > best_length:
+                    (best_start, best_length) = (days[position], length)
+                position += length
+        return (date.fromordinal(best_start).isoformat(), date.fromordinal(best_start + best_length - 1).isoformat(),
+                best_length)
+
+    def write(self, file, delimiter: str = '\t') -> None:
+        """ Writes the columns to a file, one line a message, for importing into a spreadsheet
+
+            Parameters
+            ----------
+            file
+                A file opened for writing text, with newline=''
+
+            delimiter : str
+                A tab for TSV, or a comma for CSV
+        """
+        writer = csv.writer(file, delimiter=delimiter, lineterminator='\n')
+        writer.writerow(["Name", "Date", "Character Count", "Word Count"])
+        names = self._names
+        writer.writerows((names[sender], datetime.fromtimestamp(when).strftime('%Y-%m-%d %H:%M:%S'), characters,
+                          words) for (sender, when, characters, words) in zip(self._senders, self._dates,
+                                                                             self._characters, self._words))
+
+    @property
+    def dates(self) -> array:
+        """ The date of each message, in seconds since 1970 """
+        return self._dates
+
+    @property
+    def days(self) -> array:
+        """ The day of each message, as a date ordinal """
+        return self._days
+
+    @property
+    def senders(self) -> array:
+        """ Who sent each message, as an index into names """
+        return self._senders
+
+    @property
+    def names(self) -> list:
+        return self._names
+
+    @property
+    def characters(self) -> array:
+        return self._characters
+
+    @property
+    def words(self) -> array:
+        return self._words
+
+
+class DatabaseStats:
+    """ The number of messages, characters and attachments in the whole database, by who sent them or the chat
+    they are in, and by period
+
+    The counting is all done in SQLite, so no Message is created. Only the messages whose text is only in the
+    attributedBody are decoded, to count their characters, the same way as they are for the output.
+    """
+
+    GROUPS = ('person', 'handle', 'chat')
+    PERIODS = tuple(_PERIODS)
+
+    def __init__(self, database, group_by: str = 'person', period: str = 'month', me: str = 'Me') -> None:
+        """
+            Parameters
+            ----------
+            database : imessagedb.DB
+                An instance of a connected database
+
+            group_by : str
+                'person' for the sender, with the handles of a person in the contacts put together, 'handle' for
+                the sending handle, or 'chat' for the chat the message is in
+
+            period : str
+                'day', 'week' (starting on Monday), 'month', 'hour_of_week' (the day of the week and the hour, to
+                show when the messages are sent) or 'all'
+
+            me : str
+                The name to use for the messages that I sent
+        """
+        if group_by not in self.GROUPS:
+            raise ValueError(f"Unknown stats group {group_by}, must be one of {', '.join(self.GROUPS)}")
+        if period not in _PERIODS:
+            raise ValueError(f"Unknown stats period {period}, must be one of {', '.join(_PERIODS)}")
+        self._database = database
+        self._group_by = group_by
+        self._period = period
+        self._me = me
+        self._stats = self._get_stats()
+
+    def _get_stats(self) -> list:
+        parameters = {}
+        if self._group_by == 'chat':
+            # A message in more than one chat is counted in each of them
+            from_clause = "chat_message_join cmj join message on message.rowid = cmj.message_id"
+            group_column = "cmj.chat_id"
+            date_column = "cmj.message_date"
+        else:
+            from_clause = "message"
+            group_column = "case when message.is_from_me then 0 else message.handle_id end"
+            date_column = "message.date"
+
+        rules = []
+        start_time = self._database.control.get('start time', fallback=None)
+        end_time = self._database.control.get('end time', fallback=None)
+        if start_time:
+            parameters['start_date'] = convert_to_database_date(start_time)
+            rules.append(f"{date_column} >= :start_date")
+        if end_time:
+            parameters['end_date'] = convert_to_database_date(end_time)
+            rules.append(f"{date_column} <= :end_date")
+        where_clause = f"where {' and '.join(rules)} " if rules else ""
+
+        unix_date = f"{date_column} / 1000000000 + strftime('%s', '2001-01-01')"
+        period_column = f"coalesce({_PERIODS[self._period].format(unix_date)}, '')"
+        select_string = f"select {group_column}, {period_column}, count(*), " \
+                        "sum(case when message.text is null or message.text in ('', ' ') " \
+                        "then text_length(message.text, message.attributedBody) " \
+                        "else length(message.text) end), " \
+                        "sum(case when message.cache_has_attachments then " \
+                        "(select count(*) from message_attachment_join maj where maj.message_id = message.rowid) " \
+                        "else 0 end) " \
+                        f"from {from_clause} " \
+                        f"{where_clause}" \
+                        "group by 1, 2"
+
+        cursor = self._database.cursor()
+        cursor.connection.create_function('text_length', 2, _text_length, deterministic=True)
+        cursor.execute(select_string, parameters)
+        totals = {}
+        for (group, period, messages, characters, attachments) in cursor.fetchall():
+            key = (self._group_name(group), period)
+            total = totals.setdefault(key, [0, 0, 0])
+            total[0] += messages
+            total[1] += characters or 0
+            total[2] += attachments or 0
+        cursor.close()
+
+        return [{'name': name, 'period': self._period_name(period), 'messages': messages, 'characters': characters,
+                 'attachments': attachments}
+                for ((name, period), (messages, characters, attachments)) in sorted(totals.items())]
+
+    def _group_name(self, group: int) -> str:
+        if self._group_by == 'chat':
+            chat = self._database.chats.chat_list.get(group)
+            if chat is None:
+                return str(group)
+            return chat.chat_name or chat.chat_identifier
+        if group == 0:
+            return self._me
+        handle = self._database.handles.handles.get(group)
+        if handle is None:
+            return str(group)
+        return handle.name if self._group_by == 'person' else handle.number
+
+    def _period_name(self, period: str) -> str:
+        if self._period == 'hour_of_week' and period:
+            return f'{_DAYS[int(period[0])]} {period[2:]}:00'
+        return period
+
+    def stats(self) -> list:
+        """ Returns a list of the counts suitable for importing into a spreadsheet, sorted by name and period.
+
+         The fields returned are:
+            name: The person, handle or chat
+            period: The day, the Monday the week starts on, the month, the day of the week and the hour, or ''
+            messages: The number of messages
+            characters: The number of characters in the messages
+            attachments: The number of attachments
+        """
+        return self._stats
+
+    def print_stats(self) -> str:
+        """ Returns a string of the counts suitable for importing into a spreadsheet """
+
+        result = ["Name\tPeriod\tMessages\tCharacters\tAttachments"]
+        for i in self._stats:
+            result.append(f"{i['name']}\t{i['period']}\t{i['messages']}\t{i['characters']}\t{i['attachments']}")
+        return '\n'.join(result)
@@ -0,0 +1,399 @@
+import struct
+
+# The tags that start a value in a typedstream. Any other head byte is a small integer or, where an object or a
+#  shared string is expected, a reference to one that has already been read
+_TAG_INTEGER_2 = 0x81
+_TAG_INTEGER_4 = 0x82
+_TAG_FLOATING_POINT = 0x83
+_TAG_NEW = 0x84
+_TAG_NIL = 0x85
+_TAG_END_OF_OBJECT = 0x86
+_REFERENCE_BASE = -110  # 0x92 as a signed byte is the first reference
+
+_INTEGER_TYPES = frozenset(b'cCsSiIlLqQ')
+_UNSIGNED_TYPES = frozenset(b'CSILQ')
+
+_LITTLE_ENDIAN = (struct.Struct('<h'), struct.Struct('<i'), struct.Struct('<f'), struct.Struct('<d'))
+_BIG_ENDIAN = (struct.Struct('>h'), struct.Struct('>i'), struct.Struct('>f'), struct.Struct('>d'))
+_UNSIGNED_16 = struct.Struct('<H')
+_UNSIGNED_32 = struct.Struct('<I')
+
+# Almost every body starts with the same few archives of the class names. The bytes up to the text are the same,
+#  so once they have been read, the text of another body that starts with them can be read straight away
+_text_prefixes = {}
+_MAXIMUM_TEXT_PREFIXES = 64
+_class_names = {}
+_STRING_CLASSES = ('NSString', 'NSMutableString')
+
+
+class TypedStreamError(ValueError):
+    """ The data is not a typedstream, or uses a part of the format that isn't supported """
+
+
+class TypedObject:
+    """ An object read from a typedstream: the name of its class and the values that were archived for it """
+
+    __slots__ = ('class_name', 'values')
+
+    def __init__(self, class_name: str = None) -> None:
+        self.class_name = class_name
+        self.values = []
+
+    def __repr__(self) -> str:
+        return f'{self.class_name}({self.values})'
+
+
+class TypedStreamReader:
+    """ Reads Apple's typedstream format (NSArchiver), which is how the attributedBody of a message is stored
+
+    The stream is read in one pass over a memoryview of the data, without copying it. Objects are returned as
+    TypedObjects holding the values that the class archived, in order. A string is the bytes of a '+' value,
+    so an NSString has them as its only value.
+    """
+
+    def __init__(self, data: bytes) -> None:
+        """
+            Parameters
+            ----------
+            data : bytes
+                The typedstream
+        """
+        self._data = memoryview(data)
+        self._position = 0
+        self._shared_strings = []
+        self._objects = []
+        (self._int16, self._int32, self._float, self._double) = _LITTLE_ENDIAN
+        self._big_endian = False
+        self._read_header()
+
+    def _byte(self) -> int:
+        try:
+            value = self._data[self._position]
+        except IndexError:
+            raise TypedStreamError(f"Unexpected end of the typedstream at {self._position}") from None
+        self._position += 1
+        return value
+
+    def _bytes(self, length: int) -> memoryview:
+        end = self._position + length
+        if end > len(self._data):
+            raise TypedStreamError(f"Unexpected end of the typedstream at {self._position}")
+        value = self._data[self._position:end]
+        self._position = end
+        return value
+
+    def _unpack(self, packer: struct.Struct):
+        value = packer.unpack_from(self._data, self._position)[0] if \
+            self._position + packer.size <= len(self._data) else None
+        if value is None:
+            raise TypedStreamError(f"Unexpected end of the typedstream at {self._position}")
+        self._position += packer.size
+        return value
+
+    def _integer(self, head: int, unsigned: bool = False) -> int:
+        """ Returns the integer that starts with the head byte that was just read """
+        if head == _TAG_INTEGER_2:
+            value = self._unpack(self._int16)
+            return value & 0xffff if unsigned else value
+        if head == _TAG_INTEGER_4:
+            value = self._unpack(self._int32)
+            return value & 0xffffffff if unsigned else value
+        if unsigned or head < 0x80:
+            return head
+        return head - 0x100
+
+    def _read_header(self) -> None:
+        version = self._byte()
+        signature = bytes(self._bytes(self._integer(self._byte(), unsigned=True)))
+        if signature == b'typedstream':
+            # Big endian, from older systems
+            (self._int16, self._int32, self._float, self._double) = _BIG_ENDIAN
+            self._big_endian = True
+        elif signature != b'streamtyped':
+            raise TypedStreamError(f"Not a typedstream, the signature is {signature}")
+        if version != 4:
+            raise TypedStreamError(f"Unsupported typedstream version {version}")
+        self._system_version = self._integer(self._byte())
+
+    def _reference(self, head: int) -> int:
+        return self._integer(head) - _REFERENCE_BASE
+
+    def _read_shared_string(self) -> bytes:
+        """ Returns a string that is only stored once, like a class name or a type encoding """
+        head = self._byte()
+        if head == _TAG_NIL:
+            return None
+        if head == _TAG_NEW:
+            value = bytes(self._bytes(self._integer(self._byte(), unsigned=True)))
+            self._shared_strings.append(value)
+            return value
+        try:
+            return self._shared_strings[self._reference(head)]
+        except IndexError:
+            raise TypedStreamError(f"Reference to an unknown string at {self._position}") from None
+
+    def _read_object_reference(self, head: int):
+        try:
+            return self._objects[self._reference(head)]
+        except IndexError:
+            raise TypedStreamError(f"Reference to an unknown object at {self._position}") from None
+
+    def _read_class(self) -> str:
+        """ Returns the name of the class, reading the chain of its superclasses """
+        head = self._byte()
+        if head == _TAG_NIL:
+            return None
+        if head != _TAG_NEW:
+            return self._read_object_reference(head)
+
+        name = self._read_shared_string()
+        if name is None:
+            raise TypedStreamError(f"Missing class name at {self._position}")
+        name = _class_names.get(name) or _class_names.setdefault(name, name.decode('utf-8', errors='replace'))
+        self._objects.append(name)
+        self._integer(self._byte())  # The version of the class
+        self._read_class()  # The superclass, which ends with nil
+        return name
+
+    def _read_c_string(self) -> bytes:
+        head = self._byte()
+        if head == _TAG_NIL:
+            return None
+        if head != _TAG_NEW:
+            return self._read_object_reference(head)
+        value = self._read_shared_string()
+        self._objects.append(value)
+        return value
+
+    def read_object(self, values: bool = True) -> TypedObject:
+        """ Returns the next object in the stream
+
+            Parameters
+            ----------
+            values : bool
+                Whether to read the values of the object. If it is False, the values still have to be read by
+                read_values before anything else is read.
+        """
+        head = self._byte()
+        if head == _TAG_NIL:
+            return None
+        if head != _TAG_NEW:
+            return self._read_object_reference(head)
+
+        typed_object = TypedObject()
+        self._objects.append(typed_object)
+        typed_object.class_name = self._read_class()
+        if values:
+            self.read_values(typed_object)
+        return typed_object
+
+    def read_values(self, typed_object: TypedObject, count: int = None) -> None:
+        """ Reads the values of the object, up to the end of the object or until count groups have been read """
+        groups = 0
+        while True:
+            if self._position >= len(self._data):
+                raise TypedStreamError(f"Unexpected end of the typedstream at {self._position}")
+            if self._data[self._position] == _TAG_END_OF_OBJECT:
+                self._position += 1
+                return
+            if count is not None and groups == count:
+                return
+            self.read_group(typed_object.values)
+            groups += 1
+
+    def read_group(self, values: list) -> None:
+        """ Reads a type encoding and the values of that type, adding them to the list """
+        encoding = self._read_shared_string()
+        if encoding is None:
+            raise TypedStreamError(f"Missing type encoding at {self._position}")
+        try:
+            self._read_typed_values(encoding, 0, len(encoding), values)
+        except (IndexError, ValueError) as exp:
+            if isinstance(exp, TypedStreamError):
+                raise
+            raise TypedStreamError(f"Unsupported type encoding {encoding}") from None
+
+    def _read_typed_values(self, encoding: bytes, start: int, end: int, values: list) -> None:
+        index = start
+        while index < end:
+            index = self._read_typed_value(encoding, index, values)
+
+    def _read_typed_value(self, encoding: bytes, index: int, values: list) -> int:
+        """ Reads the value of the type at the index of the encoding, returning the index of the next type """
+        code = encoding[index]
+        if code == 0x40:  # @
+            values.append(self.read_object())
+        elif code == 0x2b:  # +
+            values.append(bytes(self._bytes(self._integer(self._byte(), unsigned=True))))
+        elif code in _INTEGER_TYPES:
+            values.append(self._integer(self._byte(), unsigned=code in _UNSIGNED_TYPES))
+        elif code == 0x66 or code == 0x64:  # f d
+            head = self._byte()
+            if head == _TAG_FLOATING_POINT:
+                values.append(self._unpack(self._float if code == 0x66 else self._double))
+            else:
+                values.append(float(self._integer(head)))
+        elif code == 0x2a or code == 0x25 or code == 0x3a:  # * % :
+            values.append(self._read_c_string())
+        elif code == 0x23:  # #
+            values.append(self._read_class())
+        elif code == 0x5b:  # [
+            index += 1
+            count_start = index
+            while chr(encoding[index]).isdigit():
+                index += 1
+            count = int(encoding[count_start:index])
+            if encoding[index] in b'cC':
+                values.append(bytes(self._bytes(count)))
+                index += 1
+            else:
+                element_end = self._type_end(encoding, index)
+                array = []
+                for _ in range(count):
+                    self._read_typed_values(encoding, index, element_end, array)
+                values.append(array)
+                index = element_end
+            if encoding[index] != 0x5d:  # ]
+                raise TypedStreamError(f"Unsupported array encoding {encoding}")
+        elif code == 0x7b:  # {
+            end = self._type_end(encoding, index)
+            fields = encoding.find(b'=', index, end) + 1 or index + 1
+            structure = []
+            self._read_typed_values(encoding, fields, end - 1, structure)
+            values.append(structure)
+            return end
+        else:
+            raise TypedStreamError(f"Unsupported type encoding {chr(code)} in {encoding}")
+        return index + 1
+
+    @staticmethod
+    def _type_end(encoding: bytes, index: int) -> int:
+        """ Returns the index after the type that starts at the index of the encoding """
+        if encoding[index] not in b'{[':
+            return index + 1
+        depth = 0
+        for position in range(index, len(encoding)):
+            if encoding[position] in b'{[':
+                depth += 1
+            elif encoding[position] in b'}]':
+                depth -= 1
+                if depth == 0:
+                    return position + 1
+        raise TypedStreamError(f"Unterminated type encoding {encoding}")
+
+    def read_root(self, values: bool = True) -> TypedObject:
+        """ Returns the object at the start of the stream """
+        encoding = self._read_shared_string()
+        if encoding != b'@':
+            raise TypedStreamError(f"Expected an object at the start of the stream, not {encoding}")
+        return self.read_object(values)
+
+
+def _string(value) -> str:
+    """ Returns the text of an NSString """
+    if isinstance(value, TypedObject) and value.values and isinstance(value.values[0], bytes):
+        return value.values[0].decode('utf-8', errors='replace')
+    if isinstance(value, bytes):
+        return value.decode('utf-8', errors='replace')
+    return value
+
+
+def _attributes(value) -> dict:
+    """ Returns an NSDictionary of attributes as a dict, with the strings and numbers converted """
+    if not isinstance(value, TypedObject) or not value.values:
+        return {}
+    result = {}
+    pairs = value.values[1:]
+    for i in range(0, len(pairs) - 1, 2):
+        item = pairs[i + 1]
+        if isinstance(item, TypedObject) and item.class_name in ('NSNumber', 'NSValue') and len(item.values) > 1:
+            item = item.values[-1]
+        else:
+            item = _string(item)
+        result[_string(pairs[i])] = item
+    return result
+
+
+def _read_text(data: bytes, position: int) -> str:
+    """ Returns the text whose length starts at the position, in a little endian stream """
+    try:
+        head = data[position]
+        if head == _TAG_INTEGER_2:
+            length = _UNSIGNED_16.unpack_from(data, position + 1)[0]
+            position += 3
+        elif head == _TAG_INTEGER_4:
+            length = _UNSIGNED_32.unpack_from(data, position + 1)[0]
+            position += 5
+        else:
+            length = head
+            position += 1
+    except (IndexError, struct.error):
+        raise TypedStreamError(f"Unexpected end of the typedstream at {position}") from None
+    if position + length > len(data):
+        raise TypedStreamError(f"Unexpected end of the typedstream at {position}")
+    return str(memoryview(data)[position:position + length], 'utf-8', 'replace')
+
+
+def attributed_body_text(data: bytes) -> str:
+    """ Returns the text of an archived NSAttributedString, reading only as far as the string
+
+        Parameters
+        ----------
+        data : bytes
+            The attributedBody of a message
+    """
+    for (length, prefixes) in _text_prefixes.items():
+        if data[:length] in prefixes:
+            return _read_text(data, length)
+
+    reader = TypedStreamReader(data)
+    root = reader.read_root(values=False)
+    if root is None:
+        return None
+
+    # The usual layout is the string object, with its text as a '+' value
+    string_object = None
+    if reader._read_shared_string() == b'@':
+        string_object = reader.read_object(values=False)
+    if not isinstance(string_object, TypedObject) or string_object.class_name not in _STRING_CLASSES or \
+            reader._read_shared_string() != b'+' or reader._big_endian:
+        # Anything else is read the long way
+        reader = TypedStreamReader(data)
+        root = reader.read_root(values=False)
+        reader.read_values(root, count=1)
+        return _string(root.values[0]) if root.values else None
+
+    if sum(len(i) for i in _text_prefixes.values()) < _MAXIMUM_TEXT_PREFIXES:
+        _text_prefixes.setdefault(reader._position, set()).add(bytes(data[:reader._position]))
+    return _read_text(data, reader._position)
+
+
+def attributed_body(data: bytes) -> tuple:
+    """ Returns the text of an archived NSAttributedString and its attribute runs
+
+        Parameters
+        ----------
+        data : bytes
+            The attributedBody of a message
+
+        The runs are a list of (length, attributes), where the length is in UTF-16 code units, the way the
+        runs are counted in the archive.
+    """
+    root = TypedStreamReader(data).read_root()
+    if root is None or not root.values:
+        return None, []
+
+    text = _string(root.values[0])
+    runs = []
+    attributes = {}
+    values = root.values[1:]
+    i = 0
+    while i + 1 < len(values):
+        (index, length) = (values[i], values[i + 1])
+        i += 2
+        # A set of attributes is only archived the first time it is used
+        if i < len(values) and isinstance(values[i], TypedObject):
+            attributes[index] = _attributes(values[i])
+            i += 1
+        runs.append((length, attributes.get(index, {})))
+    return text, runs
@@ -1,9 +1,23 @@
 """ Utility functions for the class """
 
-from datetime import datetime
+import time
+from datetime import datetime, timedelta
 
 mac_epoch_start = int(datetime(2001, 1, 1, 0, 0, 0).strftime('%s'))
 
+# The dates in the database are in nanoseconds since 2001-01-01 UTC, which is this many seconds since 1970
+_MAC_EPOCH_UTC = 978307200
+_DAY_SECONDS = 86400
+_UNKNOWN = object()
+
+# The offset of local time from UTC on each UTC day, or None for a day that it changes on
+_utc_offsets = {}
+# The date 'YYYY-MM-DD' and the abbreviated weekday of each local day
+_day_names = {}
+# The times of day are put together from these, which is quicker than formatting the numbers
+_MINUTES = [f'{i // 60:02d}:{i % 60:02d}:' for i in range(24 * 60)]
+_SECONDS = [f'{i:02d}' for i in range(60)]
+
 
 def convert_to_database_date(date_string: str) -> float:
     date_ = datetime.strptime(date_string, '%Y-%m-%d %H:%M:%S')
@@ -18,6 +32,68 @@ def convert_from_database_date(date_value: float) -> datetime:
     return datetime.fromtimestamp(epoch_date)
 
 
+def unix_time(database_date: int) -> int:
+    """ Returns the seconds since 1970 of a date from the database """
+    # Rounded towards zero, the way SQLite divides
+    if database_date >= 0:
+        return database_date // 1000000000 + _MAC_EPOCH_UTC
+    return -(-database_date // 1000000000) + _MAC_EPOCH_UTC
+
+
+def local_time(database_date: int) -> int:
+    """ Returns the seconds since 1970 of a date from the database, counted in local time
+
+    The offset from UTC is looked up once for each day, and only looked up for each date on the days that it
+    changes.
+    """
+    # unix_time(), without the call for the dates after 2001, as this is done for every message
+    if database_date >= 0:
+        seconds = database_date // 1000000000 + _MAC_EPOCH_UTC
+    else:
+        seconds = unix_time(database_date)
+    utc_day = seconds // _DAY_SECONDS
+    offset = _utc_offsets.get(utc_day, _UNKNOWN)
+    if offset is _UNKNOWN:
+        start = time.localtime(utc_day * _DAY_SECONDS).tm_gmtoff
+        end = time.localtime(utc_day * _DAY_SECONDS + _DAY_SECONDS - 1).tm_gmtoff
+        offset = _utc_offsets[utc_day] = start if start == end else None
+    if offset is None:
+        offset = time.localtime(seconds).tm_gmtoff
+    return seconds + offset
+
+
+def local_day(database_date: int) -> int:
+    """ Returns the local day of a date from the database, as the number of days since 1970-01-01 """
+    return local_time(database_date) // _DAY_SECONDS
+
+
+def day_names(day: int) -> tuple:
+    """ Returns the date 'YYYY-MM-DD' and the abbreviated weekday of a day from local_day() """
+    names = _day_names.get(day)
+    if names is None:
+        when = datetime(1970, 1, 1) + timedelta(days=day)
+        names = _day_names[day] = (f'{when.year:04d}-{when.month:02d}-{when.day:02d}', when.strftime('%a'))
+    return names
+
+
+def format_database_date(database_date: int) -> str:
+    """ Returns a date from the database as 'YYYY-MM-DD HH:MM:SS' in local time, or None if there isn't one """
+    if database_date is None:
+        return None
+    (day, second) = divmod(local_time(database_date), _DAY_SECONDS)
+    names = _day_names.get(day) or day_names(day)
+    return f'{names[0]} {_MINUTES[second // 60]}{_SECONDS[second % 60]}'
+
+
+def fetch_rows(cursor, size: int = 1000):
+    """ A generator that returns the rows of an executed query, fetching them from the cursor in batches """
+    cursor.arraysize = size
+    rows = cursor.fetchmany()
+    while rows:
+        yield from rows
+        rows = cursor.fetchmany()
+
+
 def safe_filename(filename: str) -> str:
     safe_name = filename.replace(' ', '_')
     return safe_name
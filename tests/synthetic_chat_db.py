@@ -0,0 +1,245 @@
+"""
+Creates a chat.db with the schema of the real one, filled with made up conversations, so that the whole program can
+be run and measured without a Mac. There are handles, one to one chats and group chats, with the messages spread
+over them the way they usually are, a few busy chats and a lot of quiet ones. Most of the text is in attributedBody,
+some messages have been edited, some are replies in a thread, and some have attachments, which are small files of
+random bytes in the attachment directory. The same seed always makes the same database.
+
+The tests import it directly, and the benchmarks add this directory to their path.
+
+    python tests/synthetic_chat_db.py chat.db --messages 1000000 --attachment-directory attachments
+"""
+
+import argparse
+import os
+import plistlib
+import random
+import sqlite3
+import struct
+import uuid
+
+SCHEMA_DATABASE = os.path.join(os.path.dirname(__file__), 'chat.db')
+WORDS = "hello there how are you doing today see https://example.com/page lunch dinner great ok sure " \
+        "on my way \U0001F600 café".split()
+
+# Nanoseconds since 2001-01-01 for 2019-01-01
+START_DATE = 568080000 * 1000000000
+
+ATTACHMENT_TYPES = [('image/jpeg', 'jpeg'), ('image/png', 'png'), ('video/mp4', 'mp4'), ('application/pdf', 'pdf')]
+
+
+def create_schema(connection: sqlite3.Connection) -> None:
+    """ The tables and indices of the test database. The triggers are left out, they only slow down the inserts. """
+    schema = sqlite3.connect(SCHEMA_DATABASE)
+    statements = [i[0] for i in schema.execute("select sql from sqlite_master "
+                                               "where type in ('table', 'index') and sql is not null "
+                                               "and name not like 'sqlite_%'")]
+    schema.close()
+    for statement in statements:
+        connection.execute(statement)
+
+
+def body_encoder():
+    """ Returns a function that makes an attributedBody like the one in the test database, for any text """
+    connection = sqlite3.connect(SCHEMA_DATABASE)
+    template = connection.execute("select attributedBody from message where rowid = 1602652").fetchone()[0]
+    connection.close()
+
+    start = template.index(b'\x84\x01+') + 3
+    end = template.index(b'\x86', start)
+    (prefix, suffix) = (template[:start], template[end:])
+    run_length = suffix.index(b'iI\x01') + 3
+
+    def encode(text: str) -> bytes:
+        encoded = text.encode('utf-8')
+        length = bytes([len(encoded)]) if len(encoded) < 0x80 else b'\x81' + struct.pack('<H', len(encoded))
+        units = len(text.encode('utf-16-le')) // 2
+        units = bytes([units]) if units < 0x80 else b'\x81' + struct.pack('<H', units)
+        return prefix + length + encoded + suffix[:run_length] + units + suffix[run_length + 1:]
+
+    return encode
+
+
+def _guid(rng: random.Random) -> str:
+    return str(uuid.UUID(int=rng.getrandbits(128))).upper()
+
+
+def create_chat_db(filename: str, messages: int = 100000, handles: int = 50, group_chats: int = 10,
+                   attachment_directory: str = None, attachment_rate: float = 0.02, attachment_size: int = 4096,
+                   edit_rate: float = 0.05, reply_rate: float = 0.1, plain_text_rate: float = 0.2,
+                   seed: int = 1) -> dict:
+    """ Create the database, and return the number of rows in each table
+
+        Parameters
+        ----------
+        filename : str
+            The database to create. It must not exist.
+
+        messages, handles, group_chats : int
+            The number of each. There is a one to one chat with each handle, as well as the group chats.
+
+        attachment_directory : str
+            Where to write the attachment files. Without one, there are no attachments.
+
+        attachment_rate, edit_rate, reply_rate : float
+            The share of the messages with an attachment, that have been edited, or that are replies in a thread
+
+        attachment_size : int
+            The most bytes in an attachment file
+
+        plain_text_rate : float
+            The share of the messages with their text in the text column, the way older messages are, instead of
+            only in attributedBody
+
+        seed : int
+            The seed for the random choices
+    """
+    if os.path.exists(filename):
+        raise FileExistsError(filename)
+    rng = random.Random(seed)
+    encode = body_encoder()
+    plain_summary = plistlib.dumps({'ust': True}, fmt=plistlib.FMT_BINARY)
+
+    connection = sqlite3.connect(filename)
+    create_schema(connection)
+
+    handle_rows = []
+    for i in range(1, handles + 1):
+        number = f'person{i}@example.com' if i % 3 == 0 else f'+1555{i:07d}'
+        handle_rows.append((i, number, 'iMessage' if i % 5 else 'SMS'))
+    connection.executemany("insert into handle (ROWID, id, service) values (?, ?, ?)", handle_rows)
+
+    # One to one chats have the same rowid as their handle, and the group chats come after them
+    chat_rows = []
+    participants = {}
+    for (rowid, number, service) in handle_rows:
+        chat_rows.append((rowid, f'{service};-;{number}', 45, number, service, ''))
+        participants[rowid] = [rowid]
+    for i in range(group_chats):
+        rowid = handles + i + 1
+        identifier = f'chat{rng.getrandbits(56):017d}'
+        chat_rows.append((rowid, f'iMessage;+;{identifier}', 43, identifier, 'iMessage',
+                          f'Group {i + 1}' if i % 4 else ''))
+        participants[rowid] = rng.sample(range(1, handles + 1), min(handles, rng.randint(2, 6)))
+    connection.executemany("insert into chat (ROWID, guid, style, chat_identifier, service_name, display_name) "
+                           "values (?, ?, ?, ?, ?, ?)", chat_rows)
+    connection.executemany("insert into chat_handle_join (chat_id, handle_id) values (?, ?)",
+                           ((chat, handle) for (chat, handles_) in participants.items() for handle in handles_))
+
+    # A few chats have most of the messages
+    chat_ids = [i[0] for i in chat_rows]
+    rng.shuffle(chat_ids)
+    chat_of_message = rng.choices(chat_ids, weights=[1 / (i + 1) for i in range(len(chat_ids))], k=messages)
+
+    recent = {}  # The last few messages of each chat, that can be replied to
+    date = START_DATE
+    attachment_count = 0
+    message_rows = []
+    join_rows = []
+    attachment_rows = []
+    attachment_join_rows = []
+
+    def flush():
+        connection.executemany("insert into message (ROWID, guid, text, attributedBody, message_summary_info, "
+                               "handle_id, date, is_from_me, service, reply_to_guid, thread_originator_guid, "
+                               "thread_originator_part, cache_has_attachments) "
+                               "values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", message_rows)
+        connection.executemany("insert into chat_message_join (chat_id, message_id, message_date) values (?, ?, ?)",
+                               join_rows)
+        connection.executemany("insert into attachment (ROWID, guid, original_guid, filename, mime_type, "
+                               "transfer_name, total_bytes) values (?, ?, ?, ?, ?, ?, ?)", attachment_rows)
+        connection.executemany("insert into message_attachment_join (message_id, attachment_id) values (?, ?)",
+                               attachment_join_rows)
+        for rows in (message_rows, join_rows, attachment_rows, attachment_join_rows):
+            rows.clear()
+
+    for rowid in range(1, messages + 1):
+        chat_id = chat_of_message[rowid - 1]
+        group = chat_id > handles
+        is_from_me = rng.random() < 0.45
+        if group:
+            handle_id = 0 if is_from_me else rng.choice(participants[chat_id])
+        else:
+            handle_id = chat_id
+        date += int(rng.expovariate(1 / 1200) * 1000000000) + 1000000000
+        guid = _guid(rng)
+
+        text = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 40)))
+        has_attachment = attachment_directory is not None and rng.random() < attachment_rate
+        if has_attachment:
+            text = '￼' + text
+        if rng.random() < plain_text_rate:
+            (text_column, body) = (text, None)
+        else:
+            (text_column, body) = (None, encode(text))
+        if rng.random() < edit_rate:
+            summary = plistlib.dumps({'ust': True, 'ec': {'0': [
+                {'t': encode(text[:len(text) // 2] or text), 'd': date / 1000000000 - 60},
+                {'t': body or encode(text), 'd': date / 1000000000}]}}, fmt=plistlib.FMT_BINARY)
+        else:
+            summary = plain_summary
+
+        (reply_to_guid, originator_guid, originator_part) = (None, None, None)
+        chat_recent = recent.setdefault(chat_id, [])
+        if chat_recent:
+            reply_to_guid = chat_recent[-1]
+            if rng.random() < reply_rate:
+                originator_guid = rng.choice(chat_recent)
+                reply_to_guid = originator_guid
+                originator_part = '0:0:10'
+        chat_recent.append(guid)
+        if len(chat_recent) > 20:
+            del chat_recent[0]
+
+        message_rows.append((rowid, guid, text_column, body, summary, handle_id, date, int(is_from_me),
+                             'iMessage', reply_to_guid, originator_guid, originator_part, int(has_attachment)))
+        join_rows.append((chat_id, rowid, date))
+
+        if has_attachment:
+            attachment_count += 1
+            (mime_type, extension) = ATTACHMENT_TYPES[attachment_count % len(ATTACHMENT_TYPES)]
+            attachment_guid = _guid(rng)
+            name = f'IMG_{attachment_count:05d}.{extension}'
+            directory = os.path.join(attachment_directory, attachment_guid[:2], attachment_guid[2:4],
+                                     attachment_guid)
+            os.makedirs(directory, exist_ok=True)
+            size = rng.randint(1, attachment_size)
+            with open(os.path.join(directory, name), 'wb') as file:
+                file.write(rng.randbytes(size))
+            attachment_rows.append((attachment_count, attachment_guid, attachment_guid,
+                                    os.path.join(directory, name), mime_type, name, size))
+            attachment_join_rows.append((rowid, attachment_count))
+
+        if len(message_rows) >= 10000:
+            flush()
+    flush()
+    connection.commit()
+
+    counts = {table: connection.execute(f"select count(*) from {table}").fetchone()[0]
+              for table in ('handle', 'chat', 'chat_handle_join', 'message', 'chat_message_join', 'attachment',
+                            'message_attachment_join')}
+    connection.close()
+    return counts
+
+
+def main() -> None:
+    argument_parser = argparse.ArgumentParser()
+    argument_parser.add_argument('filename', help="The database to create")
+    argument_parser.add_argument('--messages', type=int, default=100000, help="The number of messages")
+    argument_parser.add_argument('--handles', type=int, default=50, help="The number of handles")
+    argument_parser.add_argument('--group-chats', type=int, default=10, help="The number of group chats")
+    argument_parser.add_argument('--attachment-directory', help="Where to write the attachment files")
+    argument_parser.add_argument('--attachment-rate', type=float, default=0.02,
+                                 help="The share of the messages with an attachment")
+    argument_parser.add_argument('--seed', type=int, default=1, help="The seed for the random choices")
+    args = argument_parser.parse_args()
+
+    counts = create_chat_db(args.filename, messages=args.messages, handles=args.handles,
+                            group_chats=args.group_chats, attachment_directory=args.attachment_directory,
+                            attachment_rate=args.attachment_rate, seed=args.seed)
+    for (table, count) in counts.items():
+        print(f"{table:<24s} {count:>10,}")
+
+
+if __name__ == '__main__':
+    main()
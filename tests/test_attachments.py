@@ -16,3 +16,14 @@ def test_attachment():
     attachment = attachments.attachment_list[98368]
     expected_path = f"{os.environ['HOME']}/Library/Messages/Attachments/4f/15/D7CEBAED-9844-4B25-B841-F7748EA3BCAD/IMG_4911.heic"
     assert attachment.original_path == expected_path, "Unexpected value in attachment"
+
+
+def test_message_attachments():
+    database = imessagedb.DB(os.path.join(os.path.dirname(__file__), "chat.db"))
+
+    messages = database.Messages('chat', 'Test', chat_id=1441)
+    assert len(messages.attachment_list) == 0, "Loaded attachments that are not in the conversation"
+
+    messages = database.Messages('chat', 'Test', chat_id=2)
+    assert len(messages.attachment_list) == 2, "Unexpected number of attachments in the conversation"
+    assert messages.attachment_list.message_join[1602655] == [98368, 98369], "Unexpected attachment join"
@@ -0,0 +1,51 @@
+import imessagedb
+import os
+
+
+def _database():
+    database = imessagedb.DB(os.path.join(os.path.dirname(__file__), "chat.db"))
+    database.control['copy'] = 'False'
+    database.control['conversion cache'] = 'False'
+    return database
+
+
+def _read(filename: str) -> str:
+    with open(filename) as file:
+        return file.read()
+
+
+def test_batch_export(tmp_path):
+    database = _database()
+    database.HTMLOutput('Me', database.Messages('chat', 2, chat_id=2), output_file=str(tmp_path / 'chat_2_alone'))
+    database.HTMLOutput('Me', database.Messages('person', 'Test', numbers=['scripting@schore.org']),
+                        output_file=str(tmp_path / 'Test_alone'))
+
+    batch = database.BatchExport(output_directory=str(tmp_path), processes=0)
+    batch.add_chat(2)
+    batch.add_person('Test', ['scripting@schore.org'])
+    batch.add_person('Nobody', ['nobody@example.com'])
+    assert batch.run() == [(2, 1), ('Test', 2), ('Nobody', 0)], "Unexpected number of messages exported"
+
+    assert _read(tmp_path / 'chat_2.html') == _read(tmp_path / 'chat_2_alone.html'), \
+        "Chat not the same as when it is exported on its own"
+    assert _read(tmp_path / 'Test.html') == _read(tmp_path / 'Test_alone.html'), \
+        "Person not the same as when they are exported on their own"
+
+
+def test_batch_export_processes(tmp_path):
+    database = _database()
+    database.control['output type'] = 'text'
+    database.config['DISPLAY']['use text color'] = 'False'
+
+    batch = database.BatchExport(output_directory=str(tmp_path), processes=1)
+    batch.add_chat(1441)
+    assert batch.run() == [(1441, 1)], "Unexpected number of messages exported"
+    assert _read(tmp_path / 'chat_1441.txt').startswith('Exchanged 1 messages with 1441'), \
+        "Conversation not written by the process"
+
+
+def test_batch_export_same_title(tmp_path):
+    batch = _database().BatchExport(output_directory=str(tmp_path), processes=0)
+    batch.add_chat(2, title='Same')
+    batch.add_person('Same', ['scripting@schore.org'])
+    assert batch.run() == [('Same', 1), ('Same', 2)], "Conversations with the same title not counted apart"
@@ -6,3 +6,18 @@ def test_chats():
     database = imessagedb.DB(os.path.join(os.path.dirname(__file__), "chat.db"))
 
     assert len(database.chats) == 2, "Unexpected number of chats"
+
+
+def test_chat_summary():
+    database = imessagedb.DB(os.path.join(os.path.dirname(__file__), "chat.db"))
+
+    chat = database.chats.chat_list[2]
+    assert (chat.message_count, chat.participant_count, chat.attachment_bytes) == (1, 1, 2431824 + 2397479), \
+        "Unexpected chat summary"
+    message = next(iter(database.Messages('chat', 'Test', chat_id=2)))
+    assert chat.first_message_date == chat.last_message_date == message.date, "Unexpected dates"
+    assert database.chats.chat_list[1441].participant_count == 2, "Unexpected number of participants"
+
+    chats = database.chats.get_chats('participants').split('\n')
+    assert chats[0].startswith('1441:') and chats[1].startswith('2:'), "Chats not sorted by participants"
+    assert 'Messages: 1, Attachments: 4.6 MiB' in chats[1], "Chat summary not in the list"
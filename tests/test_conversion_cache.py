@@ -0,0 +1,60 @@
+import os
+import shutil
+
+import pytest
+
+from imessagedb.conversion_cache import ConversionCache
+
+
+def test_conversion_cache(tmp_path):
+    source = tmp_path / 'IMG_0001.heic'
+    source.write_bytes(b'heic')
+    (tmp_path / 'one').mkdir()
+    (tmp_path / 'two').mkdir()
+    conversions = []
+
+    def converter(original, converted):
+        conversions.append(original)
+        shutil.copyfile(original, converted)
+
+    cache = ConversionCache(str(tmp_path / 'cache'))
+    assert cache.convert(str(source), str(tmp_path / 'one' / 'IMG_0001.png'), 'HEIC.png', converter)
+    assert not cache.convert(str(source), str(tmp_path / 'two' / 'IMG_0001.png'), 'HEIC.png', converter)
+    cache.close()
+
+    # A new run uses the manifest from the last one
+    cache = ConversionCache(str(tmp_path / 'cache'))
+    assert not cache.convert(str(source), str(tmp_path / 'one' / 'IMG_0001.png'), 'HEIC.png', converter)
+    assert len(conversions) == 1, "The attachment was converted more than once"
+    assert (tmp_path / 'two' / 'IMG_0001.png').read_bytes() == b'heic', "Unexpected conversion"
+    assert not os.path.samefile(tmp_path / 'one' / 'IMG_0001.png', tmp_path / 'two' / 'IMG_0001.png'), \
+        "The conversion was linked instead of copied"
+
+    # Changing an exported file doesn't change the cache, and a changed cache entry is converted again
+    (tmp_path / 'two' / 'IMG_0001.png').write_bytes(b'edited')
+    key = cache.key(str(source), 'HEIC.png')[0]
+    with open(cache.lookup(key), 'rb') as file_handle:
+        assert file_handle.read() == b'heic', "The cache was changed through an exported file"
+    os.utime(cache.lookup(key), ns=(0, 0))
+    assert cache.lookup(key) is None, "A changed cache entry was used"
+
+    # A changed source is converted again
+    source.write_bytes(b'a different heic')
+    assert cache.convert(str(source), str(tmp_path / 'one' / 'IMG_0001.png'), 'HEIC.png', converter)
+    assert (tmp_path / 'one' / 'IMG_0001.png').read_bytes() == b'a different heic'
+
+
+def test_failed_conversion(tmp_path):
+    source = tmp_path / 'clip.mov'
+    source.write_bytes(b'mov')
+
+    def converter(original, converted):
+        with open(converted, 'w') as file_handle:
+            file_handle.write('partial')
+        raise RuntimeError('ffmpeg failed')
+
+    cache = ConversionCache(str(tmp_path / 'cache'))
+    with pytest.raises(RuntimeError):
+        cache.convert(str(source), str(tmp_path / 'clip.mov.mp4'), 'Video.mp4', converter)
+    assert not os.path.exists(tmp_path / 'clip.mov.mp4'), "A partial conversion was left at the destination"
+    assert cache.lookup(cache.key(str(source), 'Video.mp4')[0]) is None, "A failed conversion was recorded"
@@ -0,0 +1,44 @@
+import imessagedb
+import os
+from imessagedb.attachment import Attachment
+from imessagedb.conversion_pool import ConversionPool
+
+
+def _attachment(database, tmp_path, rowid: int, name: str) -> Attachment:
+    source = tmp_path / 'Library' / 'Attachments' / f'{rowid:02d}'
+    source.mkdir(parents=True)
+    (source / name).write_bytes(b'attachment')
+    copy_directory = tmp_path / 'copy'
+    copy_directory.mkdir(exist_ok=True)
+    return Attachment(database, rowid, f'~/Library/Attachments/{rowid:02d}/{name}', 'application/pdf',
+                      copy=True, copy_directory=str(copy_directory), home_directory=str(tmp_path))
+
+
+def test_pool(tmp_path):
+    database = imessagedb.DB(os.path.join(os.path.dirname(__file__), "chat.db"))
+    good = _attachment(database, tmp_path, 1, 'good.pdf')
+    bad = _attachment(database, tmp_path, 2, 'bad.pdf')
+    os.remove(bad.original_path)
+
+    pool = ConversionPool(jobs=2)
+    pool.submit(good)
+    pool.submit(good)
+    pool.submit(bad)
+    pool.wait()
+
+    assert os.path.exists(good.destination_path), "Attachment was not copied"
+    assert pool.processed == 1, "Unexpected number of processed attachments"
+    assert [i[0] for i in pool.failures] == [bad], "Failed attachment was not reported"
+
+
+def test_pool_copies_changed(tmp_path):
+    database = imessagedb.DB(os.path.join(os.path.dirname(__file__), "chat.db"))
+    database.control['copy mode'] = 'copy'
+    attachment = _attachment(database, tmp_path, 1, 'changed.pdf')
+
+    assert attachment.process(), "Attachment was not copied"
+    assert not attachment.process(), "Unchanged attachment was copied again"
+    with open(attachment.original_path, 'ab') as file:
+        file.write(b' and more')
+    assert attachment.process(), "Changed attachment was not copied again"
+    assert open(attachment.destination_path, 'rb').read() == b'attachment and more', "Unexpected copy"
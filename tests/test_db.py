@@ -1,6 +1,9 @@
 import configparser
+import sqlite3
+import threading
 
 import imessagedb
+import pytest
 import os
 
 
@@ -15,3 +18,54 @@ def test_configuration():
     assert isinstance(config, configparser.ConfigParser), \
         "Expected return of database.config to be of class 'configparser.ConfigParser'"
     assert config['CONTROL'], "Expected the CONTROL section to be in the configuration"
+
+
+def test_lazy_loading():
+    database = imessagedb.DB(os.path.join(os.path.dirname(__file__), "chat.db"))
+    assert database._chats is None, "Chats loaded before they were used"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(database.chats)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert all(i is results[0] for i in results), "Chats loaded more than once"
+
+
+@pytest.mark.parametrize('mode', ['readwrite', 'readonly', 'immutable', 'snapshot', 'snapshot file'])
+def test_open_mode(mode):
+    config = configparser.ConfigParser()
+    config.read_string(imessagedb.DEFAULT_CONFIGURATION)
+    if mode == 'snapshot file':
+        mode = 'snapshot'
+        config.set('CONTROL', 'snapshot in memory', 'False')
+    config.set('CONTROL', 'open mode', mode)
+
+    database = imessagedb.DB(os.path.join(os.path.dirname(__file__), "chat.db"), config=config)
+    assert len(database.Messages('person', 'Test', numbers=['scripting@schore.org'])) == 2, \
+        f"Unexpected number of messages when opened {mode}"
+    assert database.connection.execute('pragma temp_store').fetchone()[0] == 2, "temp_store was not set"
+    if mode in ('readonly', 'immutable'):
+        with pytest.raises(sqlite3.OperationalError):
+            database.connection.execute('delete from message')
+
+    snapshot = database._snapshot_filename
+    database.disconnect()
+    assert snapshot is None or not os.path.exists(snapshot), "The snapshot was not removed"
+
+
+def test_snapshot_failure(tmp_path, monkeypatch):
+    config = configparser.ConfigParser()
+    config.read_string(imessagedb.DEFAULT_CONFIGURATION)
+    config.set('CONTROL', 'open mode', 'snapshot')
+    config.set('CONTROL', 'snapshot in memory', 'False')
+    filename = tmp_path / 'chat.db'
+    filename.write_bytes(b'not a database' * 100)
+    snapshots = tmp_path / 'snapshots'
+    snapshots.mkdir()
+    monkeypatch.setattr('tempfile.tempdir', str(snapshots))
+
+    with pytest.raises(sqlite3.DatabaseError):
+        imessagedb.DB(str(filename), config=config)
+    assert list(snapshots.iterdir()) == [], "The snapshot was not removed when it couldn't be made"
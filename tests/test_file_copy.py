@@ -0,0 +1,56 @@
+import os
+import pytest
+from imessagedb.file_copy import copy_file, up_to_date
+
+
+def _source(tmp_path):
+    source = tmp_path / 'source.jpeg'
+    source.write_bytes(b'attachment')
+    os.utime(source, (1000000000, 1000000000))
+    return str(source)
+
+
+def test_copy_modes(tmp_path):
+    source = _source(tmp_path)
+
+    destination = str(tmp_path / 'copy.jpeg')
+    assert copy_file(source, destination, 'copy') == 'copy', "Not copied"
+    assert not os.path.samefile(source, destination), "Copy is the same file"
+    assert os.path.getmtime(destination) == 1000000000, "Modification time not copied"
+
+    destination = str(tmp_path / 'hardlink.jpeg')
+    assert copy_file(source, destination, 'hardlink') == 'hardlink', "Not hard linked"
+    assert os.path.samefile(source, destination), "Hard link is a different file"
+
+    destination = str(tmp_path / 'symlink.jpeg')
+    assert copy_file(source, destination, 'symlink') == 'symlink', "Not symlinked"
+    assert os.readlink(destination) == source, "Symlink to the wrong file"
+
+    # Reflinks aren't supported by every file system, in which case it is copied
+    destination = str(tmp_path / 'reflink.jpeg')
+    assert copy_file(source, destination, 'reflink') in ('reflink', 'copy'), "Not copied"
+    assert copy_file(source, str(tmp_path / 'auto.jpeg'), 'auto') in ('reflink', 'copy'), "Not copied"
+    assert not os.path.samefile(source, str(tmp_path / 'auto.jpeg')), "Auto made a hard link"
+    for name in ('copy', 'hardlink', 'symlink', 'reflink', 'auto'):
+        assert (tmp_path / f'{name}.jpeg').read_bytes() == b'attachment', f"Unexpected contents with {name}"
+        assert up_to_date(source, str(tmp_path / f'{name}.jpeg')), f"Not up to date with {name}"
+    assert not os.path.exists(tmp_path / 'auto.jpeg.partial'), "Partial file left behind"
+
+    with pytest.raises(ValueError):
+        copy_file(source, destination, 'teleport')
+
+
+def test_up_to_date(tmp_path):
+    source = _source(tmp_path)
+    destination = str(tmp_path / 'copy.jpeg')
+
+    assert not up_to_date(source, destination), "Missing destination is up to date"
+    copy_file(source, destination, 'copy')
+    assert up_to_date(source, destination), "Copy not up to date"
+
+    # The same size, but a newer original
+    with open(source, 'wb') as file:
+        file.write(b'ATTACHMENT')
+    assert not up_to_date(source, destination), "Changed original is up to date"
+    copy_file(source, destination, 'copy')
+    assert open(destination, 'rb').read() == b'ATTACHMENT', "Changed original not copied"
@@ -0,0 +1,105 @@
+import imessagedb
+from imessagedb.export_state import ExportState
+import os
+import shutil
+import sqlite3
+
+
+def _database(filename):
+    database = imessagedb.DB(filename)
+    database.control['skip attachments'] = 'True'
+    database.control['incremental'] = 'True'
+    return database
+
+
+def test_incremental_export(tmp_path):
+    full_database = os.path.join(os.path.dirname(__file__), "chat.db")
+    numbers = ['scripting@schore.org']
+    output_file = str(tmp_path / 'Test')
+
+    # An older copy of the database, before the last message arrived
+    old_database = str(tmp_path / 'old.db')
+    shutil.copyfile(full_database, old_database)
+    connection = sqlite3.connect(old_database)
+    for (trigger,) in connection.execute("select name from sqlite_master where type = 'trigger'").fetchall():
+        connection.execute(f'drop trigger {trigger}')
+    connection.execute('delete from chat_message_join where message_id = 1602655')
+    connection.execute('delete from message where rowid = 1602655')
+    connection.commit()
+    connection.close()
+
+    database = _database(old_database)
+    database.HTMLOutput('Me', database.Messages('person', 'Test', numbers=numbers), output_file=output_file)
+    database.disconnect()
+
+    database = _database(full_database)
+    state = ExportState.load(output_file, ExportState.settings(database, 'Test'))
+    assert state is not None, "The state of the last export was not saved"
+    assert state.last_rowid == 1602652, "Unexpected last message in the saved state"
+
+    messages = database.Messages('person', 'Test', numbers=numbers, min_rowid=state.last_rowid)
+    assert [i.rowid for i in messages] == [1602655], "Unexpected new messages"
+    database.HTMLOutput('Me', messages, output_file=output_file, state=state)
+    database.disconnect()
+
+    with open(f'{output_file}.html') as file_handle:
+        html = file_handle.read()
+    assert html.count('</html>') == 1, "The last export was not picked up where it left off"
+    assert html.count('<div id="file_summary">') == 1, "The header was written twice"
+    assert 'el.innerHTML = "Exchanged 2 total messages with Test.' in html, "The summary was not updated"
+    assert ExportState.load(output_file, ExportState.settings(database, 'Test')).last_rowid == 1602655
+
+
+def test_retain_html(tmp_path):
+    database = imessagedb.DB(os.path.join(os.path.dirname(__file__), "chat.db"))
+    database.control['skip attachments'] = 'True'
+    messages = database.Messages('person', 'Test', numbers=['scripting@schore.org'])
+
+    streamed = database.HTMLOutput('Me', messages, output_file=str(tmp_path / 'streamed'))
+    assert repr(streamed) == '', "A copy of the html was kept while writing it to a file"
+
+    database.control['retain html'] = 'True'
+    retained = database.HTMLOutput('Me', messages, output_file=str(tmp_path / 'retained'))
+    assert 'It’s a lovely day!' in repr(retained), "The html was not kept"
+
+    with open(tmp_path / 'streamed.html') as streamed_file, open(tmp_path / 'retained.html') as retained_file:
+        assert streamed_file.read() == retained_file.read(), "Keeping a copy changed the html that was written"
+
+
+def test_page_processes(tmp_path):
+    # A conversation over a few weeks, with threads, so it is split into a lot of pages
+    filename = str(tmp_path / 'chat.db')
+    shutil.copyfile(os.path.join(os.path.dirname(__file__), "chat.db"), filename)
+    connection = sqlite3.connect(filename)
+    for (trigger,) in connection.execute("select name from sqlite_master where type = 'trigger'").fetchall():
+        connection.execute(f'drop trigger {trigger}')
+    for i in range(1, 301):
+        date = 706020175298411392 + i * 3 * 3600 * 1000000000
+        connection.execute("insert into message (ROWID, guid, text, handle_id, is_from_me, date, "
+                           "thread_originator_guid) values (?, ?, ?, 2, ?, ?, ?)",
+                           (i, f'guid-{i}', f'Message {i} https://example.com', i % 2, date,
+                            f'guid-{i - 3}' if i % 7 == 0 else None))
+        connection.execute("insert into chat_message_join (chat_id, message_id, message_date) values (2, ?, ?)",
+                           (i, date))
+    connection.commit()
+    connection.close()
+
+    outputs = []
+    for processes in ('0', '2'):
+        database = imessagedb.DB(filename)
+        database.control['skip attachments'] = 'True'
+        database.control['page processes'] = processes
+        database.config['DISPLAY']['split output'] = '20'
+        output_directory = tmp_path / processes
+        output_directory.mkdir()
+        database.HTMLOutput('Me', database.Messages('person', 'Test', numbers=['scripting@schore.org']),
+                            output_file=str(output_directory / 'Test'))
+        database.disconnect()
+        pages = {}
+        for page in sorted(output_directory.iterdir()):
+            with open(page) as file_handle:
+                pages[page.name] = file_handle.read().replace(str(output_directory), '')
+        outputs.append(pages)
+
+    assert len(outputs[0]) > 10, "The output was not split into pages"
+    assert outputs[1] == outputs[0], "The pages rendered in processes are not the same"
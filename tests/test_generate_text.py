@@ -0,0 +1,18 @@
+import imessagedb
+import io
+import os
+
+
+def test_text_output_file():
+    database = imessagedb.DB(os.path.join(os.path.dirname(__file__), "chat.db"))
+    database.config['DISPLAY']['use text color'] = 'False'
+    messages = database.Messages('person', 'Test', numbers=['scripting@schore.org', '+17324475860'])
+
+    kept = database.TextOutput('Me', messages)
+    output_file = io.StringIO()
+    streamed = database.TextOutput('Me', messages, output_file=output_file)
+    assert output_file.getvalue() == f'{kept}\n', "Lines written to the file differ from the kept text"
+    assert str(streamed) == '', "Lines kept when they were written to the file"
+
+    streamed.save()
+    assert output_file.getvalue() == f'{kept}\n', "Text written to the file again"
@@ -1 +1,43 @@
 from imessagedb import db
+import imessagedb
+import os
+import sys
+import time
+
+import pytest
+
+DATABASE = os.path.join(os.path.dirname(__file__), "chat.db")
+
+# For each command line mode, the parts of the database that it should load
+CLI_MODES = [
+    (['--get_handles'], {'_handles'}),
+    (['--get_chats'], {'_handles', '_chats'}),
+    (['--handle', 'scripting@schore.org', '-t', 'text'], {'_handles'}),
+    (['--chat', '1441', '-t', 'text'], {'_handles', '_chats'}),
+]
+
+
+@pytest.mark.parametrize("arguments, expected", CLI_MODES)
+def test_cli_startup(arguments, expected, tmp_path, monkeypatch, record_property):
+    databases = []
+
+    class RecordingDB(db.DB):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            databases.append(self)
+
+    monkeypatch.setattr(imessagedb, 'DB', RecordingDB)
+    monkeypatch.setattr(sys, 'argv', ['imessagedb', '--database', DATABASE, '-c', str(tmp_path / 'config.ini'),
+                                      '-o', str(tmp_path)] + arguments)
+
+    start = time.perf_counter()
+    try:
+        imessagedb.run()
+    except SystemExit:
+        pass
+    elapsed = time.perf_counter() - start
+    record_property('startup_seconds', elapsed)
+    print(f"{' '.join(arguments)}: {elapsed:.3f}s")
+
+    loaded = {i for i in ('_handles', '_chats', '_attachment_list') if getattr(databases[0], i) is not None}
+    assert loaded == expected, f"Unexpected parts of the database loaded for {arguments}"
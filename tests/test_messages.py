@@ -0,0 +1,166 @@
+import imessagedb
+from imessagedb.messages import _build_message_query
+from imessagedb.utils import day_names, format_database_date, local_day
+from datetime import datetime
+import os
+import sqlite3
+from synthetic_chat_db import create_schema
+
+
+def test_messages():
+    database = imessagedb.DB(os.path.join(os.path.dirname(__file__), "chat.db"))
+
+    messages = database.Messages('chat', 'Test', chat_id=2)
+    assert len(messages) == 1, "Unexpected number of messages"
+
+
+def test_iter_messages():
+    database = imessagedb.DB(os.path.join(os.path.dirname(__file__), "chat.db"))
+
+    messages = database.Messages('person', 'Test', numbers=['scripting@schore.org'])
+    stream = database.iter_messages('person', 'Test', numbers=['scripting@schore.org'], window=1)
+    assert len(stream) == len(messages), "Unexpected number of streamed messages"
+    assert [i.rowid for i in stream] == [i.rowid for i in messages], "Streamed messages not in date order"
+    assert len(stream.guids) == 1, "Stream kept more messages than the window"
+
+
+def test_fetch_size():
+    database = imessagedb.DB(os.path.join(os.path.dirname(__file__), "chat.db"))
+    database.control['fetch size'] = '1'
+
+    messages = database.Messages('person', 'Test', numbers=['scripting@schore.org'])
+    assert len(messages) == 2, "Unexpected number of messages when fetching one row at a time"
+
+
+def _synthetic_database(filename):
+    """ A database with the schema of chat.db, a person with two chats and a message that is in both """
+    connection = sqlite3.connect(filename)
+    create_schema(connection)
+    connection.executemany("insert into handle (ROWID, id, service) values (?, ?, ?)",
+                           [(1, 'person@example.com', 'iMessage'), (2, '+15555550100', 'SMS')])
+    connection.executemany("insert into chat (ROWID, guid, chat_identifier) values (?, ?, ?)",
+                           [(1, 'chat-1', 'person@example.com'), (2, 'chat-2', '+15555550100')])
+    connection.executemany("insert into chat_handle_join (chat_id, handle_id) values (?, ?)", [(1, 1), (2, 2)])
+    connection.executemany("insert into message (ROWID, guid, text, handle_id, date) values (?, ?, ?, 1, ?)",
+                           [(i, f'guid-{i}', f'Message {i}', i * 1000000000) for i in range(1, 101)])
+    connection.executemany("insert into chat_message_join (chat_id, message_id, message_date) values (?, ?, ?)",
+                           [(1 + i % 2, i, i * 1000000000) for i in range(1, 101)] + [(1, 1, 1000000000)])
+    connection.commit()
+    connection.close()
+
+
+def test_query_plan(tmp_path):
+    filename = str(tmp_path / 'chat.db')
+    _synthetic_database(filename)
+    database = imessagedb.DB(filename)
+    database.control['start time'] = '2001-01-01 00:00:10'
+    database.control['end time'] = '2001-01-01 00:01:00'
+
+    for (query_type, arguments) in (('person', {'numbers': ['person@example.com', '+15555550100']}),
+                                    ('chat', {'chat_id': 1})):
+        (select_string, count_string, rowid_string, parameters) = \
+            _build_message_query(database, query_type, min_rowid=20, **arguments)
+        for query in (select_string, count_string, rowid_string):
+            plan = [i[3] for i in database.connection.execute(f'explain query plan {query}', parameters)]
+            assert not any(i.startswith('SCAN') for i in plan), f"Table scan in the {query_type} query: {plan}"
+            assert not any('SUBQUERY' in i for i in plan), f"Subquery in the {query_type} query: {plan}"
+
+    # The message in both chats is only returned once, and is counted once
+    database.control['start time'] = ''
+    database.control['end time'] = ''
+    messages = database.Messages('person', 'Test', numbers=['person@example.com', '+15555550100'])
+    assert [i.rowid for i in messages] == list(range(1, 101)), "Unexpected messages"
+    assert len(database.iter_messages('person', 'Test', numbers=['person@example.com', '+15555550100'])) == 100
+
+
+def test_lazy_decoding():
+    database = imessagedb.DB(os.path.join(os.path.dirname(__file__), "chat.db"))
+
+    message = database.Messages('chat', 'Test', chat_id=1441).message_list[0]
+    assert message.attributed_body is not None, "The body was decoded before it was used"
+    assert message.text == 'iMessagedb test: Let’s set something up ', "Unexpected text"
+    assert message.attributed_body is None, "The body was kept after it was decoded"
+    assert message.message_summary_info is not None, "The edits were decoded before they were used"
+    assert message.edits == [], "Unexpected edits"
+    assert message.message_summary_info is None, "The summary info was kept after it was decoded"
+
+
+def test_compact_messages():
+    database = imessagedb.DB(os.path.join(os.path.dirname(__file__), "chat.db"))
+    messages = database.Messages('person', 'Test', numbers=['scripting@schore.org'])
+    database.control['compact messages'] = 'True'
+    compact = database.Messages('person', 'Test', numbers=['scripting@schore.org'])
+
+    assert len(compact) == len(messages), "Unexpected number of compact messages"
+    for (message, stored) in zip(messages, compact):
+        assert (stored.rowid, stored.guid, stored.date, stored.is_from_me, stored.handle_id, stored.text) == \
+               (message.rowid, message.guid, message.date, message.is_from_me, message.handle_id, message.text), \
+               "Compact message differs"
+        assert stored == message, "Compact message is not equal to the message with the same rowid"
+        assert compact.guids[message.guid].rowid == message.rowid, "Compact message not found by guid"
+    assert 'no-such-guid' not in compact.guids, "Unexpected guid found"
+
+
+def test_thread_before(tmp_path):
+    filename = str(tmp_path / 'chat.db')
+    _synthetic_database(filename)
+    # A thread started by a message in the other chat, before the start time
+    connection = sqlite3.connect(filename)
+    connection.execute("update message set thread_originator_guid = 'guid-5' where ROWID % 10 = 0 and ROWID > 10")
+    connection.commit()
+    connection.close()
+
+    database = imessagedb.DB(filename)
+    database.control['start time'] = '2001-01-01 00:00:10'
+    for compact in ('False', 'True'):
+        database.control['compact messages'] = compact
+        messages = database.Messages('chat', 'Test', chat_id=1)
+        threads = {i.rowid: messages.thread_before(i) for i in messages}
+        assert [i.rowid for i in threads[40]] == [5, 20, 30], "Unexpected thread before a reply"
+        assert [i.rowid for i in threads[20]] == [5], "Unexpected thread before the first reply"
+        assert threads[12] is None, "Unexpected thread for a message that isn't a reply"
+
+    stream = database.iter_messages('chat', 'Test', chat_id=1, window=2)
+    assert [[j.rowid for j in stream.thread_before(i)] for i in stream if i.rowid == 100] == \
+           [[5, 20, 30, 40, 50, 60, 70, 80, 90]], "Unexpected thread when streaming"
+
+
+def test_stream_thread_originators(tmp_path):
+    filename = str(tmp_path / 'chat.db')
+    _synthetic_database(filename)
+    # Three threads started in the other chat, with the first one replied to the most
+    connection = sqlite3.connect(filename)
+    for (originator, replies) in (('guid-5', (12, 20, 30, 40)), ('guid-7', (16, )), ('guid-9', (24, ))):
+        connection.executemany("update message set thread_originator_guid = ? where ROWID = ?",
+                               [(originator, i) for i in replies])
+    connection.commit()
+    connection.close()
+
+    database = imessagedb.DB(filename)
+    database.control['start time'] = '2001-01-01 00:00:10'
+    # The thread that is still being replied to is kept over the one that was fetched before it
+    stream = database.iter_messages('chat', 'Test', chat_id=1, window=2)
+    assert [[j.rowid for j in stream.thread_before(i)] for i in stream if i.rowid == 40] == \
+           [[5, 12, 20, 30]], "Thread originator forgotten while it was still replied to"
+
+    stream = database.iter_messages('chat', 'Test', chat_id=1, window=2, thread_replies=3)
+    threads = {i.rowid: [j.rowid for j in stream.thread_before(i)] for i in stream if i.rowid in (20, 40)}
+    assert threads == {20: [5, 12], 40: [5, 20, 30]}, "Unexpected replies kept"
+
+
+def test_message_dates():
+    database = imessagedb.DB(os.path.join(os.path.dirname(__file__), "chat.db"))
+    messages = database.Messages('person', 'Test', numbers=['scripting@schore.org', '+17324475860'])
+
+    cursor = database.cursor()
+    for message in messages:
+        assert isinstance(message.database_date, int), "Date not kept as it is in the database"
+        cursor.execute("select datetime(date/1000000000 + strftime('%s', '2001-01-01'), 'unixepoch', 'localtime') "
+                       "from message where rowid = ?", (message.rowid, ))
+        assert message.date == cursor.fetchone()[0], "Date not formatted the way SQLite does"
+        assert day_names(local_day(message.database_date))[0] == message.date[:10], "Unexpected day"
+    cursor.close()
+    assert [i.database_date for i in messages] == sorted(i.database_date for i in messages), "Messages not sorted"
+    assert format_database_date(0) == datetime.fromtimestamp(978307200).strftime('%Y-%m-%d %H:%M:%S'), \
+        "Unexpected start of the dates"
+    assert format_database_date(None) is None, "Missing date formatted"
@@ -0,0 +1,73 @@
+import imessagedb
+from imessagedb import profiling
+from imessagedb.message import _convert_attributed_body
+import json
+import os
+
+
+def test_profile(tmp_path):
+    database = imessagedb.DB(os.path.join(os.path.dirname(__file__), "chat.db"))
+    database.control['copy'] = 'False'
+
+    with imessagedb.Profile() as profile:
+        assert profiling.active is profile, "Profile not active"
+        messages = database.Messages('person', 'Test', numbers=['scripting@schore.org'])
+        database.HTMLOutput('Me', messages, output_file=str(tmp_path / 'test'))
+    assert profiling.active is None, "Profile still active"
+
+    report = profile.report()
+    for stage in ('fetch messages', 'fetch attachments', 'link threads', 'html output', 'wait for attachments'):
+        assert report['stages'][stage]['calls'] == 1, f"Stage {stage} not recorded"
+    assert report['stages']['fetch messages']['seconds'] >= report['stages']['fetch attachments']['seconds'], \
+        "Stage inside another not included in its time"
+    assert report['counters']['rows fetched'] == 2, "Rows not counted"
+    assert report['counters']['attributedBody decoded'] >= 1, "Decoding not counted"
+    assert report['counters']['html bytes written'] == os.path.getsize(tmp_path / 'test.html'), \
+        "Bytes written not counted"
+    assert report['peak_memory'] >= max(i['peak_memory'] for i in report['stages'].values()), \
+        "Peak memory less than the peak of a stage"
+
+    profile.write(str(tmp_path / 'profile.json'))
+    with open(tmp_path / 'profile.json') as file:
+        assert json.load(file)['counters'] == report['counters'], "Report not written"
+    assert 'html output' in profile.summary(), "Stage not in the summary"
+
+
+def test_profile_off():
+    assert profiling.stage('anything') is profiling.stage('something else'), "Stage recorded without a profile"
+    profiling.count('anything')
+
+    with imessagedb.Profile(memory=False) as profile:
+        with profiling.stage('outer'):
+            with profiling.stage('inner'):
+                profiling.count('things', 2)
+    assert profile.report()['counters'] == {'things': 2}, "Counter not recorded"
+    assert profile.report()['peak_memory'] is None, "Memory traced when it shouldn't be"
+    assert set(profile.report()['stages']) == {'outer', 'inner'}, "Nested stages not recorded"
+
+
+def test_profile_decode_failure():
+    with imessagedb.Profile(memory=False) as profile:
+        assert _convert_attributed_body(b'not a typedstream') is None, "Garbage decoded"
+    report = profile.report()
+    assert report['counters'] == {'attributedBody not decoded': 1}, "Failed decode counted as decoded"
+    assert report['times']['decode attributedBody'] > 0, "Failed decode not timed"
+
+
+def test_cpu_profile(tmp_path):
+    database = imessagedb.DB(os.path.join(os.path.dirname(__file__), "chat.db"))
+    database.control['copy'] = 'False'
+
+    with database.profile_cpu(str(tmp_path / 'export.pstats'), interval=0.0001) as profile:
+        for _ in range(20):
+            messages = database.Messages('person', 'Test', numbers=['scripting@schore.org'])
+            database.HTMLOutput('Me', messages, output_file=str(tmp_path / 'test'))
+    assert profiling.active is None, "Profile for the stages still active"
+
+    assert any(i[2] == '_convert_attributed_body' for i in profile.stats.stats), "Decoding not profiled"
+    with open(tmp_path / 'export.collapsed') as file:
+        lines = file.read().splitlines()
+    assert lines == profile.collapsed() and lines, "Collapsed stacks not written"
+    (stack, samples) = lines[0].rsplit(' ', 1)
+    assert int(samples) > 0 and ';' in stack, "Unexpected collapsed stack"
+    assert any(i.startswith(('fetch messages;', 'html output;')) for i in lines), "Stacks not tagged with the stage"
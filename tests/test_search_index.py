@@ -0,0 +1,94 @@
+import configparser
+import imessagedb
+from imessagedb.search_index import _match_string
+import os
+import shutil
+import sqlite3
+
+
+def _config(tmp_path):
+    config = configparser.ConfigParser()
+    config.read_string(imessagedb.DEFAULT_CONFIGURATION)
+    config.set('CONTROL', 'cache directory', str(tmp_path / 'cache'))
+    return config
+
+
+def test_match_string():
+    assert _match_string('lovely day') == '"lovely" "day"', "Words not quoted"
+    assert _match_string('lov*') == '"lov"*', "Prefix search not kept"
+    assert _match_string('say "hi" OR') == '"say" """hi""" "OR"', "Query syntax not escaped"
+
+
+def test_search(tmp_path):
+    database = imessagedb.DB(os.path.join(os.path.dirname(__file__), "chat.db"), config=_config(tmp_path))
+
+    hits = database.search('LOVELY')
+    assert [i.message.rowid for i in hits] == [1602655], "Unexpected search results"
+    assert hits[0].chat.rowid == 2, "Search result not in its chat"
+    assert hits[0].message.is_from_me and hits[0].handle is None, "Unexpected sender of the search result"
+    assert '[lovely]' in hits[0].snippet, "Match not marked in the snippet"
+    assert database.search('lov*')[0].message.rowid == 1602655, "Prefix search not matched"
+    assert database.search('lovely night') == [], "Search matched a message without all the words"
+    database.disconnect()
+
+
+def test_search_incremental(tmp_path):
+    filename = str(tmp_path / 'chat.db')
+    shutil.copy(os.path.join(os.path.dirname(__file__), "chat.db"), filename)
+    config = _config(tmp_path)
+
+    database = imessagedb.DB(filename, config=config)
+    assert len(database.search('lovely')) == 1, "Unexpected search results"
+    database.disconnect()
+
+    connection = sqlite3.connect(filename)
+    for (name,) in connection.execute("select name from sqlite_master where type = 'trigger'").fetchall():
+        connection.execute(f'drop trigger {name}')
+    connection.execute("insert into message (guid, text, handle_id, is_from_me, date) "
+                       "values ('search-test', 'Another lovely evening', 2, 0, 706000000000000000)")
+    connection.commit()
+    connection.close()
+
+    database = imessagedb.DB(filename, config=config)
+    index = imessagedb.search_index.SearchIndex(database)
+    assert index.update() == 1, "Index not kept between runs, or the new message not added"
+    assert index.update() == 0, "Message added to the index twice"
+    index.close()
+    hits = database.search('lovely')
+    assert len(hits) == 2, "Unexpected search results after the update"
+    hit = [i for i in hits if i.message.guid == 'search-test'][0]
+    assert hit.chat is None and hit.handle.number == 'scripting@schore.org', \
+        "Unexpected context for a message that isn't in a chat"
+    database.disconnect()
+
+
+def test_search_update_new_message(tmp_path):
+    filename = str(tmp_path / 'chat.db')
+    shutil.copy(os.path.join(os.path.dirname(__file__), "chat.db"), filename)
+    connection = sqlite3.connect(filename)
+    for (name,) in connection.execute("select name from sqlite_master where type = 'trigger'").fetchall():
+        connection.execute(f'drop trigger {name}')
+    connection.commit()
+
+    class ArrivingCursor(sqlite3.Cursor):
+        """ A message arrives right after the update finds the last one """
+        found_last = False
+
+        def execute(self, *args):
+            if self.found_last:
+                self.found_last = False
+                connection.execute("insert into message (guid, text, handle_id, is_from_me, date) "
+                                   "values ('search-test', 'A lovely surprise', 2, 0, 706000000000000000)")
+                connection.commit()
+            self.found_last = args[0].startswith('select max(rowid)')
+            return super().execute(*args)
+
+    database = imessagedb.DB(filename, config=_config(tmp_path))
+    index = imessagedb.search_index.SearchIndex(database)
+    database.cursor = lambda: database.connection.connection.cursor(ArrivingCursor)
+    index.update()
+    database.cursor = lambda: database.connection.connection.cursor()
+    assert index.update() == 1, "Message that arrived during the update not added by the next one"
+    index.close()
+    database.disconnect()
+    connection.close()
@@ -0,0 +1,81 @@
+import imessagedb
+from imessagedb.message import Message
+from imessagedb.stats import ConversationStats, write_stats
+from datetime import datetime
+import io
+import os
+
+
+def test_database_stats():
+    database = imessagedb.DB(os.path.join(os.path.dirname(__file__), "chat.db"))
+
+    stats = database.DatabaseStats('chat', 'day').stats()
+    assert [(i['name'], i['messages'], i['characters'], i['attachments']) for i in stats] == \
+           [('chat78806267822556021', 1, 40, 0), ('scripting@schore.org', 1, 20, 2)], "Unexpected chat stats"
+
+    stats = database.DatabaseStats('person', 'all', me='Someone').stats()
+    assert stats == [{'name': 'Someone', 'period': '', 'messages': 2, 'characters': 60, 'attachments': 2}], \
+        "Unexpected person stats"
+
+    # The characters are counted from the decoded text, the same as the messages
+    messages = database.Messages('person', 'Test', numbers=['scripting@schore.org'])
+    assert stats[0]['characters'] == sum(len(i.text or '') for i in messages), "Characters not counted the same"
+
+
+def test_database_stats_time():
+    database = imessagedb.DB(os.path.join(os.path.dirname(__file__), "chat.db"))
+    database.control['start time'] = '2023-05-18 00:00:00'
+
+    assert database.DatabaseStats('handle', 'hour_of_week').stats() == [], "Start time not used"
+
+
+def _conversation():
+    rows = [('2023-01-01 10:00:00', 1, 'hi there'), ('2023-01-01 10:05:00', 0, 'hello'),
+            ('2023-01-02 09:00:00', 0, 'a\nb'), ('2023-01-02 09:01:00', 1, None), ('2023-01-05 08:00:00', 1, 'ok')]
+    # The dates in the database are in nanoseconds since 2001-01-01 UTC
+    dates = [(int(datetime.fromisoformat(i[0]).timestamp()) - 978307200) * 1000000000 for i in rows]
+    return [Message(None, rowid, f'guid-{rowid}', dates[rowid], is_from_me, 2, None, None, text, None, None, None, 1,
+                    None) for (rowid, (_, is_from_me, text)) in enumerate(rows)]
+
+
+def test_conversation_stats():
+    database = imessagedb.DB(os.path.join(os.path.dirname(__file__), "chat.db"))
+    stats = ConversationStats(database, _conversation())
+
+    assert len(stats) == 5 and stats.names == ['Me', 'Scripting@Schore.Org'], "Unexpected senders"
+    assert list(stats.senders) == [0, 1, 1, 0, 0], "Unexpected sender column"
+    assert list(stats.characters) == [8, 5, 3, 0, 2] and list(stats.words) == [2, 1, 1, 0, 1], \
+        "Unexpected counts"
+    assert {i: list(j) for (i, j) in stats.reply_latency().items()} == \
+           {'Me': [60], 'Scripting@Schore.Org': [300]}, "Unexpected reply latency"
+    assert stats.messages_per_day() == {'2023-01-01': 2, '2023-01-02': 2, '2023-01-05': 1}, \
+        "Unexpected messages per day"
+    assert stats.longest_streak() == ('2023-01-01', '2023-01-02', 2), "Unexpected longest streak"
+
+    output = io.StringIO(newline='')
+    stats.write(output, delimiter=',')
+    assert output.getvalue().split('\n')[1] == 'Me,2023-01-01 10:00:00,8,2', "Unexpected stats written"
+
+
+def test_write_stats():
+    database = imessagedb.DB(os.path.join(os.path.dirname(__file__), "chat.db"))
+    output = io.StringIO(newline='')
+
+    assert write_stats(database, _conversation(), output) == 5, "Unexpected number of rows written"
+    lines = output.getvalue().split('\n')
+    assert lines[0] == 'Name\tDate\tCharacter Count\tWord Count\tText', "Unexpected header"
+    assert lines[3] == 'Scripting@Schore.Org\t2023-01-02 09:00:00\t3\t1\ta b', "Unexpected row"
+
+    output = io.StringIO(newline='')
+    write_stats(database, _conversation(), output, delimiter=',')
+    assert output.getvalue().split('\n')[1] == 'Me,2023-01-01 10:00:00,8,2,hi there', "Unexpected CSV row"
+
+
+def test_conversation_stats_without_numpy(monkeypatch):
+    database = imessagedb.DB(os.path.join(os.path.dirname(__file__), "chat.db"))
+    stats = ConversationStats(database, _conversation())
+    measures = (stats.reply_latency(), stats.messages_per_day(), stats.longest_streak())
+
+    monkeypatch.setattr('imessagedb.stats.numpy', None)
+    assert (stats.reply_latency(), stats.messages_per_day(), stats.longest_streak()) == measures, \
+        "Measures differ without NumPy"
@@ -0,0 +1,35 @@
+import imessagedb
+from imessagedb.stats import ConversationStats
+import sqlite3
+from synthetic_chat_db import create_chat_db
+
+
+def test_synthetic_chat_db(tmp_path):
+    filename = str(tmp_path / 'chat.db')
+    counts = create_chat_db(filename, messages=300, handles=6, group_chats=2,
+                            attachment_directory=str(tmp_path / 'source'), attachment_rate=0.1)
+    assert counts['message'] == counts['chat_message_join'] == 300, "Unexpected number of messages"
+    assert counts['chat'] == 8 and counts['attachment'] > 0, "Unexpected chats or attachments"
+
+    connection = sqlite3.connect(filename)
+    (chat_id, count) = connection.execute("select chat_id, count(*) from chat_message_join group by chat_id "
+                                          "order by count(*) desc limit 1").fetchone()
+    connection.close()
+
+    database = imessagedb.DB(filename)
+    database.control['skip attachments'] = 'True'
+    messages = database.Messages('chat', 'Busiest', chat_id=chat_id)
+    assert len(messages) == count, "Unexpected number of messages in the chat"
+    assert all(i.text for i in messages), "Text not decoded from attributedBody"
+
+    output_file = str(tmp_path / 'Busiest')
+    database.HTMLOutput('Me', messages, output_file=output_file)
+    with open(f'{output_file}.html') as file_handle:
+        html = file_handle.read()
+    assert f'Exchanged {count} total messages with Busiest.' in html, "Unexpected summary in the html"
+
+    stats = ConversationStats(database, messages)
+    assert len(stats) == count and sum(stats.messages_per_day().values()) == count, "Unexpected conversation stats"
+    assert sum(i['messages'] for i in database.DatabaseStats('chat', 'all').stats()) == 300, \
+        "Unexpected database stats"
+    database.disconnect()
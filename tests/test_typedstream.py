@@ -0,0 +1,95 @@
+import os
+import sqlite3
+import struct
+
+import pytest
+
+from imessagedb.typedstream import attributed_body, attributed_body_text, TypedStreamError
+
+
+def _integer(value: int) -> bytes:
+    if 0 <= value < 0x80:
+        return bytes([value])
+    if value < 0x10000:
+        return b'\x81' + struct.pack('<H', value)
+    return b'\x82' + struct.pack('<I', value)
+
+
+def _archive(text: str, runs: list) -> bytes:
+    """ Archive an NSAttributedString the way Messages does, with a part number attribute for each run
+
+    The runs are a list of (attribute set, length), and an attribute set is only archived the first time.
+    """
+    body = text.encode('utf-8')
+    # Objects: 0 the string, 1 NSAttributedString, 2 NSObject, 3 the NSString, 4 NSString
+    # Shared strings: 0 @, 1 NSAttributedString, 2 NSObject, 3 NSString, 4 +, 5 iI, 6 NSDictionary, 7 i
+    data = b'\x04\x0bstreamtyped\x81\xe8\x03\x84\x01@' \
+           b'\x84\x84\x84\x12NSAttributedString\x00\x84\x84\x08NSObject\x00\x85' \
+           b'\x92\x84\x84\x84\x08NSString\x01\x94\x84\x01+' + _integer(len(body)) + body + b'\x86'
+    objects = 5
+    dictionary_class = None
+    archived = set()
+    for (index, (attribute_set, length)) in enumerate(runs):
+        data += (b'\x84\x02iI' if index == 0 else b'\x97') + _integer(attribute_set) + _integer(length)
+        if attribute_set in archived:
+            continue
+        archived.add(attribute_set)
+        data += b'\x92\x84'
+        if dictionary_class is None:
+            dictionary_class = objects + 1
+            data += b'\x84\x84\x0cNSDictionary\x00\x94\x84\x01i'
+            objects += 2
+        else:
+            data += bytes([0x92 + dictionary_class]) + b'\x99'
+            objects += 1
+        value = f'{attribute_set}'.encode('utf-8')
+        data += b'\x01\x92\x84\x96\x96\x0fPartAttributeId\x86\x92\x84\x96\x96' + _integer(len(value)) + value + \
+                b'\x86\x86'
+        objects += 2
+    return data + b'\x86'
+
+
+def _corpus() -> list:
+    """ The bodies in the test database, and bodies that the old split heuristic got wrong """
+    corpus = []
+    connection = sqlite3.connect(os.path.join(os.path.dirname(__file__), "chat.db"))
+    for (attributed_body_data, ) in connection.execute("select attributedBody from message order by rowid"):
+        corpus.append(attributed_body_data)
+    connection.close()
+    expected = [('iMessagedb test: Let’s set something up ', [40]),
+                ('￼￼It’s a lovely day!', [1, 1, 18])]
+
+    texts = [('Short', [(1, 5)]),
+             ('A message that is longer than 127 bytes, so its length takes more than one byte. ' * 3, [(1, 246)]),
+             ('x' * 70000, [(1, 70000)]),
+             ('Emoji \U0001F600 and accents éè take more than one byte', [(1, 40)]),
+             ('Words like NSString, NSNumber and NSDictionary are just text', [(1, 60)]),
+             ('Bytes that look like tags \x01\x02\x00 \x86 are kept', [(1, 15), (2, 10), (1, 12)])]
+    for (text, runs) in texts:
+        corpus.append(_archive(text, runs))
+        expected.append((text, [i[1] for i in runs]))
+    return list(zip(corpus, expected))
+
+
+@pytest.mark.parametrize('data, expected', _corpus())
+def test_attributed_body(data, expected):
+    (text, run_lengths) = expected
+    assert attributed_body_text(data) == text, "Unexpected text"
+
+    (full_text, runs) = attributed_body(data)
+    assert full_text == text, "Unexpected text when reading the runs"
+    assert [i[0] for i in runs] == run_lengths, "Unexpected attribute runs"
+
+
+def test_attributed_body_errors():
+    data = _archive('Hello', [(1, 5)])
+    with pytest.raises(TypedStreamError):
+        attributed_body_text(b'bplist00')
+    with pytest.raises(TypedStreamError):
+        attributed_body_text(data[:40])
+    with pytest.raises(TypedStreamError):
+        attributed_body(data[:-10])
+    # Only the stream up to the end of the text is read for the text
+    for end in range(data.index(b'Hello') + len('Hello')):
+        with pytest.raises(TypedStreamError):
+            attributed_body_text(data[:end])